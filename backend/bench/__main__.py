@@ -0,0 +1,98 @@
+from __future__ import annotations
+
+import argparse
+import sys
+from pathlib import Path
+
+from .generators import ROLE_MIXES
+from .suite import DEFAULT_THRESHOLD, PRESETS, STAGES, compare, environment_mismatch, load, run_suite, save
+
+
+def format_seconds(value: float) -> str:
+    if value >= 1:
+        return f"{value:.2f}s"
+    if value >= 1e-3:
+        return f"{value * 1e3:.2f}ms"
+    return f"{value * 1e6:.1f}us"
+
+
+def print_comparison(baseline: dict, current: dict, threshold: float) -> int:
+    mismatch = environment_mismatch(baseline, current)
+    if mismatch:
+        print(f"warning: baseline recorded with a different {', '.join(mismatch)}, timings are not comparable")
+    rows, regressions = compare(baseline, current, threshold)
+    for row in rows:
+        if row["ratio"] is None:
+            print(f"  {row['key']:<40} {'-':>10} {format_seconds(row['current']):>10}  new")
+            continue
+        flag = "REGRESSION" if row["key"] in regressions else ""
+        print(
+            f"  {row['key']:<40} {format_seconds(row['baseline']):>10} "
+            f"{format_seconds(row['current']):>10} {row['ratio']:>6.2f}x {flag}"
+        )
+    if regressions:
+        print(f"{len(regressions)} regression(s) above {threshold:.0%}")
+        return 1
+    print(f"no regressions above {threshold:.0%}")
+    return 0
+
+
+def cmd_run(args: argparse.Namespace) -> int:
+    if args.people or args.networks or args.mixes:
+        scenarios = [
+            (people, networks, mix)
+            for people in args.people or [1000]
+            for networks in args.networks or [5]
+            for mix in args.mixes or ["mixed"]
+        ]
+    else:
+        scenarios = PRESETS[args.preset]
+
+    def progress(key: str, result: dict) -> None:
+        line = f"  {key:<40} best {format_seconds(result['best']):>10}  median {format_seconds(result['median']):>10}"
+        if "lines_per_sec" in result:
+            line += f"  {result['lines_per_sec']:,.0f} lines/sec"
+        print(line)
+
+    current = run_suite(scenarios, args.stages, args.repeat, args.seed, progress)
+    if args.output:
+        save(current, args.output)
+        print(f"saved {args.output}")
+    if args.baseline:
+        return print_comparison(load(args.baseline), current, args.threshold)
+    return 0
+
+
+def cmd_compare(args: argparse.Namespace) -> int:
+    return print_comparison(load(args.baseline), load(args.current), args.threshold)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m bench", description="core pipeline benchmarks")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("run", help="run the benchmarks")
+    run.add_argument("--preset", choices=sorted(PRESETS), default="quick")
+    run.add_argument("--people", type=int, nargs="+")
+    run.add_argument("--networks", type=int, nargs="+")
+    run.add_argument("--mixes", choices=sorted(ROLE_MIXES), nargs="+")
+    run.add_argument("--stages", choices=STAGES, nargs="+", default=STAGES)
+    run.add_argument("--repeat", type=int, default=5)
+    run.add_argument("--seed", type=int, default=1)
+    run.add_argument("--output", type=Path)
+    run.add_argument("--baseline", type=Path)
+    run.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+    run.set_defaults(func=cmd_run)
+
+    diff = commands.add_parser("compare", help="compare two result files")
+    diff.add_argument("baseline", type=Path)
+    diff.add_argument("current", type=Path)
+    diff.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+    diff.set_defaults(func=cmd_compare)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,64 @@
+from __future__ import annotations
+
+import random
+from typing import Dict, List
+
+from core.models import PersonInput
+
+ROLE_MIXES: Dict[str, List[List[str]]] = {
+    "og": [["OG"]],
+    "os": [["OS"]],
+    "mediatore": [["MEDIATORE"]],
+    "direttore": [["DIRETTORE"]],
+    "mixed": [["OG"], ["OS"], ["MEDIATORE"], ["OS", "OG"], ["MEDIATORE", "OG"], ["DIRETTORE"], []],
+}
+
+ROLE_LINES: Dict[str, str] = {
+    "OG": "Ruolo: Operatore Generico",
+    "OS": "Ruolo: OS",
+    "MEDIATORE": "Qualifica: MEDIATORE",
+    "DIRETTORE": "DIRETTORE",
+}
+
+
+def network_names(count: int) -> List[str]:
+    return [f"RETE{idx + 1}" for idx in range(count)]
+
+
+def payroll_text(blocks: int, seed: int = 1, people: int = 500, mix: str = "mixed") -> str:
+    rng = random.Random(seed)
+    role_sets = ROLE_MIXES[mix]
+    parts = []
+    for idx in range(blocks):
+        roles = rng.choice(role_sets)
+        parts.append(
+            "\n".join(
+                [
+                    f"BUSTA PAGA {idx + 1}",
+                    f"Nome: Dipendente {idx % people}",
+                    f"Ore ordinarie: {rng.randint(20, 170)},00",
+                    f"Ore straordinarie: {rng.randint(0, 20)},50",
+                    f"Reperibilita: {rng.choice([0, 8, 16])}",
+                    f"Costo orario: {rng.randint(10, 25)},{rng.randint(0, 99):02d}",
+                    *[ROLE_LINES[role] for role in roles],
+                    "Note: cedolino mensile elaborato",
+                ]
+            )
+        )
+    return "\n".join(parts)
+
+
+def roster(size: int, seed: int = 1, mix: str = "mixed") -> List[PersonInput]:
+    rng = random.Random(seed)
+    role_sets = ROLE_MIXES[mix]
+    return [
+        PersonInput(
+            name=f"PERSON {idx}",
+            ore_ordinarie=rng.choice([0, 7.5, 40, 80.5, 120, 163.3]),
+            ore_straordinarie=rng.choice([0, 0, 3.2, 12]),
+            ore_reperibilita=rng.choice([0, 0, 8, 20.5]),
+            costo_orario=rng.choice([12.5, 15.0, 18.75]),
+            roles=list(rng.choice(role_sets)),
+        )
+        for idx in range(size)
+    ]
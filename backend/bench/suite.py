@@ -0,0 +1,173 @@
+from __future__ import annotations
+
+import gc
+import json
+import platform
+import statistics
+import time
+from functools import cached_property
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from core.allocation import allocate_hours, allocate_with_ledger
+from core.excel_export import build_consuntivo_excel, build_export_zip, build_template_excel
+from core.parsing import merge_people, parse_text_block
+
+from .generators import ROLE_MIXES, network_names, payroll_text, roster
+
+YEAR = 2025
+MONTH = 3
+MIN_SAMPLE = 0.05
+DEFAULT_THRESHOLD = 0.2
+
+STAGES = ["parse", "merge", "allocate", "pivot", "consuntivo", "template", "zip"]
+
+PRESETS: Dict[str, List[Tuple[int, int, str]]] = {
+    "quick": [(10, 5, "mixed"), (1000, 5, "mixed"), (1000, 50, "mixed")]
+    + [(1000, 5, mix) for mix in ROLE_MIXES if mix != "mixed"],
+    "full": [(people, networks, "mixed") for people in (10, 1000, 10000, 100000) for networks in (5, 50, 500)]
+    + [(10000, 5, mix) for mix in ROLE_MIXES if mix != "mixed"],
+}
+
+
+class Scenario:
+    def __init__(self, people: int, networks: int, mix: str, seed: int = 1) -> None:
+        self.size = people
+        self.networks = network_names(networks)
+        self.mix = mix
+        self.seed = seed
+
+    @property
+    def name(self) -> str:
+        return f"p{self.size}-n{len(self.networks)}-{self.mix}"
+
+    @cached_property
+    def text(self) -> str:
+        return payroll_text(2 * self.size, self.seed, self.size, self.mix)
+
+    @cached_property
+    def lines(self) -> int:
+        return self.text.count("\n") + 1
+
+    @cached_property
+    def parsed(self):
+        return parse_text_block(self.text)
+
+    @cached_property
+    def people(self):
+        return roster(self.size, self.seed, self.mix)
+
+    @cached_property
+    def allocation(self):
+        return allocate_with_ledger(self.people, self.networks, YEAR, MONTH, consume_all=True, medico_total=0.0)
+
+    def stage(self, stage: str) -> Callable[[], object]:
+        if stage == "parse":
+            text = self.text
+            return lambda: parse_text_block(text)
+        if stage == "merge":
+            parsed = self.parsed
+            return lambda: merge_people(parsed)
+        if stage == "allocate":
+            people, networks = self.people, self.networks
+            return lambda: allocate_hours(people, networks, YEAR, MONTH, True, 0.0)
+        table, ledger = self.allocation
+        if stage == "pivot":
+            return ledger.pivot
+        if stage == "consuntivo":
+            return lambda: build_consuntivo_excel(table, YEAR, MONTH).close()
+        if stage == "template":
+            return lambda: build_template_excel(table, YEAR, MONTH, None, self.networks)
+        if stage == "zip":
+            return lambda: build_export_zip(table, YEAR, MONTH, None, networks=self.networks)
+        raise ValueError(f"Unknown stage {stage}")
+
+
+def measure(fn: Callable[[], object], repeat: int) -> Dict[str, float]:
+    fn()
+    loops = 1
+    while True:
+        elapsed = _timed(fn, loops)
+        if elapsed >= MIN_SAMPLE or loops >= 1 << 20:
+            break
+        loops *= 2
+    samples = [elapsed / loops] + [_timed(fn, loops) / loops for _ in range(repeat - 1)]
+    return {
+        "best": min(samples),
+        "median": statistics.median(samples),
+        "loops": loops,
+        "repeat": repeat,
+    }
+
+
+def _timed(fn: Callable[[], object], loops: int) -> float:
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        started = time.perf_counter()
+        for _ in range(loops):
+            fn()
+        return time.perf_counter() - started
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def run_suite(
+    scenarios: Iterable[Tuple[int, int, str]],
+    stages: Iterable[str] = STAGES,
+    repeat: int = 5,
+    seed: int = 1,
+    progress: Optional[Callable[[str, Dict[str, float]], None]] = None,
+) -> dict:
+    stages = list(stages)
+    results: Dict[str, Dict[str, float]] = {}
+    for people, networks, mix in scenarios:
+        scenario = Scenario(people, networks, mix, seed)
+        for stage in stages:
+            key = f"{stage}/{scenario.name}"
+            results[key] = measure(scenario.stage(stage), repeat)
+            if stage == "parse":
+                results[key]["lines_per_sec"] = scenario.lines / results[key]["best"]
+            if progress is not None:
+                progress(key, results[key])
+    return {
+        "meta": {
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "platform": platform.platform(),
+            "repeat": repeat,
+            "seed": seed,
+        },
+        "results": results,
+    }
+
+
+def compare(baseline: dict, current: dict, threshold: float = DEFAULT_THRESHOLD) -> Tuple[List[dict], List[str]]:
+    rows: List[dict] = []
+    regressions: List[str] = []
+    for key, result in current["results"].items():
+        previous = baseline["results"].get(key)
+        if previous is None:
+            rows.append({"key": key, "baseline": None, "current": result["best"], "ratio": None})
+            continue
+        ratio = result["best"] / previous["best"] if previous["best"] else float("inf")
+        rows.append({"key": key, "baseline": previous["best"], "current": result["best"], "ratio": ratio})
+        if ratio > 1 + threshold:
+            regressions.append(key)
+    return rows, regressions
+
+
+def environment_mismatch(baseline: dict, current: dict) -> List[str]:
+    keys = ("python", "machine", "platform")
+    return [key for key in keys if baseline.get("meta", {}).get(key) != current.get("meta", {}).get(key)]
+
+
+def load(path: Path) -> dict:
+    return json.loads(Path(path).read_text(encoding="utf-8"))
+
+
+def save(data: dict, path: Path) -> None:
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(data, indent=2, sort_keys=True) + "\n", encoding="utf-8")
@@ -2,9 +2,12 @@ from __future__ import annotations
 
 import calendar
 from dataclasses import asdict
-from typing import Dict, List, Tuple
+from functools import lru_cache
+from types import MappingProxyType
+from typing import Dict, Iterable, Iterator, List, Mapping, Optional, Tuple
 
-from .models import AllocationRow, DemandSummary, PersonInput
+from .ledger import DemandLedger
+from .models import AllocationRow, AllocationTable, AllocationTuple, DemandSummary, PersonInput, RowBuffer
 from .parsing import normalize_name
 
 ROLE_DEFAULTS = {
@@ -18,7 +21,18 @@ ROLE_DEFAULTS = {
 
 REPERIBILITA_COST = 1.5
 
+# Bump when the allocation rules (fallbacks, finalize rows) or the result
+# classes (AllocationTable, DemandSummary, DemandLedger) change, so cached
+# results and exports are not reused across deploys.
+ALLOCATION_VERSION = 1
 
+NETWORKS = ["RETE1", "RETE2", "RETE3", "RETE4", "RETE5"]
+
+FIRST_YEAR = 2000
+LAST_YEAR = 2100
+
+
+@lru_cache(maxsize=4096)
 def month_meta(year: int, month: int) -> Tuple[int, float]:
     days = calendar.monthrange(year, month)[1]
     weeks = days / 7.0
@@ -31,22 +45,56 @@ def round_up_step(value: float, step: float = 0.5) -> float:
     return (int((value + step - 1e-9) / step)) * step
 
 
-def compute_demands(networks: List[str], year: int, month: int) -> Dict[str, Dict[str, float]]:
+RoleConfig = Tuple[Tuple[str, str, float, float, Optional[str]], ...]
+
+
+def role_config_key() -> RoleConfig:
+    return tuple(
+        (role, cfg["type"], cfg["value"], cfg["chunk"], cfg["fallback"]) for role, cfg in ROLE_DEFAULTS.items()
+    )
+
+
+def demand_table(networks: List[str], year: int, month: int) -> Mapping[str, Mapping[str, float]]:
+    return _demand_table(tuple(networks), year, month, role_config_key())
+
+
+@lru_cache(maxsize=4096)
+def _demand_table(
+    networks: Tuple[str, ...],
+    year: int,
+    month: int,
+    config: RoleConfig,
+) -> Mapping[str, Mapping[str, float]]:
     days, weeks = month_meta(year, month)
-    demands: Dict[str, Dict[str, float]] = {}
-    for role, cfg in ROLE_DEFAULTS.items():
-        role_demands: Dict[str, float] = {}
-        for network in networks:
-            base = cfg["value"]
-            if cfg["type"] == "PER_DAY":
-                total = base * days
-            elif cfg["type"] == "PER_WEEK":
-                total = base * weeks
-            else:
-                total = base
-            role_demands[network] = round_up_step(total, 0.5)
-        demands[role] = role_demands
-    return demands
+    demands: Dict[str, Mapping[str, float]] = {}
+    for role, kind, base, _chunk, _fallback in config:
+        if kind == "PER_DAY":
+            total = base * days
+        elif kind == "PER_WEEK":
+            total = base * weeks
+        else:
+            total = base
+        value = round_up_step(total, 0.5)
+        demands[role] = MappingProxyType({network: value for network in networks})
+    return MappingProxyType(demands)
+
+
+def compute_demands(networks: List[str], year: int, month: int) -> Dict[str, Dict[str, float]]:
+    table = demand_table(networks, year, month)
+    return {role: dict(role_demands) for role, role_demands in table.items()}
+
+
+def warm_demand_cache(
+    networks: List[str] = NETWORKS,
+    first_year: int = FIRST_YEAR,
+    last_year: int = LAST_YEAR,
+) -> int:
+    count = 0
+    for year in range(first_year, last_year + 1):
+        for month in range(1, 13):
+            demand_table(networks, year, month)
+            count += 1
+    return count
 
 
 def director_distribution(hours: float, networks: List[str]) -> Dict[str, float]:
@@ -64,63 +112,117 @@ def allocate_hours(
     month: int,
     consume_all: bool = True,
     medico_total: float = 0.0,
-) -> Tuple[List[AllocationRow], List[DemandSummary]]:
-    demands = compute_demands(networks, year, month)
-    allocations: List[AllocationRow] = []
+) -> Tuple[AllocationTable, List[DemandSummary]]:
+    allocations, ledger = allocate_with_ledger(people, networks, year, month, consume_all, medico_total)
+    return allocations, ledger.summary()
+
+
+def allocate_with_ledger(
+    people: List[PersonInput],
+    networks: List[str],
+    year: int,
+    month: int,
+    consume_all: bool = True,
+    medico_total: float = 0.0,
+) -> Tuple[AllocationTable, DemandLedger]:
+    ledger = DemandLedger(demand_table(networks, year, month))
+    allocations = AllocationTable()
+
+    for person in people:
+        allocate_person(person, networks, ledger, allocations, consume_all)
+
+    finalize_allocation(ledger, allocations, networks, medico_total)
+    return allocations, ledger
 
+
+def iter_allocation(
+    people: Iterable[PersonInput],
+    networks: List[str],
+    ledger: DemandLedger,
+    consume_all: bool = True,
+    medico_total: float = 0.0,
+    batch_rows: int = 1000,
+) -> Iterator[List[AllocationTuple]]:
+    buffer = RowBuffer()
     for person in people:
-        name = normalize_name(person.name)
-        day_hours = person.ore_ordinarie + person.ore_straordinarie
-        rep_hours = person.ore_reperibilita
-
-        roles = list(person.roles)
-        if name == "CLAUDIO ALI":
-            roles = ["OG"]
-        if name == "DOMENICA MOIO":
-            roles = ["DIRETTORE"]
-
-        if "DIRETTORE" in roles and day_hours > 0:
-            distribution = director_distribution(day_hours, networks)
-            for network, hours in distribution.items():
-                allocations.append(
-                    AllocationRow(
-                        name=name,
-                        network=network,
-                        role="DIRETTORE",
-                        hours=hours,
-                        cost_hour=person.costo_orario,
-                        amount=hours * person.costo_orario,
-                    )
-                )
-                demands["DIRETTORE"][network] = max(
-                    0.0, demands["DIRETTORE"][network] - hours
-                )
-            day_hours = 0.0
-
-        for role in prioritize_roles(roles):
-            if role == "DIRETTORE":
-                continue
-            day_hours = allocate_role(
-                name,
-                role,
-                day_hours,
-                person.costo_orario,
-                networks,
-                demands,
-                allocations,
-                consume_all,
-            )
-
-        if rep_hours > 0:
-            rep_hours = allocate_reperibilita(
-                name,
-                rep_hours,
-                networks,
-                demands,
-                allocations,
-                consume_all,
-            )
+        allocate_person(person, networks, ledger, buffer, consume_all)
+        if len(buffer.rows) >= batch_rows:
+            yield buffer.rows
+            buffer = RowBuffer()
+    finalize_allocation(ledger, buffer, networks, medico_total)
+    if buffer.rows:
+        yield buffer.rows
 
+
+def allocate_person(
+    person: PersonInput,
+    networks: List[str],
+    ledger: DemandLedger,
+    allocations: AllocationTable,
+    consume_all: bool,
+) -> None:
+    name = normalize_name(person.name)
+    day_hours = person.ore_ordinarie + person.ore_straordinarie
+    rep_hours = person.ore_reperibilita
+    roles = effective_roles(name, person.roles)
+
+    if "DIRETTORE" in roles and day_hours > 0:
+        allocate_director(name, day_hours, person.costo_orario, networks, ledger, allocations)
+        day_hours = 0.0
+
+    for role in prioritize_roles(roles):
+        if role == "DIRETTORE":
+            continue
+        day_hours = allocate_role(
+            name,
+            role,
+            day_hours,
+            person.costo_orario,
+            networks,
+            ledger,
+            allocations,
+            consume_all,
+        )
+
+    if rep_hours > 0:
+        allocate_reperibilita(
+            name,
+            rep_hours,
+            networks,
+            ledger,
+            allocations,
+            consume_all,
+        )
+
+
+def effective_roles(name: str, roles: List[str]) -> List[str]:
+    if name == "CLAUDIO ALI":
+        return ["OG"]
+    if name == "DOMENICA MOIO":
+        return ["DIRETTORE"]
+    return list(roles)
+
+
+def allocate_director(
+    name: str,
+    hours: float,
+    cost_hour: float,
+    networks: List[str],
+    ledger: DemandLedger,
+    allocations: AllocationTable,
+) -> None:
+    for network, network_hours in director_distribution(hours, networks).items():
+        emit_row(allocations, ledger, name, network, "DIRETTORE", network_hours, cost_hour)
+        ledger.consume("DIRETTORE", network, network_hours)
+
+
+def finalize_allocation(
+    ledger: DemandLedger,
+    allocations: AllocationTable,
+    networks: List[str],
+    medico_total: float,
+) -> None:
+    demands = ledger.remaining
     total_rep_demand = sum(demands["REPERIBILITA"].values())
     if total_rep_demand > 0:
         fallback_name = "ALESSANDRO RICHARD"
@@ -129,7 +231,7 @@ def allocate_hours(
             fallback_name,
             missing,
             networks,
-            demands,
+            ledger,
             allocations,
             True,
         )
@@ -138,35 +240,22 @@ def allocate_hours(
         total_medico_hours = sum(demands["MEDICO"].values())
         cost_hour = (medico_total / total_medico_hours) if total_medico_hours else 0.0
         for network, hours in demands["MEDICO"].items():
-            allocations.append(
-                AllocationRow(
-                    name="DOTT. ENRICO CHIARA",
-                    network=network,
-                    role="MEDICO",
-                    hours=hours,
-                    cost_hour=cost_hour,
-                    amount=hours * cost_hour,
-                )
-            )
-            demands["MEDICO"][network] = 0.0
-
-    summary: List[DemandSummary] = []
-    for role, role_demands in demands.items():
-        for network, remaining in role_demands.items():
-            allocated = compute_allocated(allocations, role, network)
-            demand = compute_demands(networks, year, month)[role][network]
-            diff = allocated - demand
-            summary.append(
-                DemandSummary(
-                    role=role,
-                    network=network,
-                    demand=demand,
-                    allocated=allocated,
-                    diff=diff,
-                    ok=abs(diff) < 0.01,
-                )
-            )
-    return allocations, summary
+            emit_row(allocations, ledger, "DOTT. ENRICO CHIARA", network, "MEDICO", hours, cost_hour)
+            ledger.set_remaining("MEDICO", network, 0.0)
+
+
+def emit_row(
+    allocations: AllocationTable,
+    ledger: DemandLedger,
+    name: str,
+    network: str,
+    role: str,
+    hours: float,
+    cost_hour: float,
+) -> None:
+    amount = hours * cost_hour
+    allocations.append(name, network, role, hours, cost_hour, amount)
+    ledger.record(role, network, hours, amount)
 
 
 def prioritize_roles(roles: List[str]) -> List[str]:
@@ -195,10 +284,11 @@ def allocate_role(
     hours: float,
     cost_hour: float,
     networks: List[str],
-    demands: Dict[str, Dict[str, float]],
-    allocations: List[AllocationRow],
+    ledger: DemandLedger,
+    allocations: AllocationTable,
     consume_all: bool,
 ) -> float:
+    demands = ledger.remaining
     if hours <= 0 or role not in demands:
         return hours
 
@@ -206,7 +296,7 @@ def allocate_role(
     network_idx = 0
 
     while hours > 0:
-        network = pick_network(demands[role], networks, network_idx, consume_all)
+        network = next_network(ledger, role, networks, network_idx, consume_all)
         if not network:
             break
         remaining_demand = demands[role][network]
@@ -215,17 +305,8 @@ def allocate_role(
         assign = min(chunk, hours)
         if assign < chunk:
             assign = round_up_step(assign, 0.5)
-        allocations.append(
-            AllocationRow(
-                name=name,
-                network=network,
-                role=role,
-                hours=assign,
-                cost_hour=cost_hour,
-                amount=assign * cost_hour,
-            )
-        )
-        demands[role][network] = max(0.0, demands[role][network] - assign)
+        emit_row(allocations, ledger, name, network, role, assign, cost_hour)
+        ledger.consume(role, network, assign)
         hours -= assign
         network_idx += 1
     return hours
@@ -235,16 +316,17 @@ def allocate_reperibilita(
     name: str,
     hours: float,
     networks: List[str],
-    demands: Dict[str, Dict[str, float]],
-    allocations: List[AllocationRow],
+    ledger: DemandLedger,
+    allocations: AllocationTable,
     consume_all: bool,
 ) -> float:
+    demands = ledger.remaining
     role = "REPERIBILITA"
     chunk = ROLE_DEFAULTS[role]["chunk"]
     network_idx = 0
 
     while hours > 0:
-        network = pick_network(demands[role], networks, network_idx, consume_all)
+        network = next_network(ledger, role, networks, network_idx, consume_all)
         if not network:
             break
         remaining_demand = demands[role][network]
@@ -253,41 +335,34 @@ def allocate_reperibilita(
         assign = min(chunk, hours)
         if assign < chunk:
             assign = round_up_step(assign, 0.5)
-        allocations.append(
-            AllocationRow(
-                name=name,
-                network=network,
-                role=role,
-                hours=assign,
-                cost_hour=REPERIBILITA_COST,
-                amount=assign * REPERIBILITA_COST,
-            )
-        )
-        demands[role][network] = max(0.0, demands[role][network] - assign)
+        emit_row(allocations, ledger, name, network, role, assign, REPERIBILITA_COST)
+        ledger.consume(role, network, assign)
         hours -= assign
         network_idx += 1
     return hours
 
 
-def pick_network(
-    demand_map: Dict[str, float],
+def next_network(
+    ledger: DemandLedger,
+    role: str,
     networks: List[str],
-    start_idx: int,
+    cursor: int,
     consume_all: bool,
 ) -> str | None:
     if not networks:
         return None
     if consume_all:
-        ordered = networks[start_idx % len(networks) :] + networks[: start_idx % len(networks)]
-        return ordered[0]
-    return max(demand_map, key=demand_map.get)
+        return networks[cursor % len(networks)]
+    return ledger.neediest(role)
 
 
-def compute_allocated(allocations: List[AllocationRow], role: str, network: str) -> float:
+def compute_allocated(allocations: Iterable[AllocationRow], role: str, network: str) -> float:
     return sum(row.hours for row in allocations if row.role == role and row.network == network)
 
 
-def allocations_to_dicts(rows: List[AllocationRow]) -> List[dict]:
+def allocations_to_dicts(rows: Iterable[AllocationRow]) -> List[dict]:
+    if isinstance(rows, AllocationTable):
+        return rows.to_dicts()
     return [asdict(row) for row in rows]
 
 
@@ -0,0 +1,72 @@
+from __future__ import annotations
+
+from typing import Dict, List, Tuple
+
+from .allocation import allocations_to_dicts, summary_to_dicts
+from .engines import ENGINES
+from .models import PersonInput
+
+
+def month_range(start_year: int, start_month: int, end_year: int, end_month: int) -> List[Tuple[int, int]]:
+    months: List[Tuple[int, int]] = []
+    year, month = start_year, start_month
+    while (year, month) <= (end_year, end_month):
+        months.append((year, month))
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return months
+
+
+def run_month(
+    people: List[PersonInput],
+    networks: List[str],
+    year: int,
+    month: int,
+    consume_all: bool = True,
+    medico_total: float = 0.0,
+    engine: str = "greedy",
+) -> dict:
+    allocations, ledger = ENGINES[engine](people, networks, year, month, consume_all, medico_total)
+    cells = [
+        {"network": network, "role": role, "hours": hours, "amount": ledger.amount[(role, network)]}
+        for (role, network), hours in ledger.hours.items()
+    ]
+    return {
+        "year": year,
+        "month": month,
+        "consuntivo": allocations_to_dicts(allocations),
+        "pivot": ledger.pivot(),
+        "check": summary_to_dicts(ledger.summary()),
+        "cells": cells,
+        "hours": sum(allocations.hours),
+        "amount": sum(allocations.amount),
+    }
+
+
+class BatchAggregate:
+    def __init__(self) -> None:
+        self.months: List[Tuple[int, int]] = []
+        self.cells: Dict[Tuple[str, str], Dict[str, float]] = {}
+        self.hours = 0.0
+        self.amount = 0.0
+        self.failed = 0
+
+    def add(self, result: dict) -> None:
+        self.months.append((result["year"], result["month"]))
+        self.hours += result["hours"]
+        self.amount += result["amount"]
+        for cell in result["cells"]:
+            totals = self.cells.setdefault((cell["network"], cell["role"]), {"hours": 0.0, "amount": 0.0})
+            totals["hours"] += cell["hours"]
+            totals["amount"] += cell["amount"]
+
+    def to_dict(self) -> dict:
+        return {
+            "months": [{"year": year, "month": month} for year, month in sorted(self.months)],
+            "hours": self.hours,
+            "amount": self.amount,
+            "failed": self.failed,
+            "cells": [
+                {"network": network, "role": role, **totals}
+                for (network, role), totals in self.cells.items()
+            ],
+        }
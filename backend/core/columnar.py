@@ -0,0 +1,99 @@
+from __future__ import annotations
+
+import json
+import sys
+from array import array
+from functools import lru_cache
+from typing import Dict, List, Optional, Union
+
+from .ledger import DemandLedger
+from .models import AllocationTable
+
+JSON = "application/json"
+COLUMNAR_JSON = "application/vnd.cas.columnar+json"
+MSGPACK = "application/x-msgpack"
+NDJSON = "application/x-ndjson"
+
+Column = Union[List, bytes]
+
+
+def columnar_result(
+    allocations: AllocationTable,
+    ledger: DemandLedger,
+    result_hash: Optional[str] = None,
+    binary: bool = False,
+) -> dict:
+    return {
+        "format": "columnar",
+        "consuntivo": table_columns(allocations, binary),
+        "pivot": pivot_columns(ledger),
+        "check": check_columns(ledger),
+        "result_hash": result_hash,
+        "solver": ledger.stats or None,
+    }
+
+
+def table_columns(allocations: AllocationTable, binary: bool = False) -> dict:
+    encode = _buffer if binary else array.tolist
+    return {
+        "length": len(allocations),
+        "dictionaries": {
+            "name": allocations.names,
+            "network": allocations.networks,
+            "role": allocations.roles,
+        },
+        "name": encode(allocations.name_ids),
+        "network": encode(allocations.network_ids),
+        "role": encode(allocations.role_ids),
+        "hours": encode(allocations.hours),
+        "cost_hour": encode(allocations.cost_hour),
+        "amount": encode(allocations.amount),
+    }
+
+
+def pivot_columns(ledger: DemandLedger) -> Dict[str, List]:
+    columns: Dict[str, List] = {"network": [], "role": [], "hours": []}
+    for (role, network), hours in ledger.hours.items():
+        columns["network"].append(network)
+        columns["role"].append(role)
+        columns["hours"].append(hours)
+    return columns
+
+
+def check_columns(ledger: DemandLedger) -> Dict[str, List]:
+    columns: Dict[str, List] = {field: [] for field in ("role", "network", "demand", "allocated", "diff", "ok")}
+    for summary in ledger.summary():
+        columns["role"].append(summary.role)
+        columns["network"].append(summary.network)
+        columns["demand"].append(summary.demand)
+        columns["allocated"].append(summary.allocated)
+        columns["diff"].append(summary.diff)
+        columns["ok"].append(summary.ok)
+    return columns
+
+
+def encode_json(result: dict) -> bytes:
+    return json.dumps(result, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+
+def encode_msgpack(result: dict) -> bytes:
+    import msgpack
+
+    return msgpack.packb(result, use_bin_type=True)
+
+
+@lru_cache(maxsize=None)
+def msgpack_available() -> bool:
+    try:
+        import msgpack  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def _buffer(values: array) -> bytes:
+    if sys.byteorder == "little":
+        return values.tobytes()
+    swapped = array(values.typecode, values)
+    swapped.byteswap()
+    return swapped.tobytes()
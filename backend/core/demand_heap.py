@@ -0,0 +1,62 @@
+from __future__ import annotations
+
+from typing import Dict, List, Mapping, Optional
+
+
+class DemandHeap:
+    def __init__(self, values: Mapping[str, float]) -> None:
+        self.keys: List[str] = list(values)
+        self.index: Dict[str, int] = {key: idx for idx, key in enumerate(self.keys)}
+        self.values: List[float] = [values[key] for key in self.keys]
+        self.heap: List[int] = list(range(len(self.keys)))
+        self.position: List[int] = list(range(len(self.keys)))
+        for slot in reversed(range(len(self.heap) // 2)):
+            self._sift_down(slot)
+
+    def __len__(self) -> int:
+        return len(self.heap)
+
+    def top(self) -> Optional[str]:
+        if not self.heap:
+            return None
+        return self.keys[self.heap[0]]
+
+    def update(self, key: str, value: float) -> None:
+        item = self.index[key]
+        previous = self.values[item]
+        self.values[item] = value
+        if value < previous:
+            self._sift_down(self.position[item])
+        elif value > previous:
+            self._sift_up(self.position[item])
+
+    def _before(self, left: int, right: int) -> bool:
+        left_value = self.values[left]
+        right_value = self.values[right]
+        return left_value > right_value or (left_value == right_value and left < right)
+
+    def _swap(self, a: int, b: int) -> None:
+        heap = self.heap
+        heap[a], heap[b] = heap[b], heap[a]
+        self.position[heap[a]] = a
+        self.position[heap[b]] = b
+
+    def _sift_up(self, slot: int) -> None:
+        while slot:
+            parent = (slot - 1) >> 1
+            if not self._before(self.heap[slot], self.heap[parent]):
+                break
+            self._swap(slot, parent)
+            slot = parent
+
+    def _sift_down(self, slot: int) -> None:
+        size = len(self.heap)
+        while True:
+            best = slot
+            for child in (2 * slot + 1, 2 * slot + 2):
+                if child < size and self._before(self.heap[child], self.heap[best]):
+                    best = child
+            if best == slot:
+                return
+            self._swap(slot, best)
+            slot = best
@@ -0,0 +1,20 @@
+from __future__ import annotations
+
+from functools import partial
+from typing import Callable, Optional
+
+from .allocation import allocate_with_ledger
+from .solver import allocate_optimal
+from .vectorized import allocate_vectorized_engine
+
+ENGINES = {
+    "greedy": allocate_with_ledger,
+    "vectorized": allocate_vectorized_engine,
+    "optimal": allocate_optimal,
+}
+
+
+def select_engine(name: str, compare_greedy: bool = False) -> Optional[Callable]:
+    if name == "optimal" and compare_greedy:
+        return partial(allocate_optimal, compare_greedy=True)
+    return ENGINES.get(name)
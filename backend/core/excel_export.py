@@ -1,94 +1,231 @@
 from __future__ import annotations
 
 import io
+import pickle
+import re
+import tempfile
+import threading
 import zipfile
+from collections import OrderedDict
 from pathlib import Path
-from typing import List
+from typing import IO, Dict, List, Optional, Tuple
 
-import pandas as pd
 from openpyxl import Workbook, load_workbook
 
-from .models import AllocationRow
+from .allocation import NETWORKS
+from .models import AllocationTable
+from .xlsx_writer import write_table_xlsx
+from .zip_stream import DateTime, iter_zip_files, zip_entry
 
+CONSUNTIVO_COLUMNS = ["Nominativo", "Rete", "Ruolo", "Ore", "Costo_orario", "Importo"]
 
-def build_consuntivo_excel(rows: List[AllocationRow], year: int, month: int) -> bytes:
-    data = [
-        {
-            "Nominativo": row.name,
-            "Rete": row.network,
-            "Ruolo": row.role,
-            "Ore": row.hours,
-            "Costo_orario": row.cost_hour,
-            "Importo": row.amount,
-        }
-        for row in rows
-    ]
-    df = pd.DataFrame(data)
-    output = io.BytesIO()
-    with pd.ExcelWriter(output, engine="openpyxl") as writer:
-        df.to_excel(writer, index=False, sheet_name="Consuntivo")
-    output.seek(0)
-    return output.read()
+SPOOL_MAX_SIZE = 8 * 1024 * 1024
 
+CORE_TIMESTAMP = re.compile(rb"(<dcterms:(created|modified)[^>]*>)[^<]*(</dcterms:\2>)")
 
-def build_template_excel(
-    rows: List[AllocationRow],
+
+def export_date_time(year: int, month: int) -> DateTime:
+    return (year, month, 1, 0, 0, 0)
+
+
+def normalize_xlsx(data: bytes, target: IO[bytes], date_time: DateTime) -> None:
+    stamp = "{:04d}-{:02d}-{:02d}T{:02d}:{:02d}:{:02d}Z".format(*date_time).encode("ascii")
+    source = zipfile.ZipFile(io.BytesIO(data))
+    with source, zipfile.ZipFile(target, "w", zipfile.ZIP_DEFLATED) as zf:
+        for info in source.infolist():
+            content = source.read(info)
+            if info.filename == "docProps/core.xml":
+                content = CORE_TIMESTAMP.sub(lambda match: match.group(1) + stamp + match.group(3), content)
+            zf.writestr(zip_entry(zf, info.filename, date_time), content, compresslevel=zf.compresslevel)
+
+
+def write_consuntivo_excel(
+    rows: AllocationTable,
     year: int,
     month: int,
-    template_path: Path | None,
-) -> bytes:
+    target: IO[bytes],
+    date_time: Optional[DateTime] = None,
+) -> int:
+    return write_table_xlsx(target, "Consuntivo", CONSUNTIVO_COLUMNS, rows.rows(), date_time=date_time)
+
+
+def build_consuntivo_excel(rows: AllocationTable, year: int, month: int) -> IO[bytes]:
+    # The caller owns the returned file: read or copy it, then close it.
+    output = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+    try:
+        write_consuntivo_excel(rows, year, month, output)
+    except BaseException:
+        output.close()
+        raise
+    output.seek(0)
+    return output
+
+
+def template_sheets(networks: List[str]) -> List[Tuple[str, List[str]]]:
+    return [("CIG1", networks[:4])] + [(network, [network]) for network in networks]
+
+
+def prepare_template(template_path: Path | None, sheet_names: List[str]) -> Workbook:
     if template_path and template_path.exists():
         wb = load_workbook(template_path)
     else:
         wb = Workbook()
         wb.remove(wb.active)
-
-    networks = ["RETE1", "RETE2", "RETE3", "RETE4", "RETE5"]
-    cig1_networks = set(networks[:4])
-
-    def get_sheet(name: str):
+    for name in sheet_names:
         if name in wb.sheetnames:
-            return wb[name]
-        return wb.create_sheet(title=name)
-
-    def write_sheet(sheet_name: str, filter_networks: set | None):
-        ws = get_sheet(sheet_name)
-        ws.delete_rows(1, ws.max_row)
+            ws = wb[name]
+            ws.delete_rows(1, ws.max_row)
+        else:
+            wb.create_sheet(title=name)
+    return wb
+
+
+class TemplateCache:
+    def __init__(self, max_entries: int = 4) -> None:
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[tuple, bytes]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def workbook(self, template_path: Path | None, sheet_names: List[str]) -> Workbook:
+        if not template_path or not template_path.exists():
+            return prepare_template(None, sheet_names)
+        stat = template_path.stat()
+        key = (str(template_path), stat.st_mtime_ns, stat.st_size, tuple(sheet_names))
+        with self._lock:
+            blob = self._entries.get(key)
+            if blob is not None:
+                self._entries.move_to_end(key)
+        if blob is None:
+            blob = pickle.dumps(prepare_template(template_path, sheet_names), protocol=pickle.HIGHEST_PROTOCOL)
+            with self._lock:
+                self._entries[key] = blob
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return pickle.loads(blob)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+template_cache = TemplateCache()
+
+
+def export_names(year: int, month: int) -> Tuple[str, str]:
+    return (
+        f"PROSPETTO_CONSUNTIVO_{year}_{month:02d}.xlsx",
+        f"CAS-PROSPETTO_ORE_FORMAT_TEMPLATE_{year}_{month:02d}_NOLOCK.xlsx",
+    )
+
+
+def write_template_excel(
+    rows: AllocationTable,
+    year: int,
+    month: int,
+    template_path: Path | None,
+    target: IO[bytes],
+    networks: List[str] = NETWORKS,
+    date_time: Optional[DateTime] = None,
+) -> None:
+    sheets = template_sheets(networks)
+    wb = template_cache.workbook(template_path, [name for name, _networks in sheets])
+
+    buckets: Dict[str, List[tuple]] = {sheet_name: [] for sheet_name, _networks in sheets}
+    targets: Dict[str, List[List[tuple]]] = {}
+    for sheet_name, sheet_networks in sheets:
+        for network in sheet_networks:
+            targets.setdefault(network, []).append(buckets[sheet_name])
+
+    for name, network, role, hours, cost_hour, amount in rows.rows():
+        for bucket in targets.get(network, ()):
+            bucket.append((name, role, hours, cost_hour, amount))
+
+    for sheet_name, _networks in sheets:
+        ws = wb[sheet_name]
         ws.append(["Nominativo", "Ruolo", "Ore", "Costo_orario", "Importo"])
-        for row in rows:
-            if filter_networks and row.network not in filter_networks:
-                continue
-            ws.append([row.name, row.role, row.hours, row.cost_hour, row.amount])
+        for values in buckets[sheet_name]:
+            ws.append(values)
         ws.append([])
         ws.append(["FABBISOGNO (Ore)"])
         ws.append(["CONTROLLO COMMESSA"])
 
-    write_sheet("CIG1", cig1_networks)
-    for network in networks[:4]:
-        write_sheet(network, {network})
-    write_sheet("RETE5", {"RETE5"})
-
+    if date_time is None:
+        wb.save(target)
+        return
     output = io.BytesIO()
     wb.save(output)
-    output.seek(0)
-    return output.read()
+    normalize_xlsx(output.getvalue(), target, date_time)
+
+
+def build_template_excel(
+    rows: AllocationTable,
+    year: int,
+    month: int,
+    template_path: Path | None,
+    networks: List[str] = NETWORKS,
+) -> bytes:
+    output = io.BytesIO()
+    write_template_excel(rows, year, month, template_path, output, networks)
+    return output.getvalue()
+
+
+def write_consuntivo_part(
+    rows: AllocationTable,
+    year: int,
+    month: int,
+    directory: str,
+    deterministic: bool = False,
+) -> Tuple[str, str]:
+    name = export_names(year, month)[0]
+    path = str(Path(directory) / name)
+    date_time = export_date_time(year, month) if deterministic else None
+    with open(path, "wb") as output:
+        write_consuntivo_excel(rows, year, month, output, date_time)
+    return name, path
+
+
+def write_template_part(
+    rows: AllocationTable,
+    year: int,
+    month: int,
+    template_path: Path | None,
+    directory: str,
+    deterministic: bool = False,
+    networks: List[str] = NETWORKS,
+) -> Tuple[str, str]:
+    name = export_names(year, month)[1]
+    path = str(Path(directory) / name)
+    date_time = export_date_time(year, month) if deterministic else None
+    with open(path, "wb") as output:
+        write_template_excel(rows, year, month, template_path, output, networks, date_time)
+    return name, path
+
+
+def write_export_parts(
+    rows: AllocationTable,
+    year: int,
+    month: int,
+    template_path: Path | None,
+    directory: str,
+    deterministic: bool = False,
+    networks: List[str] = NETWORKS,
+) -> List[Tuple[str, str]]:
+    return [
+        write_consuntivo_part(rows, year, month, directory, deterministic),
+        write_template_part(rows, year, month, template_path, directory, deterministic, networks),
+    ]
 
 
 def build_export_zip(
-    rows: List[AllocationRow],
+    rows: AllocationTable,
     year: int,
     month: int,
     template_path: Path | None,
+    compresslevel: int = 6,
+    deterministic: bool = False,
+    networks: List[str] = NETWORKS,
 ) -> bytes:
-    consuntivo = build_consuntivo_excel(rows, year, month)
-    template = build_template_excel(rows, year, month, template_path)
-
-    zip_buffer = io.BytesIO()
-    with zipfile.ZipFile(zip_buffer, "w", zipfile.ZIP_DEFLATED) as zf:
-        cons_name = f"PROSPETTO_CONSUNTIVO_{year}_{month:02d}.xlsx"
-        template_name = f"CAS-PROSPETTO_ORE_FORMAT_TEMPLATE_{year}_{month:02d}_NOLOCK.xlsx"
-        zf.writestr(cons_name, consuntivo)
-        zf.writestr(template_name, template)
-
-    zip_buffer.seek(0)
-    return zip_buffer.read()
+    date_time = export_date_time(year, month) if deterministic else None
+    with tempfile.TemporaryDirectory() as directory:
+        parts = write_export_parts(rows, year, month, template_path, directory, deterministic, networks)
+        return b"".join(iter_zip_files(parts, compresslevel=compresslevel, date_time=date_time))
@@ -0,0 +1,101 @@
+from __future__ import annotations
+
+from typing import Dict, Iterator, List, Mapping, Optional, Tuple
+
+from .demand_heap import DemandHeap
+from .models import DemandSummary
+
+Cell = Tuple[str, str]
+
+
+class DemandLedger:
+    def __init__(self, demands: Mapping[str, Mapping[str, float]]) -> None:
+        self.demand: Dict[Cell, float] = {}
+        self.remaining: Dict[str, Dict[str, float]] = {}
+        for role, role_demands in demands.items():
+            self.remaining[role] = dict(role_demands)
+            for network, value in role_demands.items():
+                self.demand[(role, network)] = value
+        self.hours: Dict[Cell, float] = {}
+        self.amount: Dict[Cell, float] = {}
+        self.heaps: Dict[str, DemandHeap] = {}
+        self.stats: Dict[str, float] = {}
+
+    def copy(self) -> "DemandLedger":
+        ledger = DemandLedger.__new__(DemandLedger)
+        ledger.demand = self.demand
+        ledger.remaining = {role: dict(values) for role, values in self.remaining.items()}
+        ledger.hours = dict(self.hours)
+        ledger.amount = dict(self.amount)
+        ledger.heaps = {}
+        ledger.stats = dict(self.stats)
+        return ledger
+
+    def record(self, role: str, network: str, hours: float, amount: float) -> None:
+        key = (role, network)
+        self.hours[key] = self.hours.get(key, 0.0) + hours
+        self.amount[key] = self.amount.get(key, 0.0) + amount
+
+    def consume(self, role: str, network: str, hours: float) -> None:
+        role_remaining = self.remaining[role]
+        role_remaining[network] = max(0.0, role_remaining[network] - hours)
+        heap = self.heaps.get(role)
+        if heap is not None:
+            heap.update(network, role_remaining[network])
+
+    def set_remaining(self, role: str, network: str, value: float) -> None:
+        self.remaining[role][network] = value
+        heap = self.heaps.get(role)
+        if heap is not None:
+            heap.update(network, value)
+
+    def neediest(self, role: str) -> Optional[str]:
+        heap = self.heaps.get(role)
+        if heap is None:
+            heap = self.heaps[role] = DemandHeap(self.remaining[role])
+        return heap.top()
+
+    def allocated(self, role: str, network: str) -> float:
+        return self.hours.get((role, network), 0.0)
+
+    def cells(self) -> Iterator[Cell]:
+        return iter(self.demand)
+
+    def summary(self) -> List[DemandSummary]:
+        summary: List[DemandSummary] = []
+        for (role, network), demand in self.demand.items():
+            allocated = self.hours.get((role, network), 0.0)
+            diff = allocated - demand
+            summary.append(
+                DemandSummary(
+                    role=role,
+                    network=network,
+                    demand=demand,
+                    allocated=allocated,
+                    diff=diff,
+                    ok=abs(diff) < 0.01,
+                )
+            )
+        return summary
+
+    def pivot(self) -> List[dict]:
+        return [
+            {"network": network, "role": role, "hours": hours}
+            for (role, network), hours in self.hours.items()
+        ]
+
+    def deviation(self, skip: Tuple[str, ...] = ("MEDICO",)) -> Tuple[float, float, int]:
+        shortfall = 0.0
+        overshoot = 0.0
+        off = 0
+        for (role, network), demand in self.demand.items():
+            if role in skip:
+                continue
+            diff = self.hours.get((role, network), 0.0) - demand
+            if diff < 0:
+                shortfall -= diff
+            else:
+                overshoot += diff
+            if abs(diff) >= 0.01:
+                off += 1
+        return shortfall, overshoot, off
@@ -1,7 +1,8 @@
 from __future__ import annotations
 
+from array import array
 from dataclasses import dataclass
-from typing import List
+from typing import Dict, Iterator, List, Sequence, Tuple
 
 
 @dataclass
@@ -15,7 +16,7 @@ class PersonInput:
     forfait_total: float = 0.0
 
 
-@dataclass
+@dataclass(slots=True)
 class AllocationRow:
     name: str
     network: str
@@ -33,3 +34,142 @@ class DemandSummary:
     allocated: float
     diff: float
     ok: bool
+
+
+AllocationTuple = Tuple[str, str, str, float, float, float]
+
+
+class RowBuffer:
+    def __init__(self) -> None:
+        self.rows: List[AllocationTuple] = []
+
+    def append(self, name: str, network: str, role: str, hours: float, cost_hour: float, amount: float) -> None:
+        self.rows.append((name, network, role, hours, cost_hour, amount))
+
+
+class AllocationTable:
+    def __init__(self) -> None:
+        self.names: List[str] = []
+        self.networks: List[str] = []
+        self.roles: List[str] = []
+        self._lookup: Dict[str, Dict[str, int]] = {"name": {}, "network": {}, "role": {}}
+        self.name_ids = array("I")
+        self.network_ids = array("I")
+        self.role_ids = array("I")
+        self.hours = array("d")
+        self.cost_hour = array("d")
+        self.amount = array("d")
+
+    def _intern(self, kind: str, values: List[str], value: str) -> int:
+        lookup = self._lookup[kind]
+        idx = lookup.get(value)
+        if idx is None:
+            idx = len(values)
+            values.append(value)
+            lookup[value] = idx
+        return idx
+
+    def intern_name(self, name: str) -> int:
+        return self._intern("name", self.names, name)
+
+    def intern_network(self, network: str) -> int:
+        return self._intern("network", self.networks, network)
+
+    def intern_role(self, role: str) -> int:
+        return self._intern("role", self.roles, role)
+
+    def append(
+        self,
+        name: str,
+        network: str,
+        role: str,
+        hours: float,
+        cost_hour: float,
+        amount: float,
+    ) -> None:
+        self.name_ids.append(self.intern_name(name))
+        self.network_ids.append(self.intern_network(network))
+        self.role_ids.append(self.intern_role(role))
+        self.hours.append(hours)
+        self.cost_hour.append(cost_hour)
+        self.amount.append(amount)
+
+    def extend_ids(
+        self,
+        name_ids: Sequence[int],
+        network_ids: Sequence[int],
+        role_ids: Sequence[int],
+        hours: Sequence[float],
+        cost_hour: Sequence[float],
+        amount: Sequence[float],
+    ) -> None:
+        self.name_ids.extend(name_ids)
+        self.network_ids.extend(network_ids)
+        self.role_ids.extend(role_ids)
+        self.hours.extend(hours)
+        self.cost_hour.extend(cost_hour)
+        self.amount.extend(amount)
+
+    def __len__(self) -> int:
+        return len(self.hours)
+
+    def __getitem__(self, idx: int) -> AllocationRow:
+        return AllocationRow(*self.row(idx))
+
+    def __iter__(self) -> Iterator[AllocationRow]:
+        for values in self.rows():
+            yield AllocationRow(*values)
+
+    def row(self, idx: int) -> AllocationTuple:
+        return (
+            self.names[self.name_ids[idx]],
+            self.networks[self.network_ids[idx]],
+            self.roles[self.role_ids[idx]],
+            self.hours[idx],
+            self.cost_hour[idx],
+            self.amount[idx],
+        )
+
+    def rows(self, start: int = 0) -> Iterator[AllocationTuple]:
+        names, networks, roles = self.names, self.networks, self.roles
+        return zip(
+            (names[idx] for idx in self.name_ids[start:]),
+            (networks[idx] for idx in self.network_ids[start:]),
+            (roles[idx] for idx in self.role_ids[start:]),
+            self.hours[start:],
+            self.cost_hour[start:],
+            self.amount[start:],
+        )
+
+    def to_dicts(self) -> List[dict]:
+        return [
+            {
+                "name": name,
+                "network": network,
+                "role": role,
+                "hours": hours,
+                "cost_hour": cost_hour,
+                "amount": amount,
+            }
+            for name, network, role, hours, cost_hour, amount in self.rows()
+        ]
+
+    def merged(self) -> "AllocationTable":
+        table = AllocationTable()
+        table.names = list(self.names)
+        table.networks = list(self.networks)
+        table.roles = list(self.roles)
+        table._lookup = {kind: dict(lookup) for kind, lookup in self._lookup.items()}
+        positions: Dict[Tuple[int, int, int, float], int] = {}
+        for idx in range(len(self)):
+            key = (self.name_ids[idx], self.network_ids[idx], self.role_ids[idx], self.cost_hour[idx])
+            position = positions.get(key)
+            if position is not None:
+                table.hours[position] += self.hours[idx]
+                table.amount[position] += self.amount[idx]
+                continue
+            positions[key] = len(table)
+            table.extend_ids(
+                [key[0]], [key[1]], [key[2]], [self.hours[idx]], [key[3]], [self.amount[idx]]
+            )
+        return table
@@ -1,7 +1,8 @@
 from __future__ import annotations
 
+import codecs
 import re
-from typing import Dict, List
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
 
 from .models import PersonInput
 
@@ -9,6 +10,8 @@ ALIASES = {
     "SALAZAR JOSVELINE": "SALAZAR JOSVELYN",
 }
 
+BLOCK_SEPARATOR = re.compile(r"BUSTA\s+PAGA\s*\d+", flags=re.IGNORECASE)
+
 ROLE_KEYWORDS = {
     "DIRETTORE": "DIRETTORE",
     "OS": "OS",
@@ -18,6 +21,73 @@ ROLE_KEYWORDS = {
     "OPERATORE GENERICO": "OG",
 }
 
+LINE_TOKEN = re.compile(
+    r"Nome\s*[:\-]\s*(?P<nome>.+)"
+    r"|ore\s+ordinarie\s*[:\-]?\s*(?P<ore_ordinarie>[\d.,]+)"
+    r"|ore\s+straordinarie\s*[:\-]?\s*(?P<ore_straordinarie>[\d.,]+)"
+    r"|reperibilita\s*[:\-]?\s*(?P<reperibilita>[\d.,]+)"
+    r"|costo\s+orario\s*[:\-]?\s*(?P<costo_orario>[\d.,]+)"
+    r"|forfait\s*[:\-]?\s*(?P<forfait>[\d.,]+)",
+    flags=re.IGNORECASE,
+)
+
+NAME_LINE = re.compile(r"^[A-Z][A-Z\s'`.-]{3,}$")
+
+
+class KeywordMatcher:
+    def __init__(self, keywords: Dict[str, str]) -> None:
+        self.root: Dict[Optional[str], dict] = {}
+        for keyword, value in keywords.items():
+            node = self.root
+            for char in keyword.upper():
+                node = node.setdefault(char, {})
+            node[None] = value
+        prefixes = sorted({keyword.upper()[:2] for keyword in keywords}, key=len, reverse=True)
+        self._starts = re.compile(r"\b(?:" + "|".join(re.escape(prefix) for prefix in prefixes) + ")")
+
+    def find(self, text: str) -> List[str]:
+        found: List[str] = []
+        for _start, _end, value in self._matches(text.upper()):
+            if value not in found:
+                found.append(value)
+        return found
+
+    def replace(self, text: str) -> str:
+        text = text.upper()
+        parts: List[str] = []
+        last = 0
+        for start, end, value in self._matches(text):
+            if start < last:
+                continue
+            parts.append(text[last:start])
+            parts.append(value)
+            last = end
+        parts.append(text[last:])
+        return "".join(parts)
+
+    def _matches(self, text: str) -> Iterator[Tuple[int, int, str]]:
+        size = len(text)
+        for start in self._starts.finditer(text):
+            node = self.root
+            pos = start.start()
+            value = None
+            end = pos
+            while pos < size and text[pos] in node:
+                node = node[text[pos]]
+                pos += 1
+                if None in node and (pos == size or not _is_word_char(text[pos])):
+                    value = node[None]
+                    end = pos
+            if value is not None:
+                yield start.start(), end, value
+
+
+def _is_word_char(char: str) -> bool:
+    return char.isalnum() or char == "_"
+
+
+ROLE_MATCHER = KeywordMatcher(ROLE_KEYWORDS)
+
 
 def normalize_name(name: str) -> str:
     cleaned = re.sub(r"\s+", " ", name.strip())
@@ -41,71 +111,122 @@ def parse_float(value: str) -> float:
 
 
 def parse_text_block(text: str) -> List[PersonInput]:
-    blocks = re.split(r"BUSTA\s+PAGA\s*\d+", text, flags=re.IGNORECASE)
     people: List[PersonInput] = []
+    for block in BLOCK_SEPARATOR.split(text):
+        person = parse_block(block)
+        if person is not None:
+            people.append(person)
+    return people
 
-    for block in blocks:
-        lines = [line.strip() for line in block.splitlines() if line.strip()]
-        if not lines:
+
+def parse_block(block: str) -> Optional[PersonInput]:
+    lines = [line.strip() for line in block.splitlines() if line.strip()]
+    if not lines:
+        return None
+
+    name = ""
+    ore_ord = ore_str = ore_rep = cost = 0.0
+    role_lines: List[str] = []
+    forfait_total = 0.0
+
+    for line in lines:
+        fields: Dict[str, str] = {}
+        for match in LINE_TOKEN.finditer(line):
+            field = match.lastgroup
+            if field not in fields:
+                fields[field] = match.group(field)
+
+        if "nome" in fields:
+            name = apply_alias(fields["nome"])
             continue
 
-        name = ""
-        ore_ord = ore_str = ore_rep = cost = 0.0
-        roles: List[str] = []
-        forfait_total = 0.0
+        if not name and NAME_LINE.match(line):
+            name = apply_alias(line)
 
-        for line in lines:
-            name_match = re.search(r"Nome\s*[:\-]\s*(.+)", line, flags=re.IGNORECASE)
-            if name_match:
-                name = apply_alias(name_match.group(1))
-                continue
+        if "ore_ordinarie" in fields:
+            ore_ord = parse_float(fields["ore_ordinarie"])
+        if "ore_straordinarie" in fields:
+            ore_str = parse_float(fields["ore_straordinarie"])
+        if "reperibilita" in fields:
+            ore_rep = parse_float(fields["reperibilita"])
+        if "costo_orario" in fields:
+            cost = parse_float(fields["costo_orario"])
+        if "forfait" in fields:
+            forfait_total = parse_float(fields["forfait"])
 
-            if not name:
-                possible_name = re.match(r"^[A-Z][A-Z\s'`.-]{3,}$", line)
-                if possible_name:
-                    name = apply_alias(possible_name.group(0))
+        role_lines.append(line)
 
-            ore_ord_match = re.search(r"ore\s+ordinarie\s*[:\-]?\s*([\d.,]+)", line, flags=re.IGNORECASE)
-            if ore_ord_match:
-                ore_ord = parse_float(ore_ord_match.group(1))
+    roles = ROLE_MATCHER.find("\n".join(role_lines))
+    if not name:
+        return None
 
-            ore_str_match = re.search(r"ore\s+straordinarie\s*[:\-]?\s*([\d.,]+)", line, flags=re.IGNORECASE)
-            if ore_str_match:
-                ore_str = parse_float(ore_str_match.group(1))
+    roles = apply_fixed_rules(name, roles)
 
-            ore_rep_match = re.search(r"reperibilita\s*[:\-]?\s*([\d.,]+)", line, flags=re.IGNORECASE)
-            if ore_rep_match:
-                ore_rep = parse_float(ore_rep_match.group(1))
+    return PersonInput(
+        name=name,
+        ore_ordinarie=ore_ord,
+        ore_straordinarie=ore_str,
+        ore_reperibilita=ore_rep,
+        costo_orario=cost,
+        roles=roles,
+        forfait_total=forfait_total,
+    )
 
-            cost_match = re.search(r"costo\s+orario\s*[:\-]?\s*([\d.,]+)", line, flags=re.IGNORECASE)
-            if cost_match:
-                cost = parse_float(cost_match.group(1))
 
-            forfait_match = re.search(r"forfait\s*[:\-]?\s*([\d.,]+)", line, flags=re.IGNORECASE)
-            if forfait_match:
-                forfait_total = parse_float(forfait_match.group(1))
+class BlockSplitter:
+    def __init__(self) -> None:
+        self.buffer = ""
 
-            for key, role in ROLE_KEYWORDS.items():
-                if key in line.upper() and role not in roles:
-                    roles.append(role)
+    def feed(self, chunk: str) -> List[str]:
+        self.buffer += chunk
+        blocks: List[str] = []
+        start = 0
+        for match in BLOCK_SEPARATOR.finditer(self.buffer):
+            if match.end() >= len(self.buffer):
+                break
+            blocks.append(self.buffer[start : match.start()])
+            start = match.end()
+        self.buffer = self.buffer[start:]
+        return blocks
 
-        if not name:
-            continue
+    def close(self) -> List[str]:
+        blocks = BLOCK_SEPARATOR.split(self.buffer)
+        self.buffer = ""
+        return blocks
+
+
+def iter_parse_text(chunks: Iterable[str]) -> Iterator[PersonInput]:
+    splitter = BlockSplitter()
+    for chunk in chunks:
+        for block in splitter.feed(chunk):
+            person = parse_block(block)
+            if person is not None:
+                yield person
+    for block in splitter.close():
+        person = parse_block(block)
+        if person is not None:
+            yield person
+
+
+class IncrementalParser:
+    def __init__(self, encoding: str = "utf-8") -> None:
+        self.decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+        self.splitter = BlockSplitter()
+
+    def feed(self, data: bytes) -> List[PersonInput]:
+        return _parse_blocks(self.splitter.feed(self.decoder.decode(data)))
 
-        roles = apply_fixed_rules(name, roles)
+    def close(self) -> List[PersonInput]:
+        blocks = self.splitter.feed(self.decoder.decode(b"", final=True))
+        return _parse_blocks(blocks + self.splitter.close())
 
-        people.append(
-            PersonInput(
-                name=name,
-                ore_ordinarie=ore_ord,
-                ore_straordinarie=ore_str,
-                ore_reperibilita=ore_rep,
-                costo_orario=cost,
-                roles=roles,
-                forfait_total=forfait_total,
-            )
-        )
 
+def _parse_blocks(blocks: List[str]) -> List[PersonInput]:
+    people = []
+    for block in blocks:
+        person = parse_block(block)
+        if person is not None:
+            people.append(person)
     return people
 
 
@@ -118,19 +239,30 @@ def apply_fixed_rules(name: str, roles: List[str]) -> List[str]:
     return roles
 
 
-def merge_people(people: List[PersonInput]) -> List[PersonInput]:
-    merged: Dict[str, PersonInput] = {}
-    for person in people:
+class PeopleMerger:
+    def __init__(self) -> None:
+        self.merged: Dict[str, PersonInput] = {}
+
+    def add(self, person: PersonInput) -> PersonInput:
         key = normalize_name(person.name)
-        if key not in merged:
-            merged[key] = person
-            continue
-        existing = merged[key]
+        if key not in self.merged:
+            self.merged[key] = person
+            return person
+        existing = self.merged[key]
         existing.ore_ordinarie += person.ore_ordinarie
         existing.ore_straordinarie += person.ore_straordinarie
         existing.ore_reperibilita += person.ore_reperibilita
         existing.costo_orario = max(existing.costo_orario, person.costo_orario)
         existing.roles = sorted(set(existing.roles + person.roles))
         existing.forfait_total = max(existing.forfait_total, person.forfait_total)
-        merged[key] = existing
-    return list(merged.values())
+        return existing
+
+    def people(self) -> List[PersonInput]:
+        return list(self.merged.values())
+
+
+def merge_people(people: Iterable[PersonInput]) -> List[PersonInput]:
+    merger = PeopleMerger()
+    for person in people:
+        merger.add(person)
+    return merger.people()
@@ -0,0 +1,163 @@
+from __future__ import annotations
+
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+PageText = Tuple[int, str]
+
+
+def content_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def page_count(path: str) -> int:
+    import pdfplumber
+
+    with pdfplumber.open(path) as pdf:
+        return len(pdf.pages)
+
+
+def page_batches(pages: List[int], batches: int) -> List[List[int]]:
+    if not pages:
+        return []
+    batches = max(1, min(batches, len(pages)))
+    size = -(-len(pages) // batches)
+    return [pages[idx : idx + size] for idx in range(0, len(pages), size)]
+
+
+def extract_page_range(path: str, pages: List[int]) -> List[PageText]:
+    import pdfplumber
+
+    with pdfplumber.open(path) as pdf:
+        return [(page_number, pdf.pages[page_number].extract_text() or "") for page_number in pages]
+
+
+def ocr_pages(path: str, pages: List[int]) -> Dict[int, str]:
+    # One OCRmyPDF run for all textless pages: each run pays process start-up
+    # and rewrites the whole PDF. The sidecar has one \f-separated entry per page.
+    if not pages:
+        return {}
+    try:
+        import ocrmypdf
+    except ImportError:
+        return {page_number: "" for page_number in pages}
+
+    with tempfile.TemporaryDirectory() as workdir:
+        output = Path(workdir) / "ocr.pdf"
+        sidecar = Path(workdir) / "ocr.txt"
+        try:
+            ocrmypdf.ocr(
+                path,
+                output,
+                pages=",".join(str(page_number + 1) for page_number in pages),
+                force_ocr=True,
+                sidecar=sidecar,
+                progress_bar=False,
+            )
+        except Exception:
+            return {page_number: "" for page_number in pages}
+        texts = sidecar.read_text(encoding="utf-8", errors="replace").split("\f")
+    return {page_number: texts[page_number] if page_number < len(texts) else "" for page_number in pages}
+
+
+class PageTextCache:
+    def __init__(self, directory: Path, max_bytes: int = 64 * 1024 * 1024) -> None:
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._documents: "OrderedDict[str, int]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.size = 0
+        self.evictions = 0
+        if directory.exists():
+            for path in directory.glob("*/*.tmp"):
+                path.unlink(missing_ok=True)
+            documents = [path for path in directory.iterdir() if path.is_dir()]
+            for path in sorted(documents, key=lambda item: item.stat().st_mtime):
+                self._documents[path.name] = sum(item.stat().st_size for item in path.iterdir())
+                self.size += self._documents[path.name]
+            with self._lock:
+                self._trim()
+
+    @classmethod
+    def from_env(cls, storage_dir: Path) -> "PageTextCache":
+        return cls(
+            storage_dir / "pdf_text",
+            max_bytes=int(os.getenv("PDF_TEXT_CACHE_MAX_BYTES", 64 * 1024 * 1024)),
+        )
+
+    def _path(self, digest: str, page_number: int) -> Path:
+        return self.directory / digest / f"{page_number:05d}.txt"
+
+    def get(self, digest: str, page_number: int) -> Optional[str]:
+        path = self._path(digest, page_number)
+        if not path.exists():
+            return None
+        return path.read_text(encoding="utf-8")
+
+    def put(self, digest: str, page_number: int, text: str) -> None:
+        self._write(self._path(digest, page_number), digest, text)
+
+    def page_count(self, digest: str) -> Optional[int]:
+        path = self.directory / digest / "pages"
+        if not path.exists():
+            return None
+        self._touch(digest)
+        return int(path.read_text())
+
+    def set_page_count(self, digest: str, pages: int) -> None:
+        self._write(self.directory / digest / "pages", digest, str(pages))
+
+    def _write(self, path: Path, digest: str, text: str) -> None:
+        data = text.encode("utf-8")
+        path.parent.mkdir(parents=True, exist_ok=True)
+        previous = path.stat().st_size if path.exists() else 0
+        tmp = path.with_suffix(".tmp")
+        tmp.write_bytes(data)
+        tmp.replace(path)
+        with self._lock:
+            self._documents[digest] = self._documents.get(digest, 0) + len(data) - previous
+            self._documents.move_to_end(digest)
+            self.size += len(data) - previous
+            self._trim()
+
+    def _touch(self, digest: str) -> None:
+        with self._lock:
+            if digest in self._documents:
+                self._documents.move_to_end(digest)
+        try:
+            os.utime(self.directory / digest)
+        except OSError:
+            pass
+
+    def _trim(self) -> None:
+        while self.size > self.max_bytes and self._documents:
+            victim, size = self._documents.popitem(last=False)
+            self.size -= size
+            self.evictions += 1
+            shutil.rmtree(self.directory / victim, ignore_errors=True)
+
+    def lookup(self, digest: str, pages: int) -> Tuple[Dict[int, str], List[int]]:
+        found: Dict[int, str] = {}
+        missing: List[int] = []
+        for page_number in range(pages):
+            text = self.get(digest, page_number)
+            if text is None:
+                missing.append(page_number)
+            else:
+                found[page_number] = text
+        return found, missing
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "documents": len(self._documents),
+                "bytes": self.size,
+                "max_bytes": self.max_bytes,
+                "evictions": self.evictions,
+            }
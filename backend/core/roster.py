@@ -0,0 +1,172 @@
+from __future__ import annotations
+
+import csv
+import io
+import re
+from itertools import zip_longest
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .allocation import ROLE_DEFAULTS
+from .models import PersonInput
+from .parsing import ROLE_MATCHER, apply_alias
+
+NUMERIC_COLUMNS = ("ore_ordinarie", "ore_straordinarie", "ore_reperibilita", "costo_orario", "forfait_total")
+HEADER_ALIASES = {
+    "nome": "name",
+    "nominativo": "name",
+    "ruoli": "roles",
+    "ruolo": "roles",
+    "role": "roles",
+}
+ROLE_SEPARATOR = re.compile(r"[\s,;|/]+")
+THOUSANDS = re.compile(r"[-+]?\d{1,3}(\.\d{3})+")
+
+
+class RosterError(ValueError):
+    pass
+
+
+def read_roster(data: bytes, filename: str) -> List[PersonInput]:
+    if filename.lower().endswith(".xlsx"):
+        rows = xlsx_rows(data)
+    elif filename.lower().endswith((".csv", ".txt")):
+        rows = csv_rows(data)
+    else:
+        raise RosterError("Roster must be .csv or .xlsx")
+    return build_roster(*roster_columns(rows))
+
+
+def csv_rows(data: bytes) -> Iterable[Sequence]:
+    try:
+        text = data.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        text = data.decode("latin-1")
+    try:
+        dialect = csv.Sniffer().sniff(text[:4096], delimiters=",;\t")
+    except csv.Error:
+        dialect = csv.excel
+    return csv.reader(io.StringIO(text), dialect)
+
+
+def xlsx_rows(data: bytes) -> Iterable[Sequence]:
+    from openpyxl import load_workbook
+
+    try:
+        workbook = load_workbook(io.BytesIO(data), read_only=True, data_only=True)
+    except Exception as exc:
+        raise RosterError("Invalid xlsx roster") from exc
+    try:
+        yield from workbook.worksheets[0].iter_rows(values_only=True)
+    finally:
+        workbook.close()
+
+
+def roster_columns(rows: Iterable[Sequence]) -> Tuple[Dict[str, Sequence], List[int]]:
+    rows = iter(rows)
+    header = next(rows, None)
+    if header is None:
+        raise RosterError("Roster is empty")
+    fields = [_field(cell) for cell in header]
+    if "name" not in fields:
+        raise RosterError("Roster needs a name column")
+    lines: List[int] = []
+    body = []
+    for line, row in enumerate(rows, start=2):
+        if any(row):
+            lines.append(line)
+            body.append(row)
+    columns = list(zip_longest(*body, fillvalue=None)) if body else [()] * len(fields)
+    return {field: column for field, column in zip(fields, columns) if field}, lines
+
+
+def build_roster(columns: Dict[str, Sequence], lines: Sequence[int]) -> List[PersonInput]:
+    names = columns["name"]
+    size = len(names)
+    values = {field: numeric_column(columns.get(field), field, lines) for field in NUMERIC_COLUMNS}
+
+    aliases: Dict[object, str] = {}
+    for name in names:
+        if name not in aliases:
+            aliases[name] = apply_alias("" if name is None else str(name))
+    role_sets: Dict[object, List[str]] = {}
+    roles = columns.get("roles") or [None] * size
+    for cell in roles:
+        if cell not in role_sets:
+            role_sets[cell] = _roles(cell)
+    unknown = {role for found in role_sets.values() for role in found if role not in ROLE_DEFAULTS}
+    if unknown:
+        bad = {cell for cell, found in role_sets.items() if unknown.intersection(found)}
+        rows = ", ".join(str(line) for line, cell in zip(lines, roles) if cell in bad)
+        raise RosterError(f"Unknown roles {', '.join(sorted(unknown))} (rows {rows})")
+
+    return [
+        PersonInput(
+            name=aliases[name],
+            ore_ordinarie=ordinarie,
+            ore_straordinarie=straordinarie,
+            ore_reperibilita=reperibilita,
+            costo_orario=costo,
+            roles=list(role_sets[cell]),
+            forfait_total=forfait,
+        )
+        for name, ordinarie, straordinarie, reperibilita, costo, forfait, cell in zip(
+            names, *(values[field].tolist() for field in NUMERIC_COLUMNS), roles
+        )
+        if aliases[name]
+    ]
+
+
+def numeric_column(column: Optional[Sequence], field: str, lines: Sequence[int]) -> np.ndarray:
+    if column is None:
+        return np.zeros(len(lines))
+    cells = np.array(column, dtype=object)
+    cells[np.equal(cells, None) | np.equal(cells, "")] = 0.0
+    try:
+        values = cells.astype(float)
+    except (TypeError, ValueError):
+        values = _parse_text_column(cells, field, lines)
+    invalid = ~np.isfinite(values) | (values < 0)
+    if invalid.any():
+        rows = ", ".join(str(lines[row]) for row in np.flatnonzero(invalid)[:5])
+        raise RosterError(f"Invalid numeric values in column {field} (rows {rows})")
+    return values
+
+
+def _parse_text_column(cells: np.ndarray, field: str, lines: Sequence[int]) -> np.ndarray:
+    text = np.char.strip(cells.astype(str))
+    comma = np.char.rfind(text, ",")
+    dot = np.char.rfind(text, ".")
+    if (comma >= 0).any():
+        ambiguous = (comma >= 0) & (dot > comma)
+        plain = (comma < 0) & (dot >= 0)
+        if plain.any():
+            ambiguous[plain] = [bool(THOUSANDS.fullmatch(cell)) for cell in text[plain]]
+        if ambiguous.any():
+            rows = ", ".join(str(lines[row]) for row in np.flatnonzero(ambiguous)[:5])
+            raise RosterError(f"Ambiguous decimal separator in column {field} (rows {rows})")
+        italian = comma >= 0
+        text[italian] = np.char.replace(np.char.replace(text[italian], ".", ""), ",", ".")
+    text = np.where(text == "", "0", text)
+    try:
+        return text.astype(float)
+    except ValueError as exc:
+        raise RosterError(f"Invalid numeric values in column {field}") from exc
+
+
+def _field(cell: object) -> Optional[str]:
+    if cell is None:
+        return None
+    field = str(cell).strip().lower().replace(" ", "_")
+    return HEADER_ALIASES.get(field, field)
+
+
+def _roles(cell: object) -> List[str]:
+    if cell is None:
+        return []
+    roles: List[str] = []
+    for role in ROLE_SEPARATOR.split(ROLE_MATCHER.replace(str(cell))):
+        if role and role not in roles:
+            roles.append(role)
+    return roles
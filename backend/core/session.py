@@ -0,0 +1,273 @@
+from __future__ import annotations
+
+import threading
+from dataclasses import dataclass
+from typing import Dict, Iterator, List, Optional, Sequence, Set, Tuple
+
+from .allocation import allocate_person, demand_table, finalize_allocation
+from .ledger import Cell, DemandLedger
+from .models import AllocationTuple, DemandSummary, PersonInput, RowBuffer
+
+CHECKPOINT_EVERY = 64
+ROW_FIELDS = ("name", "network", "role", "hours", "cost_hour", "amount")
+
+Remaining = Dict[str, Dict[str, float]]
+Operation = Tuple[str, Optional[int], Optional[PersonInput]]
+Splice = Tuple[int, int, List[AllocationTuple]]
+
+
+class Slot:
+    __slots__ = ("person", "rows", "output", "checkpoint")
+
+    def __init__(self, person: Optional[PersonInput]) -> None:
+        self.person = person
+        self.rows: List[AllocationTuple] = []
+        self.output: List[AllocationTuple] = []
+        self.checkpoint: Optional[Remaining] = None
+
+
+@dataclass
+class SessionDelta:
+    version: int
+    splices: List[Splice]
+    row_count: int
+    pivot: List[dict]
+    pivot_removed: List[Cell]
+    check: List[DemandSummary]
+
+
+class AllocationSession:
+    def __init__(
+        self,
+        people: Sequence[Optional[PersonInput]],
+        networks: List[str],
+        year: int,
+        month: int,
+        consume_all: bool = True,
+        medico_total: float = 0.0,
+        merge_chunks: bool = False,
+        checkpoint_every: int = CHECKPOINT_EVERY,
+    ) -> None:
+        self.networks = list(networks)
+        self.year = year
+        self.month = month
+        self.consume_all = consume_all
+        self.medico_total = medico_total
+        self.merge_chunks = merge_chunks
+        self.checkpoint_every = max(1, checkpoint_every)
+        self.demands = demand_table(self.networks, year, month)
+        self.slots = [Slot(person) for person in people]
+        self.version = 0
+        self.lock = threading.Lock()
+
+        ledger = DemandLedger(self.demands)
+        for idx, slot in enumerate(self.slots):
+            if not consume_all and idx % self.checkpoint_every == 0:
+                slot.checkpoint = _snapshot(ledger.remaining)
+            self._set_rows(slot, self._allocate(slot, ledger))
+        ledger.heaps = {}
+        self.ledger = ledger
+        self.person_rows = sum(len(slot.output) for slot in self.slots)
+        self._finalize()
+
+    def __len__(self) -> int:
+        return len(self.slots)
+
+    def rows(self) -> Iterator[AllocationTuple]:
+        for slot in self.slots:
+            yield from slot.output
+        yield from self.tail
+
+    def row_dicts(self) -> List[dict]:
+        return rows_to_dicts(self.rows())
+
+    def apply(self, operations: Sequence[Operation]) -> SessionDelta:
+        self._check(operations)
+        old_final = self.final
+        old_tail = self.tail
+        old_person_rows = self.person_rows
+
+        slots = self.slots
+        dirty: Set[Slot] = set()
+        bounds: Set[Slot] = set()
+        at_end = False
+        cells: Set[Cell] = set()
+        for op, index, person in operations:
+            if op == "add":
+                slot = Slot(person)
+                slots.insert(len(slots) if index is None else index, slot)
+                dirty.add(slot)
+            elif op == "update":
+                slots[index].person = person
+                dirty.add(slots[index])
+            else:
+                removed = slots.pop(index)
+                cells.update(_cells(removed.rows))
+                if index < len(slots):
+                    slots[index].checkpoint = None
+                    bounds.add(slots[index])
+                else:
+                    at_end = True
+
+        positions = [idx for idx, slot in enumerate(slots) if slot in dirty or slot in bounds]
+        lo = min(positions, default=len(slots))
+        last = max(positions, default=-1)
+        hi = len(slots) - 1 if at_end else last
+        if at_end:
+            lo = min(lo, len(slots))
+
+        if self.consume_all:
+            scratch = DemandLedger(self.demands)
+            for idx in positions:
+                slot = slots[idx]
+                if slot in dirty:
+                    rows = self._allocate(slot, scratch)
+                    cells.update(_cells(slot.rows))
+                    cells.update(_cells(rows))
+                    self._set_rows(slot, rows)
+        elif lo < len(slots):
+            hi = max(hi, self._replay(lo, last, dirty, cells))
+
+        if cells:
+            self._refold(cells)
+        self.person_rows = sum(len(slot.output) for slot in slots)
+        self._finalize()
+        self.version += 1
+
+        splices: List[Splice] = []
+        if positions or at_end:
+            start = sum(len(slot.output) for slot in slots[:lo])
+            suffix = sum(len(slot.output) for slot in slots[max(hi + 1, lo) :])
+            delete = old_person_rows - start - suffix
+            rows = [row for slot in slots[lo : hi + 1] for row in slot.output]
+            if delete or rows:
+                splices.append((start, delete, rows))
+        if self.tail != old_tail:
+            splices.append((self.person_rows, len(old_tail), list(self.tail)))
+
+        final = self.final
+        return SessionDelta(
+            version=self.version,
+            splices=splices,
+            row_count=self.person_rows + len(self.tail),
+            pivot=[
+                {"network": network, "role": role, "hours": hours}
+                for (role, network), hours in final.hours.items()
+                if old_final.hours.get((role, network)) != hours
+            ],
+            pivot_removed=[cell for cell in old_final.hours if cell not in final.hours],
+            check=[
+                summary
+                for summary in final.summary()
+                if summary.allocated != old_final.allocated(summary.role, summary.network)
+            ],
+        )
+
+    def _check(self, operations: Sequence[Operation]) -> None:
+        size = len(self.slots)
+        for op, index, person in operations:
+            if op not in ("add", "update", "remove"):
+                raise ValueError(f"Unknown operation {op}")
+            if op != "remove" and person is None:
+                raise ValueError(f"Operation {op} needs a person")
+            if op == "add":
+                if index is not None and not 0 <= index <= size:
+                    raise IndexError(f"Invalid index {index}")
+                size += 1
+                continue
+            if index is None or not 0 <= index < size:
+                raise IndexError(f"Invalid index {index}")
+            if op == "remove":
+                size -= 1
+
+    def _replay(self, first: int, last: int, dirty: Set[Slot], cells: Set[Cell]) -> int:
+        slots = self.slots
+        start = first
+        while start > 0 and slots[start].checkpoint is None:
+            start -= 1
+        ledger = DemandLedger(self.demands)
+        if slots[start].checkpoint is not None:
+            ledger.remaining = _snapshot(slots[start].checkpoint)
+        for slot in slots[start:first]:
+            for row in slot.rows:
+                ledger.consume(row[2], row[1], row[3])
+
+        changed = last
+        for idx in range(first, len(slots)):
+            slot = slots[idx]
+            if idx > last and slot.checkpoint is not None and slot.checkpoint == ledger.remaining:
+                break
+            slot.checkpoint = _snapshot(ledger.remaining) if idx % self.checkpoint_every == 0 else None
+            rows = self._allocate(slot, ledger)
+            if slot in dirty or rows != slot.rows:
+                cells.update(_cells(slot.rows))
+                cells.update(_cells(rows))
+                self._set_rows(slot, rows)
+                changed = max(changed, idx)
+        return changed
+
+    def _refold(self, cells: Set[Cell]) -> None:
+        ledger = self.ledger
+        hours: Dict[Cell, float] = {}
+        amount: Dict[Cell, float] = {}
+        remaining = {cell: ledger.demand[cell] for cell in cells}
+        for slot in self.slots:
+            for row in slot.rows:
+                cell = (row[2], row[1])
+                if cell in remaining:
+                    hours[cell] = hours.get(cell, 0.0) + row[3]
+                    amount[cell] = amount.get(cell, 0.0) + row[5]
+                    remaining[cell] = max(0.0, remaining[cell] - row[3])
+        for cell, value in remaining.items():
+            role, network = cell
+            ledger.set_remaining(role, network, value)
+            if cell in hours:
+                ledger.hours[cell] = hours[cell]
+                ledger.amount[cell] = amount[cell]
+            else:
+                ledger.hours.pop(cell, None)
+                ledger.amount.pop(cell, None)
+
+    def _finalize(self) -> None:
+        final = self.ledger.copy()
+        buffer = RowBuffer()
+        finalize_allocation(final, buffer, self.networks, self.medico_total)
+        self.final = final
+        self.tail = merge_rows(buffer.rows) if self.merge_chunks else buffer.rows
+
+    def _allocate(self, slot: Slot, ledger: DemandLedger) -> List[AllocationTuple]:
+        buffer = RowBuffer()
+        if slot.person is not None:
+            allocate_person(slot.person, self.networks, ledger, buffer, self.consume_all)
+        return buffer.rows
+
+    def _set_rows(self, slot: Slot, rows: List[AllocationTuple]) -> None:
+        slot.rows = rows
+        slot.output = merge_rows(rows) if self.merge_chunks else rows
+
+
+def merge_rows(rows: List[AllocationTuple]) -> List[AllocationTuple]:
+    merged: List[AllocationTuple] = []
+    positions: Dict[tuple, int] = {}
+    for row in rows:
+        key = (row[0], row[1], row[2], row[4])
+        position = positions.get(key)
+        if position is None:
+            positions[key] = len(merged)
+            merged.append(row)
+            continue
+        last = merged[position]
+        merged[position] = (last[0], last[1], last[2], last[3] + row[3], last[4], last[5] + row[5])
+    return merged
+
+
+def rows_to_dicts(rows: Iterator[AllocationTuple]) -> List[dict]:
+    return [dict(zip(ROW_FIELDS, row)) for row in rows]
+
+
+def _snapshot(remaining: Remaining) -> Remaining:
+    return {role: dict(values) for role, values in remaining.items()}
+
+
+def _cells(rows: List[AllocationTuple]) -> Set[Cell]:
+    return {(row[2], row[1]) for row in rows}
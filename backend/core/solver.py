@@ -0,0 +1,226 @@
+from __future__ import annotations
+
+import math
+import time
+from typing import Dict, List, Tuple
+
+from .allocation import (
+    ROLE_DEFAULTS,
+    allocate_director,
+    allocate_reperibilita,
+    allocate_with_ledger,
+    demand_table,
+    effective_roles,
+    emit_row,
+    finalize_allocation,
+    prioritize_roles,
+    round_up_step,
+)
+from .ledger import DemandLedger
+from .models import AllocationTable, PersonInput
+from .parsing import normalize_name
+
+UNIT = 0.5
+DEMAND_REWARD = 1000
+EPSILON = 1e-9
+
+Group = Tuple[str, ...]
+
+
+class FlowGraph:
+    def __init__(self, nodes: int) -> None:
+        self.nodes = nodes
+        self.edges: List[List[int]] = []
+        self.adjacency: List[List[int]] = [[] for _ in range(nodes)]
+
+    def add_edge(self, source: int, target: int, capacity: int, cost: int) -> int:
+        idx = len(self.edges)
+        self.edges.append([source, target, capacity, cost])
+        self.edges.append([target, source, 0, -cost])
+        self.adjacency[source].append(idx)
+        self.adjacency[target].append(idx + 1)
+        return idx
+
+    def flow(self, edge: int) -> int:
+        return self.edges[edge ^ 1][2]
+
+    def min_cost_flow(self, source: int, sink: int) -> int:
+        total_cost = 0
+        while True:
+            distance = [math.inf] * self.nodes
+            via = [-1] * self.nodes
+            distance[source] = 0
+            for _ in range(self.nodes):
+                changed = False
+                for node in range(self.nodes):
+                    if distance[node] == math.inf:
+                        continue
+                    for idx in self.adjacency[node]:
+                        _source, target, capacity, cost = self.edges[idx]
+                        if capacity > 0 and distance[node] + cost < distance[target]:
+                            distance[target] = distance[node] + cost
+                            via[target] = idx
+                            changed = True
+                if not changed:
+                    break
+            if distance[sink] >= 0:
+                return total_cost
+            push = math.inf
+            node = sink
+            while node != source:
+                edge = self.edges[via[node]]
+                push = min(push, edge[2])
+                node = edge[0]
+            node = sink
+            while node != source:
+                idx = via[node]
+                self.edges[idx][2] -= push
+                self.edges[idx ^ 1][2] += push
+                node = self.edges[idx][0]
+            total_cost += push * distance[sink]
+
+
+def solve_role_flows(
+    supply: Dict[Group, int],
+    capacity: Dict[str, int],
+) -> Dict[Group, Dict[str, int]]:
+    groups = list(supply)
+    roles = list(capacity)
+    source = 0
+    sink = 1 + len(groups) + len(roles)
+    graph = FlowGraph(sink + 1)
+    role_node = {role: 1 + len(groups) + idx for idx, role in enumerate(roles)}
+    edges: Dict[Group, Dict[str, int]] = {}
+    for idx, group in enumerate(groups):
+        node = 1 + idx
+        graph.add_edge(source, node, supply[group], 0)
+        edges[group] = {
+            role: graph.add_edge(node, role_node[role], supply[group], rank) for rank, role in enumerate(group)
+        }
+    for role in roles:
+        graph.add_edge(role_node[role], sink, capacity[role], -DEMAND_REWARD)
+    graph.min_cost_flow(source, sink)
+    return {
+        group: {role: graph.flow(edge) for role, edge in role_edges.items()} for group, role_edges in edges.items()
+    }
+
+
+def allocate_optimal(
+    people: List[PersonInput],
+    networks: List[str],
+    year: int,
+    month: int,
+    consume_all: bool = True,
+    medico_total: float = 0.0,
+    compare_greedy: bool = False,
+) -> Tuple[AllocationTable, DemandLedger]:
+    started = time.perf_counter()
+    ledger = DemandLedger(demand_table(networks, year, month))
+    allocations = AllocationTable()
+
+    members: Dict[Group, List[Tuple[float, int, str, float]]] = {}
+    reperibilita: List[Tuple[str, float]] = []
+    for position, person in enumerate(people):
+        name = normalize_name(person.name)
+        day_hours = person.ore_ordinarie + person.ore_straordinarie
+        roles = effective_roles(name, person.roles)
+        if "DIRETTORE" in roles and day_hours > 0:
+            allocate_director(name, day_hours, person.costo_orario, networks, ledger, allocations)
+            day_hours = 0.0
+        group = tuple(
+            role for role in prioritize_roles(roles) if role != "DIRETTORE" and role in ledger.remaining
+        )
+        if group and day_hours > 0:
+            members.setdefault(group, []).append((person.costo_orario, position, name, day_hours))
+        if person.ore_reperibilita > 0:
+            reperibilita.append((name, person.ore_reperibilita))
+
+    supply = {
+        group: sum(_units(hours) for _cost, _position, _name, hours in group_members)
+        for group, group_members in members.items()
+    }
+    capacity = {
+        role: sum(_units(value) for value in ledger.remaining[role].values())
+        for role in sorted({role for group in members for role in group}, key=list(ledger.remaining).index)
+    }
+    flows = solve_role_flows(supply, capacity)
+
+    cursors: Dict[str, int] = {}
+    for group, group_members in members.items():
+        quotas = [[role, flows[group][role] * UNIT] for role in group]
+        for cost_hour, _position, name, hours in sorted(group_members):
+            leftover = 0.0
+            for quota in quotas:
+                if hours <= 0:
+                    break
+                if quota[1] <= 0:
+                    continue
+                piece = min(hours, quota[1])
+                quota[1] -= piece
+                hours -= piece
+                leftover += _spread(name, quota[0], piece, cost_hour, networks, ledger, allocations, cursors, False)
+            hours += leftover
+            if hours > EPSILON and consume_all:
+                _spread(name, group[0], hours, cost_hour, networks, ledger, allocations, cursors, True)
+
+    for name, hours in reperibilita:
+        allocate_reperibilita(name, hours, networks, ledger, allocations, consume_all)
+    finalize_allocation(ledger, allocations, networks, medico_total)
+
+    shortfall, overshoot, off = ledger.deviation()
+    ledger.stats = {
+        "solve_ms": round((time.perf_counter() - started) * 1000, 3),
+        "shortfall_hours": shortfall,
+        "overshoot_hours": overshoot,
+        "cells_off": off,
+    }
+    if compare_greedy:
+        started = time.perf_counter()
+        _greedy_table, greedy = allocate_with_ledger(people, networks, year, month, consume_all, medico_total)
+        greedy_shortfall, greedy_overshoot, greedy_off = greedy.deviation()
+        ledger.stats.update(
+            {
+                "greedy_ms": round((time.perf_counter() - started) * 1000, 3),
+                "greedy_shortfall_hours": greedy_shortfall,
+                "greedy_overshoot_hours": greedy_overshoot,
+                "greedy_cells_off": greedy_off,
+                "gap_hours": (greedy_shortfall + greedy_overshoot) - (shortfall + overshoot),
+            }
+        )
+    return allocations, ledger
+
+
+def _units(hours: float) -> int:
+    return int(round(round_up_step(hours, UNIT) / UNIT))
+
+
+def _spread(
+    name: str,
+    role: str,
+    hours: float,
+    cost_hour: float,
+    networks: List[str],
+    ledger: DemandLedger,
+    allocations: AllocationTable,
+    cursors: Dict[str, int],
+    overflow: bool,
+) -> float:
+    chunk = ROLE_DEFAULTS.get(role, {}).get("chunk", 7.5)
+    while hours > EPSILON and networks:
+        network = ledger.neediest(role)
+        remaining = ledger.remaining[role][network]
+        if remaining <= EPSILON:
+            if not overflow:
+                return hours
+            cursor = cursors.get(role, 0)
+            network = networks[cursor % len(networks)]
+            cursors[role] = cursor + 1
+            assign = min(chunk, hours)
+        else:
+            assign = min(chunk, hours, remaining)
+        if assign < chunk:
+            assign = round_up_step(assign, UNIT)
+        emit_row(allocations, ledger, name, network, role, assign, cost_hour)
+        ledger.consume(role, network, assign)
+        hours -= assign
+    return max(hours, 0.0) if hours > EPSILON else 0.0
@@ -0,0 +1,236 @@
+from __future__ import annotations
+
+from typing import List, Mapping, Tuple
+
+import numpy as np
+
+from .allocation import (
+    REPERIBILITA_COST,
+    ROLE_DEFAULTS,
+    allocate_with_ledger,
+    demand_table,
+    prioritize_roles,
+    round_up_step,
+)
+from .ledger import DemandLedger
+from .models import AllocationTable, DemandSummary, PersonInput
+from .parsing import normalize_name
+
+ROLES = list(ROLE_DEFAULTS)
+ROLE_INDEX = {role: idx for idx, role in enumerate(ROLES)}
+CHUNKS = np.array([ROLE_DEFAULTS[role]["chunk"] for role in ROLES], dtype=float)
+
+# People are still walked one by one in Python; NumPy only speeds up spreading
+# each person's chunks over the networks. With 1000 people it overtakes the
+# greedy engine at about 20 networks with consume_all and 50 without, and is
+# up to 2x slower on the 5 networks /compute uses, so the engine delegates to
+# greedy (identical rows) below this size.
+VECTORIZED_MIN_NETWORKS = 50
+
+
+class _RowBuffer:
+    def __init__(self) -> None:
+        self.names: List[str] = []
+        self.name_ids: List[np.ndarray] = []
+        self.network_ids: List[np.ndarray] = []
+        self.role_ids: List[np.ndarray] = []
+        self.hours: List[np.ndarray] = []
+        self.costs: List[np.ndarray] = []
+
+    def add_name(self, name: str) -> int:
+        self.names.append(name)
+        return len(self.names) - 1
+
+    def extend(self, name_id: int, role_id: int, network_ids: np.ndarray, hours: np.ndarray, cost: float) -> None:
+        if not len(network_ids):
+            return
+        self.name_ids.append(np.full(len(network_ids), name_id, dtype=np.int64))
+        self.network_ids.append(network_ids.astype(np.int64, copy=False))
+        self.role_ids.append(np.full(len(network_ids), role_id, dtype=np.int64))
+        self.hours.append(hours.astype(float, copy=False))
+        self.costs.append(np.full(len(network_ids), cost, dtype=float))
+
+    def columns(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        if not self.hours:
+            empty_ids = np.zeros(0, dtype=np.int64)
+            empty = np.zeros(0, dtype=float)
+            return empty_ids, empty_ids, empty_ids, empty, empty
+        return (
+            np.concatenate(self.name_ids),
+            np.concatenate(self.network_ids),
+            np.concatenate(self.role_ids),
+            np.concatenate(self.hours),
+            np.concatenate(self.costs),
+        )
+
+
+def _chunk_plan(hours: float, chunk: float) -> Tuple[int, float]:
+    full = int(hours // chunk)
+    remainder = hours - full * chunk
+    last = round_up_step(remainder, 0.5) if remainder > 0 else 0.0
+    return full, last
+
+
+def _assign_chunks(
+    demand: np.ndarray,
+    role_id: int,
+    hours: float,
+    cost: float,
+    name_id: int,
+    buffer: _RowBuffer,
+    consume_all: bool,
+) -> float:
+    network_count = demand.shape[1]
+    if hours <= 0 or network_count == 0:
+        return hours
+
+    chunk = float(CHUNKS[role_id])
+    full, last = _chunk_plan(hours, chunk)
+    total_chunks = full + (1 if last > 0 else 0)
+
+    if consume_all:
+        picked = np.arange(total_chunks) % network_count
+    else:
+        remaining = demand[role_id]
+        depth = min(total_chunks, int(np.ceil(remaining.max() / chunk)))
+        if depth <= 0:
+            return hours
+        levels = remaining[:, None] - np.arange(depth)[None, :] * chunk
+        flat = levels.ravel()
+        order = np.argsort(-flat, kind="stable")
+        available = int(np.count_nonzero(flat > 0))
+        picked = order[: min(total_chunks, available)] // depth
+
+    assigned = np.full(len(picked), chunk)
+    if len(picked) == total_chunks and last > 0:
+        assigned[-1] = last
+    buffer.extend(name_id, role_id, picked, assigned, cost)
+
+    consumed = np.bincount(picked, weights=assigned, minlength=network_count)
+    demand[role_id] = np.maximum(0.0, demand[role_id] - consumed)
+
+    if len(picked) < total_chunks:
+        return hours - len(picked) * chunk
+    hours = hours - full * chunk
+    if last > 0:
+        hours -= last
+    return hours
+
+
+def demand_matrix(demands: Mapping[str, Mapping[str, float]], networks: List[str]) -> np.ndarray:
+    matrix = np.zeros((len(ROLES), len(networks)), dtype=float)
+    for role_id, role in enumerate(ROLES):
+        matrix[role_id] = [demands[role][network] for network in networks]
+    return matrix
+
+
+def allocate_hours_vectorized(
+    people: List[PersonInput],
+    networks: List[str],
+    year: int,
+    month: int,
+    consume_all: bool = True,
+    medico_total: float = 0.0,
+) -> Tuple[AllocationTable, List[DemandSummary]]:
+    allocations, ledger = allocate_vectorized_with_ledger(
+        people, networks, year, month, consume_all, medico_total
+    )
+    return allocations, ledger.summary()
+
+
+def allocate_vectorized_engine(
+    people: List[PersonInput],
+    networks: List[str],
+    year: int,
+    month: int,
+    consume_all: bool = True,
+    medico_total: float = 0.0,
+) -> Tuple[AllocationTable, DemandLedger]:
+    engine = allocate_vectorized_with_ledger if len(networks) >= VECTORIZED_MIN_NETWORKS else allocate_with_ledger
+    return engine(people, networks, year, month, consume_all, medico_total)
+
+
+def allocate_vectorized_with_ledger(
+    people: List[PersonInput],
+    networks: List[str],
+    year: int,
+    month: int,
+    consume_all: bool = True,
+    medico_total: float = 0.0,
+) -> Tuple[AllocationTable, DemandLedger]:
+    demands = demand_table(networks, year, month)
+    ledger = DemandLedger(demands)
+    demand = demand_matrix(demands, networks)
+    network_count = len(networks)
+    all_networks = np.arange(network_count)
+    buffer = _RowBuffer()
+
+    director = ROLE_INDEX["DIRETTORE"]
+    reperibilita = ROLE_INDEX["REPERIBILITA"]
+    medico = ROLE_INDEX["MEDICO"]
+
+    for person in people:
+        name = normalize_name(person.name)
+        name_id = buffer.add_name(name)
+        day_hours = person.ore_ordinarie + person.ore_straordinarie
+        rep_hours = person.ore_reperibilita
+
+        roles = list(person.roles)
+        if name == "CLAUDIO ALI":
+            roles = ["OG"]
+        if name == "DOMENICA MOIO":
+            roles = ["DIRETTORE"]
+
+        if "DIRETTORE" in roles and day_hours > 0:
+            if network_count:
+                per = round_up_step(day_hours / network_count, 0.5)
+                assigned = np.full(network_count, per)
+                buffer.extend(name_id, director, all_networks, assigned, person.costo_orario)
+                demand[director] = np.maximum(0.0, demand[director] - per)
+            day_hours = 0.0
+
+        for role in prioritize_roles(roles):
+            if role == "DIRETTORE" or role not in ROLE_INDEX:
+                continue
+            day_hours = _assign_chunks(
+                demand, ROLE_INDEX[role], day_hours, person.costo_orario, name_id, buffer, consume_all
+            )
+
+        if rep_hours > 0:
+            _assign_chunks(demand, reperibilita, rep_hours, REPERIBILITA_COST, name_id, buffer, consume_all)
+
+    total_rep_demand = sum(demand[reperibilita].tolist())
+    if total_rep_demand > 0:
+        fallback_id = buffer.add_name("ALESSANDRO RICHARD")
+        _assign_chunks(demand, reperibilita, total_rep_demand, REPERIBILITA_COST, fallback_id, buffer, True)
+
+    total_medico_hours = sum(demand[medico].tolist())
+    cost_hour = (medico_total / total_medico_hours) if total_medico_hours else 0.0
+    medico_id = buffer.add_name("DOTT. ENRICO CHIARA")
+    buffer.extend(medico_id, medico, all_networks, demand[medico].copy(), cost_hour)
+    demand[medico] = 0.0
+
+    name_ids, network_ids, role_ids, hours, costs = buffer.columns()
+    amounts = hours * costs
+    allocations = AllocationTable()
+    name_map = np.array([allocations.intern_name(name) for name in buffer.names], dtype=np.uintc)
+    network_map = np.array([allocations.intern_network(network) for network in networks], dtype=np.uintc)
+    role_map = np.array([allocations.intern_role(role) for role in ROLES], dtype=np.uintc)
+    allocations.name_ids.frombytes(name_map[name_ids].tobytes())
+    allocations.network_ids.frombytes(network_map[network_ids].tobytes())
+    allocations.role_ids.frombytes(role_map[role_ids].tobytes())
+    allocations.hours.frombytes(hours.tobytes())
+    allocations.cost_hour.frombytes(costs.tobytes())
+    allocations.amount.frombytes(amounts.tobytes())
+
+    cells = role_ids * network_count + network_ids
+    cell_hours = np.bincount(cells, weights=hours, minlength=len(ROLES) * network_count)
+    cell_amounts = np.bincount(cells, weights=amounts, minlength=len(ROLES) * network_count)
+    touched, first_seen = np.unique(cells, return_index=True)
+    for cell in touched[np.argsort(first_seen)].tolist():
+        role_id, network_id = divmod(cell, network_count)
+        ledger.record(ROLES[role_id], networks[network_id], float(cell_hours[cell]), float(cell_amounts[cell]))
+    for role_id, role in enumerate(ROLES):
+        for network_id, network in enumerate(networks):
+            ledger.set_remaining(role, network, float(demand[role_id, network_id]))
+    return allocations, ledger
@@ -0,0 +1,138 @@
+from __future__ import annotations
+
+import re
+import zipfile
+from typing import IO, Iterable, List, Optional, Sequence, Union
+from xml.sax.saxutils import escape
+
+from .zip_stream import DateTime, zip_entry
+
+Cell = Union[str, float, int, None]
+
+CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/xl/workbook.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+    '<Override PartName="/xl/worksheets/sheet1.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+    '<Override PartName="/xl/styles.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+    "</Types>"
+)
+
+ROOT_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+    'Target="xl/workbook.xml"/>'
+    "</Relationships>"
+)
+
+WORKBOOK_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+    'Target="worksheets/sheet1.xml"/>'
+    '<Relationship Id="rId2" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" '
+    'Target="styles.xml"/>'
+    "</Relationships>"
+)
+
+WORKBOOK = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+    'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+    '<sheets><sheet name="{name}" sheetId="1" r:id="rId1"/></sheets>'
+    "</workbook>"
+)
+
+STYLES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+    '<fonts count="2"><font><sz val="11"/><name val="Calibri"/></font>'
+    '<font><b/><sz val="11"/><name val="Calibri"/></font></fonts>'
+    '<fills count="2"><fill><patternFill patternType="none"/></fill>'
+    '<fill><patternFill patternType="gray125"/></fill></fills>'
+    '<borders count="2"><border><left/><right/><top/><bottom/><diagonal/></border>'
+    '<border><left style="thin"/><right style="thin"/><top style="thin"/><bottom style="thin"/>'
+    "<diagonal/></border></borders>"
+    '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+    '<cellXfs count="2"><xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+    '<xf numFmtId="0" fontId="1" fillId="0" borderId="1" xfId="0" applyFont="1" applyBorder="1" '
+    'applyAlignment="1"><alignment horizontal="center" vertical="top"/></xf></cellXfs>'
+    '<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>'
+    "</styleSheet>"
+)
+
+SHEET_OPEN = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+)
+SHEET_CLOSE = "</sheetData></worksheet>"
+
+ILLEGAL_XML_CHARS = re.compile(r"[\x00-\x08\x0b\x0c\x0e-\x1f]")
+
+HEADER_STYLE = 1
+FLUSH_ROWS = 1000
+
+
+def column_letter(idx: int) -> str:
+    letters = ""
+    idx += 1
+    while idx:
+        idx, remainder = divmod(idx - 1, 26)
+        letters = chr(65 + remainder) + letters
+    return letters
+
+
+def row_xml(row_number: int, values: Sequence[Cell], columns: List[str], style: int = 0) -> str:
+    style_attr = f' s="{style}"' if style else ""
+    cells = []
+    for column, value in zip(columns, values):
+        ref = f"{column}{row_number}"
+        if value is None:
+            continue
+        if isinstance(value, str):
+            text = escape(ILLEGAL_XML_CHARS.sub("", value))
+            cells.append(f'<c r="{ref}"{style_attr} t="inlineStr"><is><t>{text}</t></is></c>')
+        else:
+            cells.append(f'<c r="{ref}"{style_attr}><v>{value!r}</v></c>')
+    return f'<row r="{row_number}">{"".join(cells)}</row>'
+
+
+def write_table_xlsx(
+    target: IO[bytes],
+    sheet_name: str,
+    header: Sequence[str],
+    rows: Iterable[Sequence[Cell]],
+    compresslevel: int = 6,
+    date_time: Optional[DateTime] = None,
+) -> int:
+    columns = [column_letter(idx) for idx in range(len(header))]
+    count = 0
+    with zipfile.ZipFile(target, "w", zipfile.ZIP_DEFLATED, compresslevel=compresslevel) as zf:
+        parts = [
+            ("[Content_Types].xml", CONTENT_TYPES),
+            ("_rels/.rels", ROOT_RELS),
+            ("xl/workbook.xml", WORKBOOK.format(name=escape(sheet_name, {'"': "&quot;"}))),
+            ("xl/_rels/workbook.xml.rels", WORKBOOK_RELS),
+            ("xl/styles.xml", STYLES),
+        ]
+        for name, xml in parts:
+            zf.writestr(zip_entry(zf, name, date_time), xml)
+        with zf.open(zip_entry(zf, "xl/worksheets/sheet1.xml", date_time), "w") as sheet:
+            buffer = [SHEET_OPEN, row_xml(1, header, columns, HEADER_STYLE)]
+            for count, values in enumerate(rows, start=1):
+                buffer.append(row_xml(count + 1, values, columns))
+                if len(buffer) >= FLUSH_ROWS:
+                    sheet.write("".join(buffer).encode("utf-8"))
+                    buffer.clear()
+            buffer.append(SHEET_CLOSE)
+            sheet.write("".join(buffer).encode("utf-8"))
+    return count
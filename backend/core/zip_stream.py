@@ -0,0 +1,78 @@
+from __future__ import annotations
+
+import io
+import zipfile
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+DEFAULT_CHUNK_SIZE = 64 * 1024
+
+DateTime = Tuple[int, int, int, int, int, int]
+
+
+def zip_entry(zf: zipfile.ZipFile, name: str, date_time: Optional[DateTime]):
+    if date_time is None:
+        return name
+    info = zipfile.ZipInfo(name, date_time)
+    info.compress_type = zf.compression
+    set_compress_level(info, zf.compresslevel)
+    info.external_attr = 0o600 << 16
+    return info
+
+
+def set_compress_level(info: zipfile.ZipInfo, level: Optional[int]) -> None:
+    # ZipFile.open takes no compresslevel, so the level has to travel on the
+    # ZipInfo: public since Python 3.13, private before that.
+    if hasattr(info, "compress_level"):
+        info.compress_level = level
+    elif hasattr(info, "_compresslevel"):
+        info._compresslevel = level
+
+
+class ChunkSink(io.RawIOBase):
+    def __init__(self) -> None:
+        self.chunks: List[bytes] = []
+        self.pending = 0
+        self.offset = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        size = len(data)
+        if size:
+            self.chunks.append(bytes(data))
+            self.pending += size
+            self.offset += size
+        return size
+
+    def tell(self) -> int:
+        return self.offset
+
+    def drain(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks.clear()
+        self.pending = 0
+        return data
+
+
+def iter_zip_files(
+    files: Iterable[Tuple[str, str]],
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    compresslevel: int = 6,
+    date_time: Optional[DateTime] = None,
+) -> Iterator[bytes]:
+    sink = ChunkSink()
+    with zipfile.ZipFile(sink, "w", zipfile.ZIP_DEFLATED, compresslevel=compresslevel) as zf:
+        for arcname, path in files:
+            with open(path, "rb") as source, zf.open(zip_entry(zf, arcname, date_time), "w") as entry:
+                while True:
+                    data = source.read(chunk_size)
+                    if not data:
+                        break
+                    entry.write(data)
+                    if sink.pending >= chunk_size:
+                        yield sink.drain()
+            if sink.pending:
+                yield sink.drain()
+    if sink.pending:
+        yield sink.drain()
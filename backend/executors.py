@@ -0,0 +1,123 @@
+from __future__ import annotations
+
+import asyncio
+import contextvars
+import logging
+import os
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from functools import partial
+from typing import Any, AsyncIterator, Callable, Optional
+
+from instrumentation import profiled, record_stage
+
+logger = logging.getLogger("cas.executors")
+
+
+class Saturated(Exception):
+    def __init__(self, retry_after: int) -> None:
+        super().__init__("Server busy")
+        self.retry_after = retry_after
+
+
+class ExecutorLayer:
+    def __init__(
+        self,
+        thread_workers: int,
+        process_workers: int,
+        max_pending: int,
+        retry_after: int,
+    ) -> None:
+        self.thread_workers = thread_workers
+        self.process_workers = process_workers
+        self.max_pending = max_pending
+        self.retry_after = retry_after
+        self.pending = 0
+        self._threads: Optional[ThreadPoolExecutor] = None
+        self._processes: Optional[ProcessPoolExecutor] = None
+
+    @classmethod
+    def from_env(cls) -> "ExecutorLayer":
+        cpus = os.cpu_count() or 1
+        return cls(
+            thread_workers=int(os.getenv("EXECUTOR_THREADS", min(32, cpus + 4))),
+            process_workers=int(os.getenv("EXECUTOR_PROCESSES", cpus)),
+            max_pending=max(1, int(os.getenv("EXECUTOR_MAX_PENDING", 64))),
+            retry_after=int(os.getenv("EXECUTOR_RETRY_AFTER", 5)),
+        )
+
+    @property
+    def threads(self) -> ThreadPoolExecutor:
+        if self._threads is None:
+            self._threads = ThreadPoolExecutor(max_workers=self.thread_workers, thread_name_prefix="cas")
+        return self._threads
+
+    @property
+    def processes(self) -> ProcessPoolExecutor:
+        if self._processes is None:
+            self._processes = ProcessPoolExecutor(max_workers=self.process_workers)
+        return self._processes
+
+    def acquire(self, weight: int = 1) -> None:
+        weight = min(weight, self.max_pending)
+        if self.pending + weight > self.max_pending:
+            raise Saturated(self.retry_after)
+        self.pending += weight
+
+    def release(self, weight: int = 1) -> None:
+        self.pending = max(0, self.pending - min(weight, self.max_pending))
+
+    @asynccontextmanager
+    async def admitted(self, weight: int = 1) -> AsyncIterator[None]:
+        self.acquire(weight)
+        try:
+            yield
+        finally:
+            self.release(weight)
+
+    async def _run(
+        self,
+        executor: Executor,
+        stage: str,
+        fn: Callable[..., Any],
+        *args: Any,
+        **kwargs: Any,
+    ) -> Any:
+        loop = asyncio.get_running_loop()
+        call = partial(fn, *args, **kwargs)
+        if isinstance(executor, ThreadPoolExecutor):
+            call = partial(contextvars.copy_context().run, profiled, call)
+        started = time.perf_counter()
+        try:
+            return await loop.run_in_executor(executor, call)
+        finally:
+            elapsed = time.perf_counter() - started
+            record_stage(stage, elapsed)
+            logger.debug("stage %s took %.1fms", stage, elapsed * 1000)
+
+    async def run_thread(
+        self,
+        stage: str,
+        fn: Callable[..., Any],
+        *args: Any,
+        **kwargs: Any,
+    ) -> Any:
+        return await self._run(self.threads, stage, fn, *args, **kwargs)
+
+    async def run_process(
+        self,
+        stage: str,
+        fn: Callable[..., Any],
+        *args: Any,
+        **kwargs: Any,
+    ) -> Any:
+        return await self._run(self.processes, stage, fn, *args, **kwargs)
+
+    def shutdown(self) -> None:
+        if self._threads is not None:
+            self._threads.shutdown(wait=False, cancel_futures=True)
+            self._threads = None
+        if self._processes is not None:
+            self._processes.shutdown(wait=False, cancel_futures=True)
+            self._processes = None
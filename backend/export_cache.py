@@ -0,0 +1,152 @@
+from __future__ import annotations
+
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+
+def file_hash(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as handle:
+        for block in iter(lambda: handle.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class ExportEntryWriter:
+    def __init__(self, cache: "ExportCache", template_hash: str, key: str) -> None:
+        self.cache = cache
+        self.template_hash = template_hash
+        self.key = key
+        directory = cache.directory / template_hash
+        directory.mkdir(parents=True, exist_ok=True)
+        fd, name = tempfile.mkstemp(dir=directory, suffix=".part")
+        self.tmp = Path(name)
+        self.handle = os.fdopen(fd, "wb")
+
+    def write(self, data: bytes) -> None:
+        self.handle.write(data)
+
+    def commit(self) -> None:
+        self.handle.close()
+        self.cache._commit(self.tmp, self.template_hash, self.key)
+
+    def abort(self) -> None:
+        self.handle.close()
+        self.tmp.unlink(missing_ok=True)
+
+
+class ExportCache:
+    def __init__(self, directory: Path, max_bytes: int = 512 * 1024 * 1024) -> None:
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[Path, int]" = OrderedDict()
+        self._templates: Dict[Tuple[str, int, int], str] = {}
+        self._lock = threading.Lock()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        directory.mkdir(parents=True, exist_ok=True)
+        for path in directory.glob("*/*.part"):
+            path.unlink(missing_ok=True)
+        for path in sorted(directory.glob("*/*.zip"), key=lambda item: item.stat().st_mtime):
+            self._entries[path] = path.stat().st_size
+            self.size += self._entries[path]
+
+    @classmethod
+    def from_env(cls, storage_dir: Path) -> "ExportCache":
+        return cls(
+            storage_dir / "exports",
+            max_bytes=int(os.getenv("EXPORT_CACHE_MAX_BYTES", 512 * 1024 * 1024)),
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def template_hash(self, template_path: Path) -> str:
+        stat = template_path.stat()
+        stamp = (str(template_path), stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            digest = self._templates.get(stamp)
+        if digest is None:
+            digest = file_hash(template_path)
+            with self._lock:
+                self._templates[stamp] = digest
+        return digest
+
+    def _path(self, template_hash: str, key: str) -> Path:
+        return self.directory / template_hash / f"{key}.zip"
+
+    def get(self, template_hash: str, key: str) -> Optional[Path]:
+        path = self._path(template_hash, key)
+        with self._lock:
+            if path not in self._entries or not path.exists():
+                self._forget(path)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(path)
+            self.hits += 1
+        os.utime(path)
+        return path
+
+    def writer(self, template_hash: str, key: str) -> Optional[ExportEntryWriter]:
+        if not self.enabled:
+            return None
+        return ExportEntryWriter(self, template_hash, key)
+
+    def _commit(self, tmp: Path, template_hash: str, key: str) -> None:
+        path = self._path(template_hash, key)
+        try:
+            size = tmp.stat().st_size
+            if size > self.max_bytes:
+                tmp.unlink(missing_ok=True)
+                return
+            tmp.replace(path)
+        except OSError:
+            return
+        with self._lock:
+            self._forget(path)
+            self._entries[path] = size
+            self.size += size
+            while self.size > self.max_bytes and self._entries:
+                victim, victim_size = self._entries.popitem(last=False)
+                self.size -= victim_size
+                self.evictions += 1
+                victim.unlink(missing_ok=True)
+
+    def _forget(self, path: Path) -> None:
+        size = self._entries.pop(path, None)
+        if size is not None:
+            self.size -= size
+
+    def invalidate(self, template_hash: str) -> int:
+        directory = self.directory / template_hash
+        removed = 0
+        with self._lock:
+            for path in list(self._entries):
+                if path.parent == directory:
+                    self._forget(path)
+                    removed += 1
+            self._templates = {
+                stamp: digest for stamp, digest in self._templates.items() if digest != template_hash
+            }
+        shutil.rmtree(directory, ignore_errors=True)
+        return removed
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self.size,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
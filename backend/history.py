@@ -0,0 +1,452 @@
+from __future__ import annotations
+
+import itertools
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from core.models import AllocationTuple, DemandSummary, PersonInput
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    result_hash TEXT NOT NULL,
+    year INTEGER NOT NULL,
+    month INTEGER NOT NULL,
+    engine TEXT NOT NULL,
+    consume_all INTEGER NOT NULL,
+    medico_total REAL NOT NULL,
+    inputs TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    last_run_at REAL NOT NULL,
+    repeats INTEGER NOT NULL DEFAULT 0,
+    complete INTEGER NOT NULL DEFAULT 0,
+    row_count INTEGER NOT NULL DEFAULT 0,
+    hours REAL NOT NULL DEFAULT 0,
+    amount REAL NOT NULL DEFAULT 0,
+    solver TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_runs_period ON runs (year, month, complete, last_run_at);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_runs_result ON runs (result_hash) WHERE complete = 1;
+CREATE TABLE IF NOT EXISTS allocations (
+    run_id INTEGER NOT NULL,
+    year INTEGER NOT NULL,
+    month INTEGER NOT NULL,
+    person TEXT NOT NULL,
+    network TEXT NOT NULL,
+    role TEXT NOT NULL,
+    hours REAL NOT NULL,
+    cost_hour REAL NOT NULL,
+    amount REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_allocations_period ON allocations (year, month, run_id);
+CREATE INDEX IF NOT EXISTS idx_allocations_person ON allocations (person, run_id);
+CREATE INDEX IF NOT EXISTS idx_allocations_network ON allocations (network, year, month);
+CREATE TABLE IF NOT EXISTS checks (
+    run_id INTEGER NOT NULL,
+    role TEXT NOT NULL,
+    network TEXT NOT NULL,
+    demand REAL NOT NULL,
+    allocated REAL NOT NULL,
+    diff REAL NOT NULL,
+    ok INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_checks_run ON checks (run_id);
+"""
+
+STALE_AFTER = 3600.0
+LATEST_RUNS = (
+    "SELECT id FROM (SELECT id, MAX(last_run_at) FROM runs WHERE complete = 1 {where} GROUP BY year, month)"
+)
+
+
+class PendingRun:
+    __slots__ = ("run_id", "result_hash", "year", "month", "started_at", "rows", "hours", "amount", "failed")
+
+    def __init__(self, run_id: Optional[int], result_hash: str, year: int, month: int, started_at: float) -> None:
+        self.run_id = run_id
+        self.result_hash = result_hash
+        self.year = year
+        self.month = month
+        self.started_at = started_at
+        self.rows = 0
+        self.hours = 0.0
+        self.amount = 0.0
+        self.failed = False
+
+
+class HistoryRun:
+    def __init__(self, history: "RunHistory", token: int) -> None:
+        self.history = history
+        self.token = token
+        self.dropped = False
+
+    def rows(self, rows: Iterable[AllocationTuple]) -> None:
+        if not self.dropped and not self.history._offer(("rows", self.token, rows)):
+            self.dropped = True
+
+    def finish(self, summary: List[DemandSummary], solver: Optional[Dict[str, Any]] = None) -> None:
+        if self.dropped:
+            self.abort()
+        else:
+            self.history._put(("finish", self.token, (summary, solver)))
+
+    def abort(self) -> None:
+        self.history._put(("abort", self.token, None))
+
+
+class RunHistory:
+    def __init__(
+        self,
+        path: Optional[Path],
+        batch_size: int = 32,
+        flush_interval: float = 0.5,
+        max_queue: int = 256,
+    ) -> None:
+        self.path = path
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self.max_queue = max(1, max_queue)
+        self._queue: "queue.Queue[Tuple[str, int, Any]]" = queue.Queue()
+        self._backlog = 0
+        self._orphans: List[PendingRun] = []
+        self._tokens = itertools.count(1)
+        self._lock = threading.Lock()
+        self._writer: Optional[threading.Thread] = None
+        self._writer_pid = 0
+        self._schema_ready = False
+        self.runs = 0
+        self.repeats = 0
+        self.rows_written = 0
+        self.batches = 0
+        self.errors = 0
+        self.dropped = 0
+
+    @classmethod
+    def from_env(cls, storage_dir: Path) -> "RunHistory":
+        path = Path(os.getenv("HISTORY_DB", storage_dir / "history.sqlite3"))
+        return cls(
+            path=path if os.getenv("HISTORY_ENABLED", "1") == "1" else None,
+            batch_size=int(os.getenv("HISTORY_BATCH", 32)),
+            flush_interval=float(os.getenv("HISTORY_FLUSH_MS", 500)) / 1000,
+            max_queue=int(os.getenv("HISTORY_MAX_QUEUE", 256)),
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return self.path is not None
+
+    def start(
+        self,
+        result_hash: str,
+        year: int,
+        month: int,
+        engine: str,
+        consume_all: bool,
+        medico_total: float,
+        people: List[PersonInput],
+    ) -> Optional[HistoryRun]:
+        if not self.enabled:
+            return None
+        token = next(self._tokens)
+        run = (result_hash, year, month, engine, consume_all, medico_total, people, time.time())
+        if not self._offer(("start", token, run)):
+            return None
+        return HistoryRun(self, token)
+
+    def flush(self) -> None:
+        if self._writer is not None and self._writer.is_alive():
+            self._queue.join()
+
+    def _offer(self, item: Tuple[str, int, Any]) -> bool:
+        with self._lock:
+            if self._backlog >= self.max_queue:
+                self.dropped += 1
+                return False
+            self._backlog += 1
+        self._put(item)
+        return True
+
+    def _put(self, item: Tuple[str, int, Any]) -> None:
+        self._ensure_writer()
+        self._queue.put(item)
+
+    def _ensure_writer(self) -> None:
+        pid = os.getpid()
+        with self._lock:
+            if self._writer is not None and self._writer_pid == pid and self._writer.is_alive():
+                return
+            self._writer_pid = pid
+            self._writer = threading.Thread(target=self._write_loop, name="history-writer", daemon=True)
+            self._writer.start()
+
+    def _connect(self) -> sqlite3.Connection:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        connection = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        if not self._schema_ready:
+            connection.executescript(SCHEMA)
+            self._schema_ready = True
+        return connection
+
+    def _write_loop(self) -> None:
+        connection: Optional[sqlite3.Connection] = None
+        state: Dict[int, PendingRun] = {}
+        while True:
+            items = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while len(items) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    items.append(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            try:
+                if connection is None:
+                    connection = self._connect()
+                    connection.isolation_level = None
+                    self._sweep(connection)
+                self._write_batch(connection, state, items)
+            except Exception:
+                self.errors += 1
+                for _kind, token, _data in items:
+                    state.pop(token, None)
+                if connection is not None:
+                    connection.close()
+                    connection = None
+            finally:
+                bounded = sum(1 for kind, _token, _data in items if kind in ("start", "rows"))
+                with self._lock:
+                    self._backlog -= bounded
+                for _item in items:
+                    self._queue.task_done()
+
+    def _write_batch(
+        self,
+        connection: sqlite3.Connection,
+        state: Dict[int, PendingRun],
+        items: List[Tuple[str, int, Any]],
+    ) -> None:
+        started = {token for kind, token, _data in items if kind == "start"}
+        earlier = {token: state[token] for _kind, token, _data in items if token in state}
+        orphans, self._orphans = self._orphans, []
+        try:
+            connection.execute("BEGIN")
+            for run in orphans:
+                self._delete(connection, run)
+            for item in items:
+                connection.execute("SAVEPOINT item")
+                try:
+                    self._write(connection, state, item)
+                except Exception:
+                    self.errors += 1
+                    connection.execute("ROLLBACK TO item")
+                    self._discard(connection, state, item)
+                connection.execute("RELEASE item")
+            connection.execute("COMMIT")
+            self.batches += 1
+        except Exception:
+            self.errors += 1
+            if connection.in_transaction:
+                connection.execute("ROLLBACK")
+            self._orphans = orphans + self._orphans
+            for token in started:
+                state.pop(token, None)
+            for token, run in earlier.items():
+                if token in state:
+                    run.failed = True
+                else:
+                    self._orphans.append(run)
+
+    def _discard(self, connection: sqlite3.Connection, state: Dict[int, PendingRun], item: Tuple[str, int, Any]) -> None:
+        kind, token, _data = item
+        run = state.get(token)
+        if run is None or run.run_id is None:
+            return
+        if kind == "rows":
+            run.failed = True
+            return
+        del state[token]
+        self._delete(connection, run)
+
+    def _delete(self, connection: sqlite3.Connection, run: PendingRun) -> None:
+        connection.execute(
+            "DELETE FROM allocations WHERE year = ? AND month = ? AND run_id = ?", (run.year, run.month, run.run_id)
+        )
+        connection.execute("DELETE FROM checks WHERE run_id = ?", (run.run_id,))
+        connection.execute("DELETE FROM runs WHERE id = ? AND complete = 0", (run.run_id,))
+
+    def _sweep(self, connection: sqlite3.Connection) -> None:
+        stale = time.time() - STALE_AFTER
+        connection.execute("BEGIN")
+        connection.execute(
+            "DELETE FROM allocations WHERE run_id IN (SELECT id FROM runs WHERE complete = 0 AND created_at < ?)",
+            (stale,),
+        )
+        connection.execute(
+            "DELETE FROM checks WHERE run_id IN (SELECT id FROM runs WHERE complete = 0 AND created_at < ?)", (stale,)
+        )
+        connection.execute("DELETE FROM runs WHERE complete = 0 AND created_at < ?", (stale,))
+        connection.execute("COMMIT")
+
+    def _write(self, connection: sqlite3.Connection, state: Dict[int, PendingRun], item: Tuple[str, int, Any]) -> None:
+        kind, token, data = item
+        if kind == "start":
+            result_hash, year, month, engine, consume_all, medico_total, people, started_at = data
+            if self._repeat(connection, result_hash, started_at):
+                state[token] = PendingRun(None, result_hash, year, month, started_at)
+                return
+            cursor = connection.execute(
+                "INSERT INTO runs (result_hash, year, month, engine, consume_all, medico_total, inputs, created_at,"
+                " last_run_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    result_hash,
+                    year,
+                    month,
+                    engine,
+                    int(consume_all),
+                    medico_total,
+                    json.dumps([person.__dict__ for person in people], ensure_ascii=False),
+                    started_at,
+                    started_at,
+                ),
+            )
+            state[token] = PendingRun(cursor.lastrowid, result_hash, year, month, started_at)
+            return
+        run = state.get(token)
+        if run is None:
+            return
+        if kind == "rows":
+            if run.run_id is None or run.failed:
+                return
+            rows = [(run.run_id, run.year, run.month, *row) for row in data]
+            connection.executemany("INSERT INTO allocations VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            run.rows += len(rows)
+            run.hours += sum(row[6] for row in rows)
+            run.amount += sum(row[8] for row in rows)
+            self.rows_written += len(rows)
+            return
+        if run.run_id is None:
+            del state[token]
+            return
+        if kind == "finish" and (run.failed or self._repeat(connection, run.result_hash, run.started_at)):
+            kind = "abort"
+        if kind == "finish":
+            summary, solver = data
+            connection.executemany(
+                "INSERT INTO checks VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (run.run_id, check.role, check.network, check.demand, check.allocated, check.diff, int(check.ok))
+                    for check in summary
+                ],
+            )
+            connection.execute(
+                "UPDATE runs SET complete = 1, row_count = ?, hours = ?, amount = ?, solver = ? WHERE id = ?",
+                (run.rows, run.hours, run.amount, json.dumps(solver) if solver else None, run.run_id),
+            )
+            self.runs += 1
+        else:
+            self._delete(connection, run)
+        del state[token]
+
+    def _repeat(self, connection: sqlite3.Connection, result_hash: str, started_at: float) -> bool:
+        cursor = connection.execute(
+            "UPDATE runs SET last_run_at = MAX(last_run_at, ?), repeats = repeats + 1"
+            " WHERE result_hash = ? AND complete = 1",
+            (started_at, result_hash),
+        )
+        if cursor.rowcount:
+            self.repeats += 1
+        return bool(cursor.rowcount)
+
+    def _query(self, sql: str, params: Tuple) -> List[tuple]:
+        connection = self._connect()
+        try:
+            return connection.execute(sql, params).fetchall()
+        finally:
+            connection.close()
+
+    def list_runs(self, year: Optional[int] = None, month: Optional[int] = None, limit: int = 50) -> List[dict]:
+        where, params = _period_filter(year, month)
+        rows = self._query(
+            "SELECT id, result_hash, year, month, engine, consume_all, medico_total, created_at, last_run_at, repeats,"
+            f" row_count, hours, amount FROM runs WHERE complete = 1 {where} ORDER BY last_run_at DESC LIMIT ?",
+            (*params, limit),
+        )
+        fields = (
+            "id",
+            "result_hash",
+            "year",
+            "month",
+            "engine",
+            "consume_all",
+            "medico_total",
+            "created_at",
+            "last_run_at",
+            "repeats",
+            "row_count",
+            "hours",
+            "amount",
+        )
+        return [{**dict(zip(fields, row)), "consume_all": bool(row[5])} for row in rows]
+
+    def person_hours(self, person: str, year: Optional[int] = None) -> List[dict]:
+        where, params = _period_filter(year, None)
+        rows = self._query(
+            "SELECT year, month, role, SUM(hours), SUM(amount) FROM allocations"
+            f" WHERE person = ? AND run_id IN ({LATEST_RUNS.format(where=where)})"
+            " GROUP BY year, month, role ORDER BY year, month, role",
+            (person, *params),
+        )
+        return [
+            {"year": year, "month": month, "role": role, "hours": hours, "amount": amount}
+            for year, month, role, hours, amount in rows
+        ]
+
+    def network_costs(self, year: int, month: int) -> Dict[str, Any]:
+        latest = LATEST_RUNS.format(where="AND year = ? AND month <= ?")
+        months = self._query(f"SELECT month FROM runs WHERE id IN ({latest}) ORDER BY month", (year, month))
+        rows = self._query(
+            "SELECT network, SUM(hours), SUM(amount) FROM allocations"
+            f" WHERE year = ? AND month <= ? AND run_id IN ({latest})"
+            " GROUP BY network ORDER BY network",
+            (year, month, year, month),
+        )
+        return {
+            "year": year,
+            "month": month,
+            "months": [row[0] for row in months],
+            "networks": [{"network": network, "hours": hours, "amount": amount} for network, hours, amount in rows],
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "queued": self._queue.qsize(),
+            "runs": self.runs,
+            "repeats": self.repeats,
+            "rows": self.rows_written,
+            "batches": self.batches,
+            "errors": self.errors,
+            "dropped": self.dropped,
+        }
+
+
+def _period_filter(year: Optional[int], month: Optional[int]) -> Tuple[str, Tuple]:
+    clauses = []
+    params: List[int] = []
+    if year is not None:
+        clauses.append("AND year = ?")
+        params.append(year)
+    if month is not None:
+        clauses.append("AND month = ?")
+        params.append(month)
+    return " ".join(clauses), tuple(params)
@@ -0,0 +1,328 @@
+from __future__ import annotations
+
+import asyncio
+import cProfile
+import logging
+import os
+import pstats
+import random
+import re
+import threading
+import time
+import tracemalloc
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from starlette.datastructures import MutableHeaders
+
+logger = logging.getLogger("cas.instrumentation")
+
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+ROW_BUCKETS = (1, 10, 100, 1_000, 10_000, 100_000, 1_000_000)
+BYTE_BUCKETS = (2**16, 2**20, 2**22, 2**24, 2**26, 2**28, 2**30)
+
+
+class StageTimings:
+    def __init__(self) -> None:
+        self.stages: Dict[str, float] = {}
+        self.rows: Dict[str, int] = {}
+        self.peaks: Dict[str, int] = {}
+
+    def add(self, stage: str, seconds: float) -> None:
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def add_rows(self, stage: str, rows: int) -> None:
+        self.rows[stage] = self.rows.get(stage, 0) + rows
+
+    def add_peak(self, stage: str, peak: int) -> None:
+        self.peaks[stage] = max(self.peaks.get(stage, 0), peak)
+
+    def server_timing(self, total: Optional[float] = None) -> str:
+        entries = []
+        for stage, seconds in self.stages.items():
+            entry = f"{stage};dur={seconds * 1000:.1f}"
+            details = []
+            if stage in self.rows:
+                details.append(f"rows={self.rows[stage]}")
+            if stage in self.peaks:
+                details.append(f"peak={self.peaks[stage]}")
+            if details:
+                entry += f';desc="{" ".join(details)}"'
+            entries.append(entry)
+        if total is not None:
+            entries.append(f"total;dur={total * 1000:.1f}")
+        return ", ".join(entries)
+
+
+request_timings: ContextVar[Optional[StageTimings]] = ContextVar("request_timings", default=None)
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, labels: Sequence[str], buckets: Sequence[float]) -> None:
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series: Dict[Tuple[str, ...], List[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels: Sequence[str], value: float) -> None:
+        key = tuple(str(label) for label in labels)
+        idx = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0.0] * (len(self.buckets) + 3)
+            series[idx] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted((key, list(values)) for key, values in self._series.items())
+        for key, values in series:
+            labels = ",".join(f'{name}="{_escape(value)}"' for name, value in zip(self.labels, key))
+            prefix = f"{labels}," if labels else ""
+            cumulative = 0.0
+            for bound, count in zip(self.buckets, values):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{prefix}le="{bound:g}"}} {cumulative:g}')
+            cumulative += values[len(self.buckets)]
+            lines.append(f'{self.name}_bucket{{{prefix}le="+Inf"}} {cumulative:g}')
+            suffix = f"{{{labels}}}" if labels else ""
+            lines.append(f"{self.name}_sum{suffix} {values[-2]:.6f}")
+            lines.append(f"{self.name}_count{suffix} {values[-1]:g}")
+        return lines
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Metrics:
+    def __init__(self) -> None:
+        self.requests = Histogram(
+            "cas_request_duration_seconds",
+            "Request latency per endpoint.",
+            ("method", "endpoint", "status"),
+            SECONDS_BUCKETS,
+        )
+        self.stages = Histogram(
+            "cas_stage_duration_seconds", "Duration of each processing stage.", ("stage",), SECONDS_BUCKETS
+        )
+        self.rows = Histogram("cas_stage_rows", "Rows handled by each processing stage.", ("stage",), ROW_BUCKETS)
+        self.peaks = Histogram(
+            "cas_stage_peak_bytes", "Peak traced allocation during each stage.", ("stage",), BYTE_BUCKETS
+        )
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for histogram in (self.requests, self.stages, self.rows, self.peaks):
+            lines.extend(histogram.render())
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+
+def record_stage(stage: str, seconds: float) -> None:
+    timings = request_timings.get()
+    if timings is not None:
+        timings.add(stage, seconds)
+    metrics.stages.observe((stage,), seconds)
+
+
+def record_rows(stage: str, rows: int) -> None:
+    timings = request_timings.get()
+    if timings is not None:
+        timings.add_rows(stage, rows)
+    metrics.rows.observe((stage,), rows)
+
+
+def record_peak(stage: str, peak: int) -> None:
+    timings = request_timings.get()
+    if timings is not None:
+        timings.add_peak(stage, peak)
+    metrics.peaks.observe((stage,), peak)
+
+
+class _PeakTracker:
+    # tracemalloc keeps a single process-wide peak: only a stage that runs
+    # alone may reset and read it, overlapping stages report no peak.
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._owner: Optional[object] = None
+        self._shared = False
+
+    def enter(self) -> Optional[Tuple[object, int]]:
+        with self._lock:
+            if self._owner is not None:
+                self._shared = True
+                return None
+            token = object()
+            self._owner = token
+            self._shared = False
+            tracemalloc.reset_peak()
+            return token, tracemalloc.get_traced_memory()[0]
+
+    def exit(self, token: object, baseline: int) -> Optional[int]:
+        with self._lock:
+            if self._owner is not token:
+                return None
+            self._owner = None
+            if self._shared:
+                return None
+            return max(0, tracemalloc.get_traced_memory()[1] - baseline)
+
+
+_peaks = _PeakTracker()
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    owned = _peaks.enter() if tracemalloc.is_tracing() else None
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(name, time.perf_counter() - started)
+        if owned is not None:
+            peak = _peaks.exit(*owned)
+            if peak is not None:
+                record_peak(name, peak)
+
+
+class RequestProfile:
+    # cProfile only sees the thread that enabled it, so every worker call of
+    # the request gets its own profiler and the stats are merged at the end.
+    def __init__(self) -> None:
+        self.profiles: List[cProfile.Profile] = []
+        self._lock = threading.Lock()
+
+    def run(self, fn: Callable[[], Any]) -> Any:
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            return fn()
+        finally:
+            profile.disable()
+            with self._lock:
+                self.profiles.append(profile)
+
+    def dump(self, path: Path) -> bool:
+        with self._lock:
+            profiles = list(self.profiles)
+        if not profiles:
+            return False
+        stats = pstats.Stats(profiles[0])
+        for profile in profiles[1:]:
+            stats.add(profile)
+        stats.dump_stats(path)
+        return True
+
+
+request_profile: ContextVar[Optional[RequestProfile]] = ContextVar("request_profile", default=None)
+
+
+def profiled(fn: Callable[[], Any]) -> Any:
+    profile = request_profile.get()
+    if profile is None:
+        return fn()
+    return profile.run(fn)
+
+
+class SlowRequestProfiler:
+    def __init__(self, directory: Path, threshold_ms: Optional[float], sample_rate: float = 0.1) -> None:
+        self.directory = directory
+        self.threshold_ms = threshold_ms
+        self.sample_rate = sample_rate
+        self.dumped = 0
+
+    @classmethod
+    def from_env(cls, storage_dir: Path) -> "SlowRequestProfiler":
+        threshold = os.getenv("PROFILE_THRESHOLD_MS")
+        return cls(
+            storage_dir / "profiles",
+            threshold_ms=float(threshold) if threshold else None,
+            sample_rate=float(os.getenv("PROFILE_SAMPLE_RATE", 0.1)),
+        )
+
+    def start(self) -> Optional[RequestProfile]:
+        if self.threshold_ms is None or random.random() >= self.sample_rate:
+            return None
+        return RequestProfile()
+
+    def finish(self, profile: Optional[RequestProfile], seconds: float, label: str) -> Optional[Path]:
+        if profile is None:
+            return None
+        elapsed_ms = seconds * 1000
+        if elapsed_ms < self.threshold_ms:
+            return None
+        self.directory.mkdir(parents=True, exist_ok=True)
+        slug = re.sub(r"[^A-Za-z0-9]+", "_", label).strip("_")
+        path = self.directory / f"{time.strftime('%Y%m%d-%H%M%S')}-{slug}-{elapsed_ms:.0f}ms.prof"
+        if not profile.dump(path):
+            return None
+        self.dumped += 1
+        logger.warning("%s took %.0fms, profile saved to %s", label, elapsed_ms, path)
+        return path
+
+
+class InstrumentationMiddleware:
+    def __init__(self, app: Callable, profiler: Optional[SlowRequestProfiler] = None) -> None:
+        self.app = app
+        self.profiler = profiler
+        self._paths: Dict[Any, str] = {}
+
+    async def __call__(self, scope: dict, receive: Callable, send: Callable) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timings = StageTimings()
+        token = request_timings.set(timings)
+        profile = self.profiler.start() if self.profiler is not None else None
+        profile_token = request_profile.set(profile)
+        started = time.perf_counter()
+        status = 500
+
+        async def send_with_timings(message: dict) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                headers = MutableHeaders(scope=message)
+                headers.append("Server-Timing", timings.server_timing(time.perf_counter() - started))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timings)
+        finally:
+            elapsed = time.perf_counter() - started
+            endpoint = self.endpoint_label(scope)
+            metrics.requests.observe((scope["method"], endpoint, status), elapsed)
+            request_profile.reset(profile_token)
+            request_timings.reset(token)
+            if profile is not None:
+                # Merging and writing the stats blocks, so keep it off the event loop.
+                label = f"{scope['method']} {endpoint}"
+                await asyncio.get_running_loop().run_in_executor(
+                    None, self.profiler.finish, profile, elapsed, label
+                )
+
+    def endpoint_label(self, scope: dict) -> str:
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return "unmatched"
+        path = self._paths.get(endpoint)
+        if path is None:
+            path = "unmatched"
+            for route in scope["app"].router.routes:
+                if getattr(route, "endpoint", None) is endpoint:
+                    path = route.path
+                    break
+            self._paths[endpoint] = path
+        return path
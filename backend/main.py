@@ -1,25 +1,85 @@
 from __future__ import annotations
 
+import asyncio
+import json
+import math
+import os
+import shutil
+import sys
+import tempfile
+import tracemalloc
+from dataclasses import asdict
+from functools import partial
+from itertools import islice
 from pathlib import Path
-from typing import List
+from typing import Callable, Iterator, List, Literal, Optional, Tuple
 
-from fastapi import FastAPI, File, HTTPException, UploadFile
+from fastapi import Depends, FastAPI, File, Form, HTTPException, Request, Response, UploadFile
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, StreamingResponse
-from pydantic import BaseModel, Field
-
-from core.allocation import allocate_hours, allocations_to_dicts, summary_to_dicts
-from core.excel_export import build_export_zip
-from core.models import PersonInput
-from core.parsing import apply_alias, merge_people, parse_text_block
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, Field, ValidationError
+
+from core.allocation import (
+    ALLOCATION_VERSION,
+    FIRST_YEAR,
+    LAST_YEAR,
+    NETWORKS,
+    allocations_to_dicts,
+    demand_table,
+    iter_allocation,
+    role_config_key,
+    summary_to_dicts,
+    warm_demand_cache,
+)
+from core.batch import BatchAggregate, month_range, run_month
+from core.columnar import (
+    COLUMNAR_JSON,
+    JSON,
+    MSGPACK,
+    NDJSON,
+    columnar_result,
+    encode_json,
+    encode_msgpack,
+    msgpack_available,
+)
+from core.engines import ENGINES, select_engine
+from core.ledger import DemandLedger
+from core.models import AllocationTable, AllocationTuple, PersonInput
+from core.pdf import PageTextCache, content_hash, extract_page_range, ocr_pages, page_batches, page_count
+from core.parsing import IncrementalParser, PeopleMerger, apply_alias, merge_people, parse_text_block
+from core.roster import RosterError, read_roster
+from core.session import AllocationSession, Operation, SessionDelta, rows_to_dicts
+from core.zip_stream import iter_zip_files
+from executors import ExecutorLayer, Saturated
+from export_cache import ExportCache, ExportEntryWriter
+from history import HistoryRun, RunHistory
+from instrumentation import InstrumentationMiddleware, SlowRequestProfiler, metrics, record_rows, stage
+from result_cache import ResultCache, canonical_hash
+from session_store import SessionStore
 
 BASE_DIR = Path(__file__).parent
 STORAGE_DIR = BASE_DIR / "storage"
 TEMPLATE_DIR = STORAGE_DIR / "templates"
+EXPORT_ZIP_LEVEL = int(os.getenv("EXPORT_ZIP_LEVEL", 6))
+EXPORT_CHUNK_SIZE = int(os.getenv("EXPORT_CHUNK_SIZE", 64 * 1024))
+EXPORT_DETERMINISTIC = os.getenv("EXPORT_DETERMINISTIC", "0") == "1"
+PARSE_BATCH_BYTES = int(os.getenv("PARSE_BATCH_BYTES", 64 * 1024))
+COMPUTE_STREAM_ROWS = int(os.getenv("COMPUTE_STREAM_ROWS", 1000))
+VARY_ACCEPT = {"Vary": "Accept"}
+# Bump when the exported workbooks or the archive layout change.
+EXPORT_FORMAT_VERSION = 1
 
 STORAGE_DIR.mkdir(parents=True, exist_ok=True)
 TEMPLATE_DIR.mkdir(parents=True, exist_ok=True)
 
+executors = ExecutorLayer.from_env()
+pdf_text_cache = PageTextCache.from_env(STORAGE_DIR)
+result_cache = ResultCache.from_env(STORAGE_DIR)
+export_cache = ExportCache.from_env(STORAGE_DIR)
+sessions = SessionStore.from_env()
+history = RunHistory.from_env(STORAGE_DIR)
+profiler = SlowRequestProfiler.from_env(STORAGE_DIR)
+
 app = FastAPI(title="CAS Prospetti API")
 
 app.add_middleware(
@@ -27,7 +87,78 @@ app.add_middleware(
     allow_origins=["*"],
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing"],
 )
+app.add_middleware(InstrumentationMiddleware, profiler=profiler)
+
+
+WARMUP_TEXT = "BUSTA PAGA 1\nNome: Mario Rossi\nRuolo: OS OG\nOre ordinarie: 10\nCosto orario: 12,50\n"
+
+
+def warm_up() -> None:
+    warm_demand_cache(NETWORKS)
+    merge_people(parse_text_block(WARMUP_TEXT))
+
+
+@app.on_event("startup")
+def warm_caches() -> None:
+    if os.getenv("WARM_DEMAND_CACHE", "0") == "1":
+        warm_up()
+    if os.getenv("METRICS_TRACEMALLOC", "0") == "1" and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+
+@app.on_event("shutdown")
+def shutdown_executors() -> None:
+    history.flush()
+    executors.shutdown()
+
+
+@app.exception_handler(Saturated)
+async def saturated_handler(request: Request, exc: Saturated) -> JSONResponse:
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Server busy, retry later"},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+
+class DuplexStreamingResponse(StreamingResponse):
+    async def __call__(self, scope, receive, send) -> None:
+        await self.stream_response(send)
+        if self.background is not None:
+            await self.background()
+
+
+class AdmittedStreamingResponse(StreamingResponse):
+    def __init__(self, content, weight: int = 1, **kwargs) -> None:
+        executors.acquire(weight)
+        self.weight = weight
+        super().__init__(content, **kwargs)
+
+    async def __call__(self, scope, receive, send) -> None:
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            executors.release(self.weight)
+
+
+class CleanupStreamingResponse(StreamingResponse):
+    # The body generator never starts when the client leaves before the first
+    # chunk, so cleanup of resources made for it belongs to the response.
+    def __init__(self, content, cleanup: Callable[[], None], **kwargs) -> None:
+        self.cleanup = cleanup
+        super().__init__(content, **kwargs)
+
+    async def __call__(self, scope, receive, send) -> None:
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self.cleanup()
+
+
+class AdmittedDuplexStreamingResponse(AdmittedStreamingResponse, DuplexStreamingResponse):
+    pass
 
 
 class ParseTextRequest(BaseModel):
@@ -50,58 +181,237 @@ class ComputeRequest(BaseModel):
     people: List[PersonPayload]
     consume_all_hours: bool = True
     medico_total: float = 0.0
+    engine: str = "greedy"
+    merge_chunks: bool = False
+    compare_greedy: bool = False
+
+
+class BatchJob(BaseModel):
+    year: int
+    month: int
+    people: List[PersonPayload]
+
+
+class BatchComputeRequest(BaseModel):
+    jobs: List[BatchJob] = Field(default_factory=list)
+    people: List[PersonPayload] = Field(default_factory=list)
+    start_year: Optional[int] = None
+    start_month: Optional[int] = None
+    end_year: Optional[int] = None
+    end_month: Optional[int] = None
+    consume_all_hours: bool = True
+    medico_total: float = 0.0
+    engine: str = "greedy"
 
 
 class ComputeResponse(BaseModel):
     consuntivo: List[dict]
     pivot: List[dict]
     check: List[dict]
+    result_hash: Optional[str] = None
+    solver: Optional[dict] = None
+
+
+class SessionResponse(ComputeResponse):
+    session_id: str
+    version: int
+
+
+class SessionOperation(BaseModel):
+    op: Literal["add", "update", "remove"]
+    index: Optional[int] = None
+    person: Optional[PersonPayload] = None
+
+
+class SessionPatch(BaseModel):
+    operations: List[SessionOperation]
+
+
+class SessionDeltaResponse(BaseModel):
+    session_id: str
+    version: int
+    rows: int
+    consuntivo: List[dict]
+    pivot: List[dict]
+    pivot_removed: List[dict]
+    check: List[dict]
 
 
 @app.post("/parse-text")
-async def parse_text(payload: ParseTextRequest) -> JSONResponse:
-    people = merge_people(parse_text_block(payload.text))
+async def parse_text(request: Request) -> Response:
+    content_type = request.headers.get("content-type", "application/json")
+    if not content_type.startswith("application/json"):
+        return AdmittedDuplexStreamingResponse(stream_parsed_people(request), media_type="application/x-ndjson")
+
+    try:
+        payload = ParseTextRequest.model_validate(await request.json())
+    except (ValueError, ValidationError) as exc:
+        raise HTTPException(status_code=422, detail=str(exc))
+    async with executors.admitted():
+        people = await executors.run_thread("parse", parse_people, payload.text)
+    record_rows("parse", len(people))
     return JSONResponse(content={"people": [person.__dict__ for person in people]})
 
 
-@app.post("/compute", response_model=ComputeResponse)
-async def compute(payload: ComputeRequest) -> ComputeResponse:
-    if payload.year < 2000 or payload.year > 2100:
-        raise HTTPException(status_code=400, detail="Invalid year")
-    if payload.month < 1 or payload.month > 12:
-        raise HTTPException(status_code=400, detail="Invalid month")
-    validate_people(payload.people)
+@app.post("/parse-pdf")
+async def parse_pdf(file: UploadFile = File(...)) -> JSONResponse:
+    if not file.filename or not file.filename.lower().endswith(".pdf"):
+        raise HTTPException(status_code=400, detail="File must be .pdf")
+    data = await file.read()
+    digest = content_hash(data)
 
-    people = []
-    for person in payload.people:
-        name = apply_alias(person.name)
-        if not name:
-            continue
-        people.append(
-            PersonInput(
-                name=name,
-                ore_ordinarie=person.ore_ordinarie,
-                ore_straordinarie=person.ore_straordinarie,
-                ore_reperibilita=person.ore_reperibilita,
-                costo_orario=person.costo_orario,
-                roles=person.roles,
-                forfait_total=person.forfait_total,
-            )
-        )
+    async with executors.admitted():
+        texts, stats = await extract_pdf_text(data, digest)
+        people = await executors.run_thread("parse", parse_people, "\n".join(texts))
+    return JSONResponse(
+        content={"people": [person.__dict__ for person in people], **stats},
+    )
 
-    allocations, summary = allocate_hours(
-        people=people,
-        networks=["RETE1", "RETE2", "RETE3", "RETE4", "RETE5"],
-        year=payload.year,
-        month=payload.month,
-        consume_all=payload.consume_all_hours,
-        medico_total=payload.medico_total,
+
+def roster_settings(
+    year: int = Form(...),
+    month: int = Form(...),
+    consume_all_hours: bool = Form(True),
+    medico_total: float = Form(0.0),
+    engine: str = Form("greedy"),
+    merge_chunks: bool = Form(False),
+    compare_greedy: bool = Form(False),
+) -> ComputeRequest:
+    return ComputeRequest(
+        year=year,
+        month=month,
+        people=[],
+        consume_all_hours=consume_all_hours,
+        medico_total=medico_total,
+        engine=engine,
+        merge_chunks=merge_chunks,
+        compare_greedy=compare_greedy,
     )
 
-    consuntivo = allocations_to_dicts(allocations)
-    pivot = build_pivot(consuntivo)
-    check = summary_to_dicts(summary)
-    return ComputeResponse(consuntivo=consuntivo, pivot=pivot, check=check)
+
+@app.post("/compute", response_model=ComputeResponse)
+async def compute(payload: ComputeRequest, request: Request) -> Response:
+    media_type = negotiate_compute(request.headers.get("accept"))
+    with stage("validate"):
+        validate_period(payload.year, payload.month)
+        validate_people(payload.people)
+        if payload.engine not in ENGINES:
+            raise HTTPException(status_code=400, detail="Invalid engine")
+    return await respond_compute(payload, media_type)
+
+
+@app.post("/compute-upload", response_model=ComputeResponse)
+async def compute_upload(
+    request: Request,
+    roster: UploadFile = File(...),
+    payload: ComputeRequest = Depends(roster_settings),
+) -> Response:
+    media_type = negotiate_compute(request.headers.get("accept"))
+    with stage("validate"):
+        validate_period(payload.year, payload.month)
+        if payload.engine not in ENGINES:
+            raise HTTPException(status_code=400, detail="Invalid engine")
+    return await respond_compute(payload, media_type, roster)
+
+
+async def respond_compute(payload: ComputeRequest, media_type: str, roster: Optional[UploadFile] = None) -> Response:
+    if media_type == NDJSON:
+        people = None
+        if roster is not None:
+            async with executors.admitted():
+                people = await load_upload(roster)
+        return AdmittedStreamingResponse(stream_compute(payload, people), media_type=NDJSON, headers=VARY_ACCEPT)
+
+    async with executors.admitted():
+        people = await load_upload(roster)
+        key, allocations, ledger = await executors.run_thread("allocate", run_allocation, payload, people, True)
+        record_rows("allocate", len(allocations))
+        body = await executors.run_thread("serialize", encode_compute, allocations, ledger, key, media_type)
+        return Response(content=body, media_type=media_type, headers=VARY_ACCEPT)
+
+
+@app.post("/compute-batch")
+async def compute_batch(payload: BatchComputeRequest) -> StreamingResponse:
+    if payload.engine not in ENGINES:
+        raise HTTPException(status_code=400, detail="Invalid engine")
+    jobs = build_batch_jobs(payload)
+    if not jobs:
+        raise HTTPException(status_code=400, detail="No months to compute")
+    return AdmittedStreamingResponse(stream_batch(jobs, payload), len(jobs), media_type="application/x-ndjson")
+
+
+@app.get("/metrics")
+async def metrics_endpoint() -> PlainTextResponse:
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/cache/stats")
+async def cache_stats() -> JSONResponse:
+    return JSONResponse(
+        content={
+            **result_cache.stats(),
+            "exports": export_cache.stats(),
+            "sessions": sessions.stats(),
+            "history": history.stats(),
+            "pdf_text": pdf_text_cache.stats(),
+        }
+    )
+
+
+@app.get("/history/runs")
+async def history_runs(year: Optional[int] = None, month: Optional[int] = None, limit: int = 50) -> JSONResponse:
+    check_history()
+    runs = await executors.run_thread("history", history.list_runs, year, month, min(max(limit, 1), 1000))
+    return JSONResponse(content={"runs": runs})
+
+
+@app.get("/history/people/{name}")
+async def history_person(name: str, year: Optional[int] = None) -> JSONResponse:
+    check_history()
+    person = apply_alias(name)
+    months = await executors.run_thread("history", history.person_hours, person, year)
+    return JSONResponse(content={"name": person, "months": months})
+
+
+@app.get("/history/networks")
+async def history_networks(year: int, month: int = 12) -> JSONResponse:
+    check_history()
+    validate_period(year, month)
+    return JSONResponse(content=await executors.run_thread("history", history.network_costs, year, month))
+
+
+@app.post("/sessions")
+async def create_session(payload: ComputeRequest) -> SessionResponse:
+    with stage("validate"):
+        validate_period(payload.year, payload.month)
+        validate_people(payload.people)
+        if payload.engine != "greedy":
+            raise HTTPException(status_code=400, detail="Sessions support only the greedy engine")
+
+    async with executors.admitted():
+        session = await executors.run_thread("allocate", build_session, payload)
+        record_rows("allocate", session.person_rows + len(session.tail))
+        session_id = sessions.create(session)
+        return await executors.run_thread("serialize", build_session_response, session_id, session)
+
+
+@app.patch("/sessions/{session_id}")
+async def patch_session(session_id: str, payload: SessionPatch) -> SessionDeltaResponse:
+    session = sessions.get(session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Session not found")
+    with stage("validate"):
+        operations = build_operations(payload.operations)
+
+    async with executors.admitted():
+        return await executors.run_thread("allocate", apply_session, session_id, session, operations)
+
+
+@app.delete("/sessions/{session_id}")
+async def delete_session(session_id: str) -> JSONResponse:
+    if not sessions.delete(session_id):
+        raise HTTPException(status_code=404, detail="Session not found")
+    return JSONResponse(content={"status": "deleted"})
 
 
 @app.post("/upload-template")
@@ -109,63 +419,569 @@ async def upload_template(template: UploadFile = File(...)) -> JSONResponse:
     if not template.filename or not template.filename.lower().endswith(".xlsx"):
         raise HTTPException(status_code=400, detail="Template must be .xlsx")
     target = TEMPLATE_DIR / "template.xlsx"
+    previous = export_cache.template_hash(target) if target.exists() else None
     target.write_bytes(await template.read())
+    if previous is not None and export_cache.template_hash(target) != previous:
+        export_cache.invalidate(previous)
     return JSONResponse(content={"status": "ok", "path": str(target)})
 
 
 @app.post("/export")
-async def export_zip(payload: ComputeRequest) -> StreamingResponse:
-    validate_people(payload.people)
-    people = []
-    for person in payload.people:
-        name = apply_alias(person.name)
-        if not name:
-            continue
-        people.append(
-            PersonInput(
-                name=name,
-                ore_ordinarie=person.ore_ordinarie,
-                ore_straordinarie=person.ore_straordinarie,
-                ore_reperibilita=person.ore_reperibilita,
-                costo_orario=person.costo_orario,
-                roles=person.roles,
-                forfait_total=person.forfait_total,
+async def export_zip(payload: ComputeRequest, request: Request) -> Response:
+    with stage("validate"):
+        validate_people(payload.people)
+    return await respond_export(payload, request)
+
+
+@app.post("/export-upload")
+async def export_upload(
+    request: Request,
+    roster: UploadFile = File(...),
+    payload: ComputeRequest = Depends(roster_settings),
+) -> Response:
+    return await respond_export(payload, request, roster)
+
+
+async def respond_export(payload: ComputeRequest, request: Request, roster: Optional[UploadFile] = None) -> Response:
+    from core.excel_export import export_date_time, write_consuntivo_part, write_template_part
+
+    template_path = TEMPLATE_DIR / "template.xlsx"
+    if not template_path.exists():
+        raise HTTPException(status_code=400, detail="Template missing. Upload first.")
+
+    filename = f"CAS_EXPORT_{payload.year}_{payload.month:02d}.zip"
+    async with executors.admitted():
+        people = await load_upload(roster)
+        if people is None:
+            people = await executors.run_thread("aliases", build_people, payload.people)
+        template_hash, key = await executors.run_thread("hash", export_key, payload, people, template_path)
+        etag = f'"{key}"' if EXPORT_DETERMINISTIC else f'W/"{key}"'
+        cached = export_cache.get(template_hash, key) if export_cache.enabled else None
+        if etag_matches(request.headers.get("if-none-match"), etag, cached is not None):
+            return Response(status_code=304, headers={"ETag": etag})
+        if cached is not None:
+            return FileResponse(cached, media_type="application/zip", filename=filename, headers={"ETag": etag})
+
+        workdir = tempfile.mkdtemp(prefix="export-")
+        try:
+            _key, allocations, _ledger = await executors.run_thread("allocate", run_allocation, payload, people)
+            record_rows("allocate", len(allocations))
+            parts = await asyncio.gather(
+                executors.run_process(
+                    "consuntivo",
+                    write_consuntivo_part,
+                    allocations,
+                    payload.year,
+                    payload.month,
+                    workdir,
+                    EXPORT_DETERMINISTIC,
+                ),
+                executors.run_process(
+                    "template",
+                    write_template_part,
+                    allocations,
+                    payload.year,
+                    payload.month,
+                    template_path,
+                    workdir,
+                    EXPORT_DETERMINISTIC,
+                ),
             )
+        except BaseException:
+            shutil.rmtree(workdir, ignore_errors=True)
+            raise
+
+    date_time = export_date_time(payload.year, payload.month) if EXPORT_DETERMINISTIC else None
+    return CleanupStreamingResponse(
+        stream_export(parts, workdir, date_time, partial(export_cache.writer, template_hash, key)),
+        partial(shutil.rmtree, workdir, ignore_errors=True),
+        media_type="application/zip",
+        headers={
+            "Content-Disposition": f"attachment; filename={filename}",
+            "ETag": etag,
+        },
+    )
+
+
+def stream_export(
+    parts: List[Tuple[str, str]],
+    workdir: str,
+    date_time: Optional[tuple] = None,
+    writer: Optional[Callable[[], ExportEntryWriter]] = None,
+) -> Iterator[bytes]:
+    completed = False
+    sink = writer() if writer is not None else None
+    try:
+        for chunk in iter_zip_files(
+            parts, chunk_size=EXPORT_CHUNK_SIZE, compresslevel=EXPORT_ZIP_LEVEL, date_time=date_time
+        ):
+            if sink is not None:
+                sink.write(chunk)
+            yield chunk
+        completed = True
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+        if sink is not None:
+            if completed:
+                sink.commit()
+            else:
+                sink.abort()
+
+
+def export_key(payload: ComputeRequest, people: List[PersonInput], template_path: Path) -> Tuple[str, str]:
+    template_hash = export_cache.template_hash(template_path)
+    key = canonical_hash(
+        {
+            "result": request_hash(payload, people),
+            "allocation": ALLOCATION_VERSION,
+            "roles": role_config_key(),
+            "format": EXPORT_FORMAT_VERSION,
+            "template": template_hash,
+            "zip_level": EXPORT_ZIP_LEVEL,
+            "deterministic": EXPORT_DETERMINISTIC,
+        }
+    )
+    return template_hash, key
+
+
+def etag_matches(header: Optional[str], etag: str, exists: bool) -> bool:
+    if not header:
+        return False
+    tags = {tag.strip().removeprefix("W/") for tag in header.split(",")}
+    if "*" in tags:
+        return exists
+    return etag.removeprefix("W/") in tags
+
+
+async def extract_pdf_text(data: bytes, digest: str) -> Tuple[List[str], dict]:
+    pages = pdf_text_cache.page_count(digest)
+    found: dict[int, str] = {}
+    missing: List[int] = []
+    if pages is not None:
+        found, missing = pdf_text_cache.lookup(digest, pages)
+    ocr_count = 0
+
+    if pages is None or missing:
+        with tempfile.NamedTemporaryFile(suffix=".pdf") as handle:
+            handle.write(data)
+            handle.flush()
+            if pages is None:
+                try:
+                    pages = await executors.run_thread("pdf_open", page_count, handle.name)
+                except Exception:
+                    raise HTTPException(status_code=400, detail="Invalid PDF")
+                pdf_text_cache.set_page_count(digest, pages)
+                found, missing = pdf_text_cache.lookup(digest, pages)
+            batches = page_batches(missing, executors.process_workers)
+            results = await asyncio.gather(
+                *(executors.run_process("pdf_extract", extract_page_range, handle.name, batch) for batch in batches)
+            )
+            extracted = dict(page for batch in results for page in batch)
+            textless = [page_number for page_number, text in extracted.items() if not text.strip()]
+            if textless:
+                extracted.update(await executors.run_process("pdf_ocr", ocr_pages, handle.name, sorted(textless)))
+                ocr_count = len(textless)
+        for page_number, text in extracted.items():
+            pdf_text_cache.put(digest, page_number, text)
+            found[page_number] = text
+
+    stats = {"pages": pages, "cached_pages": pages - len(missing), "ocr_pages": ocr_count}
+    return [found[page_number] for page_number in range(pages)], stats
+
+
+def parse_people(text: str) -> List[PersonInput]:
+    return merge_people(parse_text_block(text))
+
+
+async def stream_parsed_people(request: Request):
+    parser = IncrementalParser()
+    merger = PeopleMerger()
+    pending: List[bytes] = []
+    size = 0
+    async for chunk in request.stream():
+        pending.append(chunk)
+        size += len(chunk)
+        if size >= PARSE_BATCH_BYTES:
+            lines = await executors.run_thread("parse", parse_chunk, parser, merger, b"".join(pending))
+            pending, size = [], 0
+            if lines:
+                yield lines
+    lines = await executors.run_thread("parse", parse_chunk, parser, merger, b"".join(pending), True)
+    if lines:
+        yield lines
+    yield json.dumps({"type": "done", "count": len(merger.merged)}) + "\n"
+
+
+def parse_chunk(parser: IncrementalParser, merger: PeopleMerger, data: bytes, final: bool = False) -> str:
+    people = parser.feed(data)
+    if final:
+        people += parser.close()
+    # One frame per person touched by this batch, carrying the merged state so far.
+    touched = {}
+    for person in people:
+        merged = merger.add(person)
+        touched[id(merged)] = merged
+    return "".join(json.dumps({"type": "person", **person.__dict__}) + "\n" for person in touched.values())
+
+
+async def load_upload(roster: Optional[UploadFile]) -> Optional[List[PersonInput]]:
+    if roster is None:
+        return None
+    return await executors.run_thread("roster", load_roster, roster.filename or "", await roster.read())
+
+
+def load_roster(filename: str, data: bytes) -> List[PersonInput]:
+    try:
+        return read_roster(data, filename)
+    except RosterError as exc:
+        raise HTTPException(status_code=400, detail=str(exc)) from exc
+
+
+def build_people(people: List[PersonPayload]) -> List[PersonInput]:
+    result = []
+    for person in people:
+        built = build_person(person)
+        if built is not None:
+            result.append(built)
+    return result
+
+
+def build_person(person: PersonPayload) -> Optional[PersonInput]:
+    name = apply_alias(person.name)
+    if not name:
+        return None
+    return PersonInput(
+        name=name,
+        ore_ordinarie=person.ore_ordinarie,
+        ore_straordinarie=person.ore_straordinarie,
+        ore_reperibilita=person.ore_reperibilita,
+        costo_orario=person.costo_orario,
+        roles=person.roles,
+        forfait_total=person.forfait_total,
+    )
+
+
+def build_session(payload: ComputeRequest) -> AllocationSession:
+    with stage("aliases"):
+        people = [build_person(person) for person in payload.people]
+    return AllocationSession(
+        people,
+        NETWORKS,
+        payload.year,
+        payload.month,
+        consume_all=payload.consume_all_hours,
+        medico_total=payload.medico_total,
+        merge_chunks=payload.merge_chunks,
+    )
+
+
+def build_session_response(session_id: str, session: AllocationSession) -> SessionResponse:
+    with session.lock:
+        with stage("pivot"):
+            pivot = session.final.pivot()
+        return SessionResponse(
+            session_id=session_id,
+            version=session.version,
+            consuntivo=session.row_dicts(),
+            pivot=pivot,
+            check=summary_to_dicts(session.final.summary()),
         )
 
-    allocations, _summary = allocate_hours(
+
+def build_operations(operations: List[SessionOperation]) -> List[Operation]:
+    result: List[Operation] = []
+    for operation in operations:
+        person = None
+        if operation.op != "remove":
+            if operation.person is None:
+                raise HTTPException(status_code=400, detail=f"Operation {operation.op} needs a person")
+            validate_people([operation.person])
+            person = build_person(operation.person)
+        elif operation.index is None:
+            raise HTTPException(status_code=400, detail="Operation remove needs an index")
+        result.append((operation.op, operation.index, person))
+    return result
+
+
+def apply_session(session_id: str, session: AllocationSession, operations: List[Operation]) -> SessionDeltaResponse:
+    with session.lock:
+        try:
+            delta = session.apply(operations)
+        except (IndexError, ValueError) as exc:
+            raise HTTPException(status_code=400, detail=str(exc)) from exc
+    record_rows("allocate", sum(len(rows) for _start, _delete, rows in delta.splices))
+    return session_delta_response(session_id, delta)
+
+
+def session_delta_response(session_id: str, delta: SessionDelta) -> SessionDeltaResponse:
+    return SessionDeltaResponse(
+        session_id=session_id,
+        version=delta.version,
+        rows=delta.row_count,
+        consuntivo=[
+            {"start": start, "delete": delete, "rows": rows_to_dicts(rows)} for start, delete, rows in delta.splices
+        ],
+        pivot=delta.pivot,
+        pivot_removed=[{"network": network, "role": role} for role, network in delta.pivot_removed],
+        check=summary_to_dicts(delta.check),
+    )
+
+
+def check_history() -> None:
+    if not history.enabled:
+        raise HTTPException(status_code=404, detail="History disabled")
+
+
+def record_run(
+    key: str,
+    payload: ComputeRequest,
+    people: List[PersonInput],
+    allocations: AllocationTable,
+    ledger: DemandLedger,
+) -> None:
+    run = start_run(key, payload, people)
+    if run is not None:
+        run.rows(allocations.rows())
+        run.finish(ledger.summary(), ledger.stats or None)
+
+
+def start_run(key: str, payload: ComputeRequest, people: List[PersonInput]) -> Optional[HistoryRun]:
+    return history.start(
+        key,
+        payload.year,
+        payload.month,
+        payload.engine,
+        payload.consume_all_hours,
+        payload.medico_total,
+        people,
+    )
+
+
+def request_hash(payload: ComputeRequest, people: List[PersonInput]) -> str:
+    return canonical_hash(
+        {
+            "allocation": ALLOCATION_VERSION,
+            "roles": role_config_key(),
+            "year": payload.year,
+            "month": payload.month,
+            "networks": NETWORKS,
+            "consume_all_hours": payload.consume_all_hours,
+            "medico_total": payload.medico_total,
+            "engine": payload.engine,
+            "merge_chunks": payload.merge_chunks,
+            "compare_greedy": payload.compare_greedy,
+            "people": [asdict(person) for person in people],
+        }
+    )
+
+
+def run_allocation(
+    payload: ComputeRequest,
+    people: Optional[List[PersonInput]] = None,
+    record: bool = False,
+) -> Tuple[str, AllocationTable, DemandLedger]:
+    engine = select_engine(payload.engine, payload.compare_greedy)
+    if engine is None:
+        raise HTTPException(status_code=400, detail="Invalid engine")
+    if people is None:
+        with stage("aliases"):
+            people = build_people(payload.people)
+    key = request_hash(payload, people)
+    cached = result_cache.get(key)
+    if cached is not None:
+        if record:
+            record_run(key, payload, people, *cached)
+        return (key, *cached)
+
+    allocations, ledger = engine(
         people=people,
-        networks=["RETE1", "RETE2", "RETE3", "RETE4", "RETE5"],
+        networks=NETWORKS,
         year=payload.year,
         month=payload.month,
         consume_all=payload.consume_all_hours,
         medico_total=payload.medico_total,
     )
+    if payload.merge_chunks:
+        allocations = allocations.merged()
+    result_cache.put(key, (allocations, ledger))
+    if record:
+        record_run(key, payload, people, allocations, ledger)
+    return key, allocations, ledger
 
-    template_path = TEMPLATE_DIR / "template.xlsx"
-    if not template_path.exists():
-        raise HTTPException(status_code=400, detail="Template missing. Upload first.")
-    archive = build_export_zip(allocations, payload.year, payload.month, template_path)
 
-    filename = f"CAS_EXPORT_{payload.year}_{payload.month:02d}.zip"
-    return StreamingResponse(
-        iter([archive]),
-        media_type="application/zip",
-        headers={"Content-Disposition": f"attachment; filename={filename}"},
+def stream_compute(payload: ComputeRequest, people: Optional[List[PersonInput]] = None) -> Iterator[str]:
+    count = 0
+    run: Optional[HistoryRun] = None
+    try:
+        if people is None:
+            people = build_people(payload.people)
+        if history.enabled:
+            run = start_run(request_hash(payload, people), payload, people)
+        ledger, batches = allocation_batches(payload, people)
+        for rows in batches:
+            count += len(rows)
+            if run is not None:
+                run.rows(rows)
+            yield json.dumps({"type": "rows", "rows": rows_to_dicts(rows)}) + "\n"
+        yield json.dumps({"type": "pivot", "pivot": build_pivot(ledger)}) + "\n"
+        summary = ledger.summary()
+        yield json.dumps({"type": "check", "check": summary_to_dicts(summary)}) + "\n"
+        if run is not None:
+            run.finish(summary, ledger.stats or None)
+            run = None
+        yield json.dumps({"type": "done", "rows": count, "solver": ledger.stats or None}) + "\n"
+    except Exception as exc:
+        yield json.dumps({"type": "error", "detail": str(exc)}) + "\n"
+    finally:
+        if run is not None:
+            run.abort()
+        record_rows("allocate", count)
+
+
+def allocation_batches(
+    payload: ComputeRequest,
+    people: List[PersonInput],
+) -> Tuple[DemandLedger, Iterator[List[AllocationTuple]]]:
+    if payload.engine == "greedy" and not payload.merge_chunks:
+        ledger = DemandLedger(demand_table(NETWORKS, payload.year, payload.month))
+        batches = iter_allocation(
+            people,
+            NETWORKS,
+            ledger,
+            payload.consume_all_hours,
+            payload.medico_total,
+            COMPUTE_STREAM_ROWS,
+        )
+        return ledger, batches
+    allocations, ledger = select_engine(payload.engine, payload.compare_greedy)(
+        people, NETWORKS, payload.year, payload.month, payload.consume_all_hours, payload.medico_total
+    )
+    if payload.merge_chunks:
+        # Merging by key needs every row, so only unmerged greedy runs stream incrementally.
+        allocations = allocations.merged()
+    rows = allocations.rows()
+    return ledger, iter(lambda: list(islice(rows, COMPUTE_STREAM_ROWS)), [])
+
+
+def build_batch_jobs(payload: BatchComputeRequest) -> List[tuple[int, int, List[PersonInput]]]:
+    jobs = []
+    for job in payload.jobs:
+        validate_period(job.year, job.month)
+        validate_people(job.people)
+        jobs.append((job.year, job.month, build_people(job.people)))
+
+    bounds = (payload.start_year, payload.start_month, payload.end_year, payload.end_month)
+    if any(value is not None for value in bounds):
+        if any(value is None for value in bounds):
+            raise HTTPException(status_code=400, detail="Incomplete month range")
+        validate_period(payload.start_year, payload.start_month)
+        validate_period(payload.end_year, payload.end_month)
+        validate_people(payload.people)
+        people = build_people(payload.people)
+        for year, month in month_range(*bounds):
+            jobs.append((year, month, people))
+    return jobs
+
+
+async def stream_batch(jobs: List[tuple[int, int, List[PersonInput]]], payload: BatchComputeRequest):
+    async def run(year: int, month: int, people: List[PersonInput]) -> dict:
+        try:
+            return await executors.run_process(
+                "month",
+                run_month,
+                people,
+                NETWORKS,
+                year,
+                month,
+                payload.consume_all_hours,
+                payload.medico_total,
+                payload.engine,
+            )
+        except Exception as exc:
+            return {"year": year, "month": month, "error": str(exc)}
+
+    aggregate = BatchAggregate()
+    for finished in asyncio.as_completed([run(*job) for job in jobs]):
+        result = await finished
+        if "error" in result:
+            aggregate.failed += 1
+            yield json.dumps({"type": "error", **result}) + "\n"
+            continue
+        aggregate.add(result)
+        yield json.dumps({"type": "month", **result}) + "\n"
+    yield json.dumps({"type": "aggregate", **aggregate.to_dict()}) + "\n"
+
+
+def build_compute_response(
+    allocations: AllocationTable,
+    ledger: DemandLedger,
+    result_hash: Optional[str] = None,
+) -> ComputeResponse:
+    with stage("pivot"):
+        pivot = build_pivot(ledger)
+    return ComputeResponse(
+        consuntivo=allocations_to_dicts(allocations),
+        pivot=pivot,
+        check=summary_to_dicts(ledger.summary()),
+        result_hash=result_hash,
+        solver=ledger.stats or None,
     )
 
 
-def build_pivot(consuntivo: List[dict]) -> List[dict]:
-    pivot: dict[tuple[str, str], float] = {}
-    for row in consuntivo:
-        key = (row["Rete"], row["Ruolo"]) if "Rete" in row else (row["network"], row["role"])
-        hours = row.get("Ore") or row.get("hours") or 0
-        pivot[key] = pivot.get(key, 0) + hours
-
-    output = []
-    for (network, role), hours in pivot.items():
-        output.append({"network": network, "role": role, "hours": hours})
-    return output
+def encode_compute(
+    allocations: AllocationTable,
+    ledger: DemandLedger,
+    result_hash: Optional[str],
+    media_type: str,
+) -> bytes:
+    if media_type == JSON:
+        return build_compute_response(allocations, ledger, result_hash).model_dump_json().encode()
+    if media_type == MSGPACK:
+        return encode_msgpack(columnar_result(allocations, ledger, result_hash, binary=True))
+    return encode_json(columnar_result(allocations, ledger, result_hash))
+
+
+def negotiate_compute(accept: Optional[str]) -> str:
+    if not accept:
+        return JSON
+    offers = [JSON, COLUMNAR_JSON, NDJSON]
+    if msgpack_available():
+        offers.append(MSGPACK)
+    ranked = []
+    for position, part in enumerate(accept.split(",")):
+        media, _, params = part.partition(";")
+        quality = 1.0
+        for param in params.split(";"):
+            name, _, value = param.partition("=")
+            if name.strip() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if quality > 0:
+            ranked.append((-quality, position, media.strip().lower()))
+    requested = [media for _quality, _position, media in sorted(ranked)]
+    for media in requested:
+        if media in ("*/*", "application/*"):
+            return JSON
+        if media == "application/msgpack":
+            media = MSGPACK
+        if media in offers:
+            return media
+    if MSGPACK in requested or "application/msgpack" in requested:
+        raise HTTPException(status_code=406, detail="MessagePack support is not installed", headers=VARY_ACCEPT)
+    raise HTTPException(status_code=406, detail=f"Supported formats: {', '.join(offers)}", headers=VARY_ACCEPT)
+
+
+def build_pivot(ledger: DemandLedger) -> List[dict]:
+    return ledger.pivot()
+
+
+def validate_period(year: int, month: int) -> None:
+    if year < FIRST_YEAR or year > LAST_YEAR:
+        raise HTTPException(status_code=400, detail="Invalid year")
+    if month < 1 or month > 12:
+        raise HTTPException(status_code=400, detail="Invalid month")
 
 
 def validate_people(people: List[PersonPayload]) -> None:
@@ -178,7 +994,7 @@ def validate_people(people: List[PersonPayload]) -> None:
             person.forfait_total,
         ]
         for value in values:
-            if value < 0 or value != value:
+            if not math.isfinite(value) or value < 0:
                 raise HTTPException(status_code=400, detail="Invalid numeric values")
 
 
@@ -187,4 +1003,9 @@ if __name__ == "__main__":
         import uvicorn
     except ImportError:
         raise SystemExit("Uvicorn not installed. Run: pip install -r requirements.txt")
-    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
+    if "--production" in sys.argv:
+        import serve
+
+        serve.main(sys.modules[__name__])
+    else:
+        uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
@@ -0,0 +1,181 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+
+def canonical_hash(data: Any) -> str:
+    encoded = json.dumps(data, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+# Values are shared between callers and must be treated as read-only. The disk tier
+# unpickles its files, so the directory must only be writable by this service.
+class ResultCache:
+    def __init__(
+        self,
+        max_entries: int = 256,
+        ttl: float = 3600.0,
+        directory: Optional[Path] = None,
+        max_disk_bytes: int = 256 * 1024 * 1024,
+    ) -> None:
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.directory = directory
+        self.max_disk_bytes = max_disk_bytes
+        self._entries: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._disk: "OrderedDict[Path, int]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.disk_size = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.disk_evictions = 0
+        if directory is not None:
+            directory.mkdir(parents=True, exist_ok=True)
+            for path in directory.glob("*.tmp"):
+                path.unlink(missing_ok=True)
+            for path in sorted(directory.glob("*.pkl"), key=lambda item: item.stat().st_mtime):
+                self._disk[path] = path.stat().st_size
+                self.disk_size += self._disk[path]
+            with self._lock:
+                self._trim_disk()
+
+    @classmethod
+    def from_env(cls, storage_dir: Path) -> "ResultCache":
+        directory = storage_dir / "results" if os.getenv("RESULT_CACHE_DISK", "0") == "1" else None
+        return cls(
+            max_entries=int(os.getenv("RESULT_CACHE_ENTRIES", 256)),
+            ttl=float(os.getenv("RESULT_CACHE_TTL", 3600)),
+            directory=directory,
+            max_disk_bytes=int(os.getenv("RESULT_CACHE_DISK_MAX_BYTES", 256 * 1024 * 1024)),
+        )
+
+    def _path(self, key: str) -> Path:
+        return self.directory / f"{key}.pkl"
+
+    def get(self, key: str) -> Optional[Any]:
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                stored_at, value = entry
+                if now - stored_at <= self.ttl:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+                self.evictions += 1
+
+        value = self._load(key, now)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self._store(key, value, now)
+        return value
+
+    def put(self, key: str, value: Any) -> None:
+        now = time.time()
+        with self._lock:
+            self._store(key, value, now)
+        if self.directory is None:
+            return
+        data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        if len(data) > self.max_disk_bytes:
+            return
+        path = self._path(key)
+        tmp = path.with_suffix(".tmp")
+        try:
+            tmp.write_bytes(data)
+            tmp.replace(path)
+        except OSError:
+            tmp.unlink(missing_ok=True)
+            return
+        with self._lock:
+            self._forget(path)
+            self._disk[path] = len(data)
+            self.disk_size += len(data)
+            self._trim_disk()
+
+    def _trim_disk(self) -> None:
+        while self.disk_size > self.max_disk_bytes and self._disk:
+            victim, size = self._disk.popitem(last=False)
+            self.disk_size -= size
+            self.disk_evictions += 1
+            victim.unlink(missing_ok=True)
+
+    def _forget(self, path: Path) -> None:
+        size = self._disk.pop(path, None)
+        if size is not None:
+            self.disk_size -= size
+
+    def _store(self, key: str, value: Any, now: float) -> None:
+        self._entries[key] = (now, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def _load(self, key: str, now: float) -> Optional[Any]:
+        if self.directory is None:
+            return None
+        path = self._path(key)
+        try:
+            stat = path.stat()
+            if now - stat.st_mtime > self.ttl:
+                path.unlink(missing_ok=True)
+                with self._lock:
+                    self._forget(path)
+                return None
+            data = path.read_bytes()
+        except OSError:
+            return None
+        try:
+            value = pickle.loads(data)
+        except Exception:
+            # Written by an older build whose classes no longer match.
+            path.unlink(missing_ok=True)
+            with self._lock:
+                self._forget(path)
+            return None
+        with self._lock:
+            self._forget(path)
+            self._disk[path] = stat.st_size
+            self.disk_size += stat.st_size
+        return value
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+        if self.directory is not None:
+            for path in self.directory.glob("*.pkl"):
+                path.unlink(missing_ok=True)
+            with self._lock:
+                self._disk.clear()
+                self.disk_size = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl": self.ttl,
+                "disk": self.directory is not None,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "disk_bytes": self.disk_size,
+                "max_disk_bytes": self.max_disk_bytes,
+                "disk_evictions": self.disk_evictions,
+            }
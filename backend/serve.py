@@ -0,0 +1,129 @@
+from __future__ import annotations
+
+import gc
+import logging
+import os
+import signal
+import socket
+import time
+from typing import Dict
+
+import uvicorn
+
+logger = logging.getLogger("cas.serve")
+
+
+def bind_socket(host: str, port: int, backlog: int = 2048) -> socket.socket:
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+def spawn_worker(app, sock: socket.socket) -> int:
+    pid = os.fork()
+    if pid:
+        return pid
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    code = 0
+    try:
+        config = uvicorn.Config(app, log_level=os.getenv("LOG_LEVEL", "info"))
+        uvicorn.Server(config).run(sockets=[sock])
+    except BaseException:
+        logger.exception("worker %d crashed", os.getpid())
+        code = 1
+    finally:
+        os._exit(code)
+
+
+class RespawnBackoff:
+    # A worker that dies before min_uptime counts as a crash; consecutive
+    # crashes double the delay before the next respawn, up to max_delay.
+    def __init__(self, min_uptime: float = 10.0, base_delay: float = 0.5, max_delay: float = 30.0) -> None:
+        self.min_uptime = min_uptime
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.crashes = 0
+
+    @classmethod
+    def from_env(cls) -> "RespawnBackoff":
+        return cls(
+            min_uptime=float(os.getenv("RESPAWN_MIN_UPTIME", 10.0)),
+            max_delay=float(os.getenv("RESPAWN_MAX_DELAY", 30.0)),
+        )
+
+    def delay(self, uptime: float) -> float:
+        if uptime >= self.min_uptime:
+            self.crashes = 0
+            return 0.0
+        self.crashes += 1
+        return min(self.max_delay, self.base_delay * 2 ** (self.crashes - 1))
+
+
+def main(app_module=None) -> None:
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(message)s")
+    started = time.perf_counter()
+
+    if app_module is None:
+        import main as app_module
+
+    imported = time.perf_counter()
+    app_module.warm_up()
+    warmed = time.perf_counter()
+
+    host = os.getenv("HOST", "0.0.0.0")
+    port = int(os.getenv("PORT", 8000))
+    count = int(os.getenv("WEB_CONCURRENCY", os.cpu_count() or 1))
+    sock = bind_socket(host, port)
+
+    gc.collect()
+    gc.freeze()
+    workers: Dict[int, float] = {spawn_worker(app_module.app, sock): time.monotonic() for _ in range(count)}
+    logger.info(
+        "cold start %.1fms (import %.1fms, warm-up %.1fms), %d workers on %s:%d",
+        (time.perf_counter() - started) * 1000,
+        (imported - started) * 1000,
+        (warmed - imported) * 1000,
+        count,
+        host,
+        port,
+    )
+
+    stopping = False
+
+    def stop(signum, frame) -> None:
+        nonlocal stopping
+        stopping = True
+        for pid in list(workers):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    backoff = RespawnBackoff.from_env()
+    while workers:
+        try:
+            pid, _status = os.wait()
+        except ChildProcessError:
+            break
+        spawned = workers.pop(pid, None)
+        if stopping or spawned is None:
+            continue
+        delay = backoff.delay(time.monotonic() - spawned)
+        logger.warning("worker %d exited, starting a new one in %.1fs", pid, delay)
+        deadline = time.monotonic() + delay
+        while not stopping and time.monotonic() < deadline:
+            time.sleep(max(0.0, min(0.2, deadline - time.monotonic())))
+        if not stopping:
+            workers[spawn_worker(app_module.app, sock)] = time.monotonic()
+    sock.close()
+
+
+if __name__ == "__main__":
+    main()
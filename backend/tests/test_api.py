@@ -0,0 +1,606 @@
+import asyncio
+import io
+import json
+import pstats
+import subprocess
+import sys
+import tempfile
+import threading
+import types
+import zipfile
+from pathlib import Path
+
+import pytest
+from fastapi.testclient import TestClient
+from openpyxl import Workbook, load_workbook
+
+import main
+from core.allocation import ROLE_DEFAULTS
+from core.excel_export import build_export_zip
+from core.models import PersonInput
+from core.pdf import PageTextCache, ocr_pages
+from executors import ExecutorLayer
+from export_cache import ExportCache
+from history import RunHistory
+from instrumentation import InstrumentationMiddleware, SlowRequestProfiler, request_profile
+from result_cache import ResultCache
+from serve import RespawnBackoff
+
+client = TestClient(main.app)
+
+
+@pytest.fixture(autouse=True)
+def no_history(monkeypatch):
+    monkeypatch.setattr(main, "history", RunHistory(None))
+
+PAYLOAD = {
+    "year": 2025,
+    "month": 3,
+    "people": [
+        {"name": "Mario Rossi", "ore_ordinarie": 80, "costo_orario": 15, "roles": ["OS", "OG"]},
+        {"name": "Anna Bianchi", "ore_ordinarie": 40, "ore_reperibilita": 16, "costo_orario": 12, "roles": ["OG"]},
+    ],
+}
+
+
+def test_compute_reports_stage_timings():
+    response = client.post("/compute", json=PAYLOAD)
+    assert response.status_code == 200
+    timing = response.headers["Server-Timing"]
+    for name in ["validate", "aliases", "allocate", "pivot", "serialize", "total"]:
+        assert f"{name};dur=" in timing
+    assert 'allocate;dur=' in timing and 'desc="rows=' in timing
+    body = response.json()
+    assert {row["role"] for row in body["consuntivo"]} >= {"OS", "REPERIBILITA"}
+
+
+def test_optimal_engine_reports_solver_stats():
+    body = client.post("/compute", json={**PAYLOAD, "engine": "optimal"}).json()
+    assert {"solve_ms", "shortfall_hours", "cells_off"} <= set(body["solver"])
+    assert "gap_hours" not in body["solver"]
+    body = client.post("/compute", json={**PAYLOAD, "engine": "optimal", "compare_greedy": True}).json()
+    assert body["solver"]["gap_hours"] >= 0
+    assert {"solve_ms", "greedy_ms", "greedy_shortfall_hours"} <= set(body["solver"])
+    assert client.post("/compute", json=PAYLOAD).json()["solver"] is None
+
+
+def test_saturated_executor_returns_503():
+    main.executors.acquire(main.executors.max_pending)
+    try:
+        response = client.post("/parse-text", json={"text": "Nome: Mario Rossi"})
+    finally:
+        main.executors.release(main.executors.max_pending)
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == str(main.executors.retry_after)
+
+
+def test_streaming_admission_is_released_when_the_stream_never_starts():
+    async def receive():
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        raise OSError("client gone")
+
+    started = main.executors.pending
+    response = main.AdmittedStreamingResponse(iter(["never"]), main.executors.max_pending * 2)
+    assert main.executors.pending == main.executors.max_pending
+    with pytest.raises(Exception):
+        asyncio.run(response({"type": "http"}, receive, send))
+    assert main.executors.pending == started
+
+
+def test_compute_results_are_cached_by_request_hash(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "result_cache", ResultCache(max_entries=4, directory=tmp_path / "results"))
+    first = client.post("/compute", json=PAYLOAD).json()
+    second = client.post("/compute", json=PAYLOAD).json()
+    assert first["result_hash"] == second["result_hash"]
+    stats = client.get("/cache/stats").json()
+    assert stats["misses"] == 1 and stats["hits"] == 1
+
+    main.result_cache._entries.clear()
+    assert main.result_cache.get(first["result_hash"]) is not None
+    assert main.result_cache.stats()["disk_hits"] == 1
+
+
+def test_result_cache_disk_tier_evicts_least_recently_used(tmp_path):
+    cache = ResultCache(max_entries=1, directory=tmp_path, max_disk_bytes=250)
+    for key in ["a", "b"]:
+        cache.put(key, "x" * 100)
+    cache.get("a")
+    cache.put("c", "x" * 100)
+    assert sorted(path.stem for path in tmp_path.glob("*.pkl")) == ["a", "c"]
+    assert cache.stats()["disk_evictions"] == 1
+    assert ResultCache(directory=tmp_path, max_disk_bytes=150).stats()["disk_bytes"] <= 150
+
+
+def test_result_cache_drops_entries_that_no_longer_unpickle(tmp_path):
+    (tmp_path / "old.pkl").write_bytes(b"cremoved_module\nAllocationTable\n.")
+    cache = ResultCache(directory=tmp_path)
+    assert cache.get("old") is None
+    assert not (tmp_path / "old.pkl").exists() and cache.stats()["disk_bytes"] == 0
+
+
+def test_request_hash_tracks_allocation_rules(monkeypatch):
+    request = main.ComputeRequest(**PAYLOAD)
+    people = main.build_people(request.people)
+    key = main.request_hash(request, people)
+    monkeypatch.setitem(ROLE_DEFAULTS["OG"], "fallback", "OS")
+    rules_key = main.request_hash(request, people)
+    monkeypatch.setattr(main, "ALLOCATION_VERSION", main.ALLOCATION_VERSION + 1)
+    assert len({key, rules_key, main.request_hash(request, people)}) == 3
+
+
+def test_parse_text_streams_ndjson_for_raw_upload(monkeypatch):
+    text = "BUSTA PAGA 1\nNome: Mario Rossi\nOre ordinarie: 10\nBUSTA PAGA 2\nNome: MARIO ROSSI\nOre ordinarie: 5\n"
+    chunks = (text[pos : pos + 9].encode() for pos in range(0, len(text), 9))
+    response = client.post("/parse-text", content=chunks, headers={"Content-Type": "text/plain"})
+    frames = [json.loads(line) for line in response.text.splitlines()]
+    assert frames[-1] == {"type": "done", "count": 1}
+    assert [frame["ore_ordinarie"] for frame in frames[:-1]] == [15]
+    assert main.executors.pending == 0
+
+    monkeypatch.setattr(main, "PARSE_BATCH_BYTES", 1)
+    chunks = (text[pos : pos + 9].encode() for pos in range(0, len(text), 9))
+    response = client.post("/parse-text", content=chunks, headers={"Content-Type": "text/plain"})
+    frames = [json.loads(line) for line in response.text.splitlines()]
+    assert [frame["ore_ordinarie"] for frame in frames[:-1]] == [10, 15]
+
+    main.executors.acquire(main.executors.max_pending)
+    try:
+        busy = client.post("/parse-text", content=text.encode(), headers={"Content-Type": "text/plain"})
+    finally:
+        main.executors.release(main.executors.max_pending)
+    assert busy.status_code == 503
+
+    response = client.post("/parse-text", json={"text": text})
+    assert response.json()["people"][0]["ore_ordinarie"] == 15
+
+
+def _make_pdf(pages):
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>", None, "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for lines in pages:
+        body = "BT /F1 11 Tf 50 780 Td 14 TL " + " ".join(f"({line}) '" for line in lines) + " ET"
+        objects.append(f"<< /Length {len(body)} >>\nstream\n{body}\nendstream")
+        objects.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] /Resources << /Font << /F1 3 0 R >> >> /Contents {len(objects)} 0 R >>"
+        )
+        kids.append(f"{len(objects)} 0 R")
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {len(kids)} >>"
+    out = b"%PDF-1.4\n"
+    offsets = []
+    for idx, obj in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += f"{idx} 0 obj\n{obj}\nendobj\n".encode()
+    xref = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    out += "".join(f"{offset:010d} 00000 n \n" for offset in offsets).encode()
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+    return out
+
+
+def test_parse_pdf_extracts_pages_and_caches_text(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "pdf_text_cache", PageTextCache(tmp_path))
+    data = _make_pdf(
+        [
+            ["BUSTA PAGA 1", "Nome: Mario Rossi", "Ore ordinarie: 10"],
+            ["BUSTA PAGA 2", "Nome: MARIO ROSSI", "Ore ordinarie: 5", "Ruolo: OS"],
+        ]
+    )
+    files = {"file": ("buste.pdf", data, "application/pdf")}
+    first = client.post("/parse-pdf", files=files).json()
+    assert first["pages"] == 2 and first["cached_pages"] == 0
+    assert first["people"] == [
+        {
+            "name": "MARIO ROSSI",
+            "ore_ordinarie": 15.0,
+            "ore_straordinarie": 0.0,
+            "ore_reperibilita": 0.0,
+            "costo_orario": 0.0,
+            "roles": ["OS"],
+            "forfait_total": 0.0,
+        }
+    ]
+    second = client.post("/parse-pdf", files=files).json()
+    assert second["cached_pages"] == 2
+    assert second["people"] == first["people"]
+
+
+def test_ocr_runs_once_for_all_textless_pages(tmp_path, monkeypatch):
+    calls = []
+
+    def ocr(path, output, pages, sidecar, **kwargs):
+        calls.append(pages)
+        Path(sidecar).write_text("\f".join(f"pagina {idx}" for idx in range(10)), encoding="utf-8")
+
+    monkeypatch.setitem(sys.modules, "ocrmypdf", types.SimpleNamespace(ocr=ocr))
+    assert ocr_pages("scan.pdf", [2, 6, 8]) == {2: "pagina 2", 6: "pagina 6", 8: "pagina 8"}
+    assert calls == ["3,7,9"]
+    assert ocr_pages("scan.pdf", []) == {}
+
+
+def test_pdf_text_cache_evicts_least_recently_used_documents(tmp_path):
+    cache = PageTextCache(tmp_path, max_bytes=25)
+    cache.set_page_count("a", 1)
+    cache.put("a", 0, "x" * 10)
+    cache.set_page_count("b", 1)
+    cache.put("b", 0, "y" * 10)
+    assert cache.page_count("a") == 1
+    cache.set_page_count("c", 1)
+    cache.put("c", 0, "z" * 10)
+    assert cache.page_count("b") is None and cache.get("a", 0) == "x" * 10
+    assert cache.stats()["evictions"] == 1
+    assert PageTextCache(tmp_path, max_bytes=12).stats()["bytes"] <= 12
+
+
+def test_export_streams_zip_archive(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "TEMPLATE_DIR", tmp_path)
+    monkeypatch.setattr(main, "export_cache", ExportCache(tmp_path / "exports", max_bytes=0))
+    assert client.post("/export", json=PAYLOAD).status_code == 400
+
+    Workbook().save(tmp_path / "template.xlsx")
+    response = client.post("/export", json=PAYLOAD)
+    assert response.status_code == 200
+    with zipfile.ZipFile(io.BytesIO(response.content)) as archive:
+        assert archive.namelist() == [
+            "PROSPETTO_CONSUNTIVO_2025_03.xlsx",
+            "CAS-PROSPETTO_ORE_FORMAT_TEMPLATE_2025_03_NOLOCK.xlsx",
+        ]
+        consuntivo = load_workbook(io.BytesIO(archive.read("PROSPETTO_CONSUNTIVO_2025_03.xlsx")))
+    assert consuntivo.active.max_row > 1
+
+
+def test_parallel_export_matches_serial_build_in_deterministic_mode(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "TEMPLATE_DIR", tmp_path)
+    monkeypatch.setattr(main, "EXPORT_DETERMINISTIC", True)
+    monkeypatch.setattr(main, "export_cache", ExportCache(tmp_path / "exports", max_bytes=0))
+    Workbook().save(tmp_path / "template.xlsx")
+    first = client.post("/export", json=PAYLOAD).content
+    second = client.post("/export", json=PAYLOAD).content
+    assert first == second
+
+    request = main.ComputeRequest(**PAYLOAD)
+    _key, allocations, _ledger = main.run_allocation(request)
+    serial = build_export_zip(allocations, 2025, 3, tmp_path / "template.xlsx", deterministic=True)
+    assert first == serial
+
+
+def test_export_is_cached_on_disk_with_etag(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "TEMPLATE_DIR", tmp_path / "templates")
+    monkeypatch.setattr(main, "export_cache", ExportCache(tmp_path / "exports"))
+    main.TEMPLATE_DIR.mkdir()
+    Workbook().save(main.TEMPLATE_DIR / "template.xlsx")
+
+    assert client.post("/export", json=PAYLOAD, headers={"If-None-Match": "*"}).status_code == 200
+    main.export_cache.invalidate(main.export_cache.template_hash(main.TEMPLATE_DIR / "template.xlsx"))
+    first = client.post("/export", json=PAYLOAD)
+    etag = first.headers["ETag"]
+    assert etag.startswith('W/"') != main.EXPORT_DETERMINISTIC
+    second = client.post("/export", json=PAYLOAD)
+    assert second.headers["ETag"] == etag
+    assert second.content == first.content
+    assert main.export_cache.stats()["hits"] == 1
+
+    response = client.post("/export", json=PAYLOAD, headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert client.post("/export", json=PAYLOAD, headers={"If-None-Match": "*"}).status_code == 304
+
+    template = io.BytesIO()
+    workbook = Workbook()
+    workbook.active.title = "Copertina"
+    workbook.save(template)
+    files = {"template": ("template.xlsx", template.getvalue())}
+    assert client.post("/upload-template", files=files).status_code == 200
+    assert main.export_cache.stats()["entries"] == 0
+    assert client.post("/export", json=PAYLOAD).headers["ETag"] != etag
+
+
+def test_export_disconnect_before_first_chunk_leaves_nothing_on_disk(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "TEMPLATE_DIR", tmp_path)
+    monkeypatch.setattr(main, "export_cache", ExportCache(tmp_path / "exports"))
+    monkeypatch.setattr(tempfile, "tempdir", str(tmp_path / "work"))
+    (tmp_path / "work").mkdir()
+    Workbook().save(tmp_path / "template.xlsx")
+    body = json.dumps(PAYLOAD).encode()
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "POST",
+        "scheme": "http",
+        "path": "/export",
+        "raw_path": b"/export",
+        "query_string": b"",
+        "root_path": "",
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+        "client": ("test", 1),
+        "server": ("test", 80),
+    }
+
+    async def run():
+        messages = [{"type": "http.request", "body": body, "more_body": False}]
+
+        async def receive():
+            if messages:
+                return messages.pop(0)
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            if message["type"] == "http.response.start":
+                await asyncio.Event().wait()
+
+        await main.app(scope, receive, send)
+
+    asyncio.run(run())
+    assert list((tmp_path / "work").iterdir()) == []
+    assert list((tmp_path / "exports").glob("*/*")) == []
+    assert main.executors.pending == 0
+
+
+def test_export_key_tracks_allocation_rules_and_format(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "export_cache", ExportCache(tmp_path / "exports"))
+    Workbook().save(tmp_path / "template.xlsx")
+    request = main.ComputeRequest(**PAYLOAD)
+    people = main.build_people(request.people)
+    _template, key = main.export_key(request, people, tmp_path / "template.xlsx")
+    monkeypatch.setitem(ROLE_DEFAULTS["OS"], "chunk", 4.0)
+    _template, rules_key = main.export_key(request, people, tmp_path / "template.xlsx")
+    monkeypatch.setattr(main, "EXPORT_FORMAT_VERSION", main.EXPORT_FORMAT_VERSION + 1)
+    _template, format_key = main.export_key(request, people, tmp_path / "template.xlsx")
+    assert len({key, rules_key, format_key}) == 3
+
+
+def test_export_cache_evicts_least_recently_used(tmp_path):
+    cache = ExportCache(tmp_path, max_bytes=10)
+    for key in ["a", "b", "c"]:
+        writer = cache.writer("tpl", key)
+        writer.write(b"12345")
+        writer.commit()
+    assert cache.get("tpl", "a") is None
+    assert cache.get("tpl", "c") is not None
+    assert cache.stats()["evictions"] == 1
+    assert ExportCache(tmp_path, max_bytes=10).stats()["bytes"] == 10
+
+
+def test_export_dependencies_are_imported_lazily():
+    code = "import sys, main; print('openpyxl' in sys.modules)"
+    result = subprocess.run([sys.executable, "-c", code], cwd=Path(main.__file__).parent, capture_output=True)
+    assert result.stdout.strip() == b"False"
+
+
+def test_metrics_publish_request_and_stage_histograms():
+    client.post("/compute", json=PAYLOAD)
+    body = client.get("/metrics").text
+    assert 'cas_request_duration_seconds_count{method="POST",endpoint="/compute",status="200"}' in body
+    assert 'cas_stage_duration_seconds_bucket{stage="allocate",le="+Inf"}' in body
+    assert 'cas_stage_rows_count{stage="allocate"}' in body
+
+
+def worker_stage_for_profile():
+    return sum(range(1000))
+
+
+def test_slow_request_profiler_captures_worker_threads(tmp_path):
+    profiler = SlowRequestProfiler(tmp_path, threshold_ms=0.0, sample_rate=1.0)
+    profile = profiler.start()
+    layer = ExecutorLayer(thread_workers=2, process_workers=1, max_pending=4, retry_after=1)
+
+    async def run():
+        token = request_profile.set(profile)
+        try:
+            await layer.run_thread("allocate", worker_stage_for_profile)
+        finally:
+            request_profile.reset(token)
+
+    asyncio.run(run())
+    layer.shutdown()
+    assert profiler.finish(profiler.start(), 0.25, "POST /compute") is None
+    path = profiler.finish(profile, 0.25, "POST /compute")
+    assert path.exists() and path.name.endswith("POST_compute-250ms.prof")
+    functions = {name for _file, _line, name in pstats.Stats(str(path)).stats}
+    assert "worker_stage_for_profile" in functions
+
+
+def test_profile_is_written_off_the_event_loop(tmp_path):
+    threads = []
+    loop_threads = []
+
+    class RecordingProfiler(SlowRequestProfiler):
+        def finish(self, profile, seconds, label):
+            threads.append(threading.current_thread())
+            return super().finish(profile, seconds, label)
+
+    async def app(scope, receive, send):
+        loop_threads.append(threading.current_thread())
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"ok"})
+
+    wrapped = InstrumentationMiddleware(app, RecordingProfiler(tmp_path, threshold_ms=0.0, sample_rate=1.0))
+    assert TestClient(wrapped).get("/").text == "ok"
+    assert len(threads) == 1 and threads[0] is not loop_threads[0]
+
+
+def test_session_patch_returns_only_changed_rows():
+    created = client.post("/sessions", json=PAYLOAD).json()
+    rows = created["consuntivo"]
+    person = {"name": "Luca Verdi", "ore_ordinarie": 20, "costo_orario": 14, "roles": ["OS"]}
+    response = client.patch(
+        f"/sessions/{created['session_id']}",
+        json={"operations": [{"op": "add", "index": 1, "person": person}, {"op": "remove", "index": 0}]},
+    )
+    assert response.status_code == 200
+    delta = response.json()
+    assert delta["version"] == 1
+    for splice in delta["consuntivo"]:
+        rows[splice["start"] : splice["start"] + splice["delete"]] = splice["rows"]
+
+    people = [person, PAYLOAD["people"][1]]
+    expected = client.post("/compute", json={**PAYLOAD, "people": people}).json()
+    assert rows == expected["consuntivo"] and delta["rows"] == len(rows)
+    changed = {(row["network"], row["role"]): row["hours"] for row in delta["pivot"]}
+    for row in expected["pivot"]:
+        assert changed.get((row["network"], row["role"]), row["hours"]) == row["hours"]
+
+    bad = client.patch(f"/sessions/{created['session_id']}", json={"operations": [{"op": "remove", "index": 9}]})
+    assert bad.status_code == 400
+    assert client.delete(f"/sessions/{created['session_id']}").status_code == 200
+    assert client.patch(f"/sessions/{created['session_id']}", json={"operations": []}).status_code == 404
+
+
+def test_compute_negotiates_columnar_and_msgpack(monkeypatch):
+    expected = client.post("/compute", json=PAYLOAD).json()
+    response = client.post("/compute", json=PAYLOAD, headers={"Accept": "application/vnd.cas.columnar+json"})
+    assert response.headers["content-type"] == "application/vnd.cas.columnar+json"
+    table = response.json()["consuntivo"]
+    names, networks, roles = (table["dictionaries"][field] for field in ("name", "network", "role"))
+    columns = zip(table["name"], table["network"], table["role"], table["hours"], table["cost_hour"], table["amount"])
+    rows = [
+        {
+            "name": names[name],
+            "network": networks[network],
+            "role": roles[role],
+            "hours": hours,
+            "cost_hour": cost_hour,
+            "amount": amount,
+        }
+        for name, network, role, hours, cost_hour, amount in columns
+    ]
+    assert rows == expected["consuntivo"]
+    assert response.json()["check"]["allocated"] == [row["allocated"] for row in expected["check"]]
+    assert response.headers["vary"] == "Accept"
+    assert client.post("/compute", json=PAYLOAD).headers["vary"] == "Accept"
+
+    rejected = client.post("/compute", json=PAYLOAD, headers={"Accept": "text/csv"})
+    assert rejected.status_code == 406 and rejected.headers["vary"] == "Accept"
+    monkeypatch.setattr(main, "msgpack_available", lambda: False)
+    fallback = client.post("/compute", json=PAYLOAD, headers={"Accept": "application/x-msgpack, */*;q=0.1"})
+    assert fallback.headers["content-type"] == "application/json"
+    assert client.post("/compute", json=PAYLOAD, headers={"Accept": "application/x-msgpack"}).status_code == 406
+
+
+def test_compute_streams_ndjson_rows_then_trailers(monkeypatch):
+    monkeypatch.setattr(main, "COMPUTE_STREAM_ROWS", 2)
+    for extra in ({}, {"merge_chunks": True}, {"engine": "vectorized"}):
+        payload = {**PAYLOAD, **extra}
+        expected = client.post("/compute", json=payload).json()
+        response = client.post("/compute", json=payload, headers={"Accept": "application/x-ndjson"})
+        assert response.headers["content-type"].startswith("application/x-ndjson")
+        assert response.headers["vary"] == "Accept"
+        frames = [json.loads(line) for line in response.text.splitlines()]
+        assert [frame["type"] for frame in frames[-3:]] == ["pivot", "check", "done"]
+        batches = [frame["rows"] for frame in frames if frame["type"] == "rows"]
+        assert len(batches) >= 3
+        rows = [row for batch in batches for row in batch]
+        assert rows == expected["consuntivo"] and frames[-1]["rows"] == len(rows)
+        assert frames[-3]["pivot"] == expected["pivot"] and frames[-2]["check"] == expected["check"]
+        assert main.executors.pending == 0
+
+
+def test_compute_upload_reads_csv_roster():
+    roster = "name;ore_ordinarie;ore_reperibilita;costo_orario;roles\nMario Rossi;80;;15;OS,OG\nAnna Bianchi;40;16;12;OG\n"
+    files = {"roster": ("rosa.csv", roster.encode("utf-8"), "text/csv")}
+    data = {"year": "2025", "month": "3"}
+    response = client.post("/compute-upload", files=files, data=data)
+    assert response.status_code == 200
+    expected = client.post("/compute", json=PAYLOAD).json()
+    assert response.json() == expected
+
+    bad = {"roster": ("rosa.csv", b"name;costo_orario\nMario;x\n", "text/csv")}
+    assert client.post("/compute-upload", files=bad, data=data).status_code == 400
+
+    main.executors.acquire(main.executors.max_pending)
+    try:
+        assert client.post("/compute-upload", files=files, data=data).status_code == 503
+    finally:
+        main.executors.release(main.executors.max_pending)
+
+
+def test_compute_rejects_non_finite_hours():
+    body = json.dumps(PAYLOAD).replace('"ore_ordinarie": 80', '"ore_ordinarie": 1e400')
+    response = client.post("/compute", content=body, headers={"Content-Type": "application/json"})
+    assert response.status_code == 400
+
+
+def test_history_answers_queries_from_latest_runs(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "history", RunHistory(tmp_path / "history.sqlite3", flush_interval=0.01))
+    first = client.post("/compute", json=PAYLOAD).json()
+    changed = {**PAYLOAD, "people": [{**PAYLOAD["people"][0], "ore_ordinarie": 60}, PAYLOAD["people"][1]]}
+    march = client.post("/compute", json=changed).json()
+    april = client.post("/compute", json={**PAYLOAD, "month": 4}, headers={"Accept": "application/x-ndjson"})
+    frames = [json.loads(line) for line in april.text.splitlines()]
+    april_rows = [row for frame in frames if frame["type"] == "rows" for row in frame["rows"]]
+    main.history.flush()
+
+    runs = client.get("/history/runs", params={"year": 2025}).json()["runs"]
+    assert main.history.stats()["runs"] == 3
+    assert [(run["month"], run["row_count"]) for run in runs] == [
+        (4, len(april_rows)),
+        (3, len(march["consuntivo"])),
+        (3, len(first["consuntivo"])),
+    ]
+
+    mario = client.get("/history/people/mario rossi").json()
+    assert mario["name"] == "MARIO ROSSI"
+    hours = {}
+    for month, rows in ((3, march["consuntivo"]), (4, april_rows)):
+        for row in rows:
+            if row["name"] == "MARIO ROSSI":
+                hours[month, row["role"]] = hours.get((month, row["role"]), 0) + row["hours"]
+    assert {(item["month"], item["role"]): item["hours"] for item in mario["months"]} == pytest.approx(hours)
+
+    ytd = client.get("/history/networks", params={"year": 2025, "month": 4}).json()
+    assert ytd["months"] == [3, 4]
+    amounts = {}
+    for row in march["consuntivo"] + april_rows:
+        amounts[row["network"]] = amounts.get(row["network"], 0) + row["amount"]
+    assert {item["network"]: item["amount"] for item in ytd["networks"]} == pytest.approx(amounts)
+
+    client.post("/compute", json=PAYLOAD, headers={"Accept": "application/x-ndjson"})
+    client.post("/compute", json=PAYLOAD)
+    main.history.flush()
+    runs = client.get("/history/runs", params={"year": 2025}).json()["runs"]
+    assert [(run["month"], run["row_count"], run["repeats"]) for run in runs] == [
+        (3, len(first["consuntivo"]), 2),
+        (4, len(april_rows), 0),
+        (3, len(march["consuntivo"]), 0),
+    ]
+    mario = client.get("/history/people/MARIO ROSSI", params={"year": 2025}).json()
+    march_hours = sum(item["hours"] for item in mario["months"] if item["month"] == 3)
+    assert march_hours == pytest.approx(sum(row["hours"] for row in first["consuntivo"] if row["name"] == "MARIO ROSSI"))
+
+    monkeypatch.setattr(main, "history", RunHistory(None))
+    assert client.get("/history/runs").status_code == 404
+
+
+def test_history_drops_when_full_and_discards_failed_runs(tmp_path):
+    people = [PersonInput("A", 10, 0, 0, 10, ["OS"], 0)]
+    row = ("A", "RETE1", "OS", 10.0, 10.0, 100.0)
+    history = RunHistory(tmp_path / "history.sqlite3", flush_interval=0.01, max_queue=1)
+    history._ensure_writer = lambda: None
+    run = history.start("full", 2025, 1, "greedy", True, 0.0, people)
+    run.rows([row])
+    run.finish([])
+    assert history.start("other", 2025, 2, "greedy", True, 0.0, people) is None
+    assert history.stats()["dropped"] == 2
+
+    del history._ensure_writer
+    history.max_queue = 16
+    broken = history.start("broken", 2025, 3, "greedy", True, 0.0, people)
+    broken.rows([row[:3]])
+    good = history.start("good", 2025, 3, "greedy", True, 0.0, people)
+    good.rows([row])
+    good.finish([])
+    broken.finish([])
+    history.flush()
+
+    assert [(item["result_hash"], item["row_count"]) for item in history.list_runs()] == [("good", 1)]
+    assert history._query("SELECT COUNT(*) FROM runs", ())[0][0] == 1
+    assert history._query("SELECT COUNT(*) FROM allocations", ())[0][0] == 1
+    assert history.stats()["errors"] == 1
+
+
+def test_respawn_backoff_grows_on_crash_loops_and_resets():
+    backoff = RespawnBackoff(min_uptime=10.0, base_delay=0.5, max_delay=2.0)
+    assert [backoff.delay(0.1) for _ in range(4)] == [0.5, 1.0, 2.0, 2.0]
+    assert backoff.delay(60.0) == 0.0
+    assert backoff.delay(0.1) == 0.5
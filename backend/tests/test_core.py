@@ -1,5 +1,36 @@
-from core.allocation import compute_demands, round_up_step
-from core.parsing import merge_people, parse_text_block
+import io
+import random
+import zipfile
+from array import array
+
+import pytest
+from openpyxl import Workbook, load_workbook
+
+from core.allocation import (
+    NETWORKS,
+    ROLE_DEFAULTS,
+    allocate_hours,
+    allocate_with_ledger,
+    allocations_to_dicts,
+    compute_allocated,
+    compute_demands,
+    demand_table,
+    round_up_step,
+    summary_to_dicts,
+)
+from core.batch import BatchAggregate, month_range, run_month
+from core.columnar import columnar_result, encode_msgpack
+from core.demand_heap import DemandHeap
+from core.session import AllocationSession
+from core.solver import allocate_optimal, solve_role_flows
+from core.ledger import DemandLedger
+from core.excel_export import build_consuntivo_excel, build_template_excel, template_sheets
+from core.models import AllocationTable, PersonInput
+from core.parsing import iter_parse_text, merge_people, parse_text_block
+from core.roster import RosterError, read_roster
+from core import vectorized
+from core.vectorized import allocate_hours_vectorized, allocate_vectorized_with_ledger
+from core.zip_stream import iter_zip_files
 
 
 def test_rounding_step():
@@ -24,3 +55,319 @@ def test_dedup_people():
     people = merge_people(parse_text_block(text))
     assert len(people) == 1
     assert people[0].ore_ordinarie == 15
+
+
+def _random_roster(seed, size):
+    rng = random.Random(seed)
+    role_sets = [["OG"], ["OS"], ["MEDIATORE"], ["OS", "OG"], ["MEDIATORE", "OG"], ["DIRETTORE"], []]
+    people = []
+    for idx in range(size):
+        people.append(
+            PersonInput(
+                name=f"PERSON {idx}",
+                ore_ordinarie=rng.choice([0, 7.5, 40, 80.5, 120, 163.3]),
+                ore_straordinarie=rng.choice([0, 0, 3.2, 12]),
+                ore_reperibilita=rng.choice([0, 0, 8, 20.5]),
+                costo_orario=rng.choice([12.5, 15.0, 18.75]),
+                roles=list(rng.choice(role_sets)),
+            )
+        )
+    return people
+
+
+def test_vectorized_engine_matches_greedy():
+    networks = ["RETE1", "RETE2", "RETE3", "RETE4", "RETE5"]
+    for seed in range(6):
+        for consume_all in (True, False):
+            people = _random_roster(seed, 40)
+            expected = allocate_hours(people, networks, 2025, 2 + seed, consume_all, 900.0)
+            actual = allocate_hours_vectorized(people, networks, 2025, 2 + seed, consume_all, 900.0)
+            assert allocations_to_dicts(actual[0]) == allocations_to_dicts(expected[0])
+            assert summary_to_dicts(actual[1]) == summary_to_dicts(expected[1])
+
+
+def test_vectorized_engine_uses_numpy_only_for_many_networks(monkeypatch):
+    calls = []
+    monkeypatch.setattr(vectorized, "allocate_vectorized_with_ledger", lambda *args: calls.append(len(args[1])))
+    people = _random_roster(3, 10)
+    vectorized.allocate_vectorized_engine(people, NETWORKS, 2025, 3)
+    vectorized.allocate_vectorized_engine(people, [f"RETE{idx}" for idx in range(60)], 2025, 3)
+    assert calls == [60]
+
+
+def test_ledger_matches_row_scan():
+    networks = ["RETE1", "RETE2", "RETE3"]
+    people = _random_roster(7, 25)
+    for engine in (allocate_with_ledger, allocate_vectorized_with_ledger):
+        rows, ledger = engine(people, networks, 2025, 3, False, 300.0)
+        for role, network in ledger.cells():
+            assert ledger.allocated(role, network) == compute_allocated(rows, role, network)
+        pivot = {(row["network"], row["role"]): row["hours"] for row in ledger.pivot()}
+        assert sum(pivot.values()) == sum(row.hours for row in rows)
+
+
+def test_demand_table_cache_follows_role_config():
+    first = demand_table(["RETE1"], 2024, 2)
+    assert demand_table(["RETE1"], 2024, 2) is first
+    with pytest.raises(TypeError):
+        first["OG"]["RETE1"] = 0.0
+    original = ROLE_DEFAULTS["OG"]["value"]
+    ROLE_DEFAULTS["OG"]["value"] = original + 1
+    try:
+        assert demand_table(["RETE1"], 2024, 2)["OG"]["RETE1"] == first["OG"]["RETE1"] + 29
+    finally:
+        ROLE_DEFAULTS["OG"]["value"] = original
+    assert demand_table(["RETE1"], 2024, 2) is first
+
+
+def test_allocation_table_merge_consecutive_chunks():
+    people = [PersonInput("MARIO ROSSI", 40, 0, 0, 10.0, ["OS"])]
+    rows, ledger = allocate_with_ledger(people, ["RETE1"], 2025, 1, True, 0.0)
+    merged = rows.merged()
+    os_rows = [row for row in merged if row.role == "OS"]
+    assert len(rows) > len(merged)
+    assert [(row.name, row.hours, row.amount) for row in os_rows] == [("MARIO ROSSI", 40.0, 400.0)]
+    assert sum(merged.hours) == sum(rows.hours)
+
+
+def test_allocation_table_merge_interleaved_rows():
+    rows = AllocationTable()
+    rows.append("ANNA", "RETE1", "OG", 2.0, 10.0, 20.0)
+    rows.append("ANNA", "RETE2", "OG", 1.0, 10.0, 10.0)
+    rows.append("ANNA", "RETE1", "OG", 3.0, 10.0, 30.0)
+    rows.append("ANNA", "RETE1", "OG", 1.0, 12.0, 12.0)
+    assert list(rows.merged().rows()) == [
+        ("ANNA", "RETE1", "OG", 5.0, 10.0, 50.0),
+        ("ANNA", "RETE2", "OG", 1.0, 10.0, 10.0),
+        ("ANNA", "RETE1", "OG", 1.0, 12.0, 12.0),
+    ]
+
+
+def test_batch_month_range_and_aggregate():
+    months = month_range(2024, 11, 2025, 2)
+    assert months == [(2024, 11), (2024, 12), (2025, 1), (2025, 2)]
+    people = _random_roster(3, 10)
+    aggregate = BatchAggregate()
+    results = [run_month(people, ["RETE1", "RETE2"], year, month) for year, month in months]
+    for result in results:
+        aggregate.add(result)
+    summary = aggregate.to_dict()
+    assert len(summary["months"]) == 4
+    assert summary["hours"] == sum(result["hours"] for result in results)
+    assert sum(cell["hours"] for cell in summary["cells"]) == summary["hours"]
+
+
+def test_streaming_parser_matches_full_parse():
+    text = "".join(
+        f"BUSTA PAGA {idx}\nNome: Persona {idx % 7}\nOre ordinarie: {idx}\nReperibilita: 2\n"
+        for idx in range(1, 60)
+    )
+    expected = merge_people(parse_text_block(text))
+    for size in (1, 7, 64, len(text)):
+        chunks = (text[pos : pos + size] for pos in range(0, len(text), size))
+        assert merge_people(iter_parse_text(chunks)) == expected
+
+
+def test_role_keywords_match_whole_words_only():
+    text = """
+    BUSTA PAGA 1
+    Nome: Mario Rossi
+    Costo orario: 12,50
+    Qualifica: Operatore Sociale
+    BUSTA PAGA 2
+    Nome: Anna Bianchi
+    Costo orario: 10
+    Ruolo: og / mediatore
+    """
+    people = parse_text_block(text)
+    assert people[0].roles == ["OS"]
+    assert people[0].costo_orario == 12.5
+    assert people[1].roles == ["OG", "MEDIATORE"]
+
+
+def test_consuntivo_excel_roundtrip():
+    rows, _ledger = allocate_with_ledger(_random_roster(2, 15), ["RETE1", "RETE2"], 2025, 4, True, 100.0)
+    rows.append("L'ACQUA & <CO>", "RETE1", "OG", 7.5, 10.0, 75.0)
+    with build_consuntivo_excel(rows, 2025, 4) as output:
+        sheet = load_workbook(output)["Consuntivo"]
+    values = list(sheet.iter_rows(values_only=True))
+    assert values[0] == ("Nominativo", "Rete", "Ruolo", "Ore", "Costo_orario", "Importo")
+    assert values[1:] == list(rows.rows())
+    assert sheet["A1"].font.b
+
+
+def test_template_export_partitions_rows_per_sheet(tmp_path):
+    template_path = tmp_path / "template.xlsx"
+    wb = Workbook()
+    wb.active.title = "CIG1"
+    wb.active.append(["stale"])
+    wb.save(template_path)
+
+    rows, _ledger = allocate_with_ledger(_random_roster(4, 20), NETWORKS, 2025, 5, True, 0.0)
+    first = load_workbook(io.BytesIO(build_template_excel(rows, 2025, 5, template_path)))
+    second = load_workbook(io.BytesIO(build_template_excel(rows, 2025, 5, template_path)))
+    for sheet_name, networks in template_sheets(NETWORKS):
+        expected = [
+            (name, role, hours, cost_hour, amount)
+            for name, network, role, hours, cost_hour, amount in rows.rows()
+            if network in networks
+        ]
+        values = list(first[sheet_name].iter_rows(values_only=True))
+        assert values[1 : len(expected) + 1] == expected
+        assert values == list(second[sheet_name].iter_rows(values_only=True))
+
+
+def test_zip_stream_yields_bounded_chunks(tmp_path):
+    payload = random.Random(3).randbytes(300_000)
+    source = tmp_path / "blob.bin"
+    source.write_bytes(payload)
+    chunks = list(iter_zip_files([("blob.bin", str(source))], chunk_size=16 * 1024, compresslevel=1))
+    assert len(chunks) > 10
+    assert max(len(chunk) for chunk in chunks) < 64 * 1024
+    with zipfile.ZipFile(io.BytesIO(b"".join(chunks))) as archive:
+        assert archive.read("blob.bin") == payload
+
+
+def test_zip_stream_fixed_timestamps_keep_compresslevel(tmp_path):
+    source = tmp_path / "text.txt"
+    source.write_bytes(b"".join(b"riga %d del consuntivo\n" % idx for idx in range(20_000)))
+    sizes = []
+    for level in (1, 9):
+        parts = iter_zip_files([("text.txt", str(source))], compresslevel=level, date_time=(2025, 1, 1, 0, 0, 0))
+        data = b"".join(parts)
+        sizes.append(len(data))
+        with zipfile.ZipFile(io.BytesIO(data)) as archive:
+            assert archive.getinfo("text.txt").date_time == (2025, 1, 1, 0, 0, 0)
+    assert sizes[1] < sizes[0]
+
+
+def test_bench_suite_runs_every_stage_and_flags_regressions():
+    from bench.suite import STAGES, compare, environment_mismatch, run_suite
+
+    current = run_suite([(10, 5, "mixed")], repeat=1)
+    assert sorted(current["results"]) == sorted(f"{stage}/p10-n5-mixed" for stage in STAGES)
+    assert current["results"]["parse/p10-n5-mixed"]["lines_per_sec"] > 0
+    assert environment_mismatch(current, current) == []
+
+    baseline = {"results": {key: dict(result) for key, result in current["results"].items()}}
+    assert environment_mismatch(baseline, current) == ["python", "machine", "platform"]
+    baseline["results"]["allocate/p10-n5-mixed"]["best"] /= 2
+    _rows, regressions = compare(baseline, current, threshold=0.5)
+    assert regressions == ["allocate/p10-n5-mixed"]
+
+
+def test_demand_heap_matches_max_with_first_index_ties():
+    rng = random.Random(5)
+    values = {f"RETE{idx}": rng.choice([0.0, 7.5, 15.0, 30.5]) for idx in range(40)}
+    heap = DemandHeap(values)
+    for _ in range(300):
+        assert heap.top() == max(values, key=values.get)
+        network = rng.choice(list(values))
+        values[network] = max(0.0, values[network] - rng.choice([0.5, 7.5, 8.0]))
+        heap.update(network, values[network])
+
+
+def test_ledger_set_remaining_keeps_heap_current():
+    ledger = DemandLedger({"OG": {"RETE1": 10.0, "RETE2": 5.0}})
+    assert ledger.neediest("OG") == "RETE1"
+    ledger.set_remaining("OG", "RETE1", 0.0)
+    assert ledger.neediest("OG") == "RETE2"
+    assert ledger.remaining["OG"] == {"RETE1": 0.0, "RETE2": 5.0}
+
+
+def test_optimal_engine_never_deviates_more_than_greedy():
+    networks = ["RETE1", "RETE2", "RETE3", "RETE4", "RETE5"]
+    for seed in range(6):
+        for consume_all in (True, False):
+            people = _random_roster(seed, 40)
+            rows, ledger = allocate_optimal(people, networks, 2025, 2 + seed, consume_all, 900.0, compare_greedy=True)
+            greedy_rows, _greedy = allocate_with_ledger(people, networks, 2025, 2 + seed, consume_all, 900.0)
+            assert ledger.stats["gap_hours"] >= -1e-6
+            for role, network in ledger.cells():
+                assert ledger.allocated(role, network) == pytest.approx(compute_allocated(rows, role, network))
+            if consume_all:
+                assert abs(sum(rows.hours) - sum(greedy_rows.hours)) <= 0.5 * len(people)
+
+
+def test_role_flows_fill_higher_priority_roles_first():
+    flows = solve_role_flows({("OG", "OS"): 10, ("OS",): 4}, {"OG": 6, "OS": 6})
+    assert flows[("OG", "OS")] == {"OG": 6, "OS": 2}
+    assert flows[("OS",)] == {"OS": 4}
+
+
+def test_session_edits_match_full_recompute():
+    networks = ["RETE1", "RETE2", "RETE3"]
+    for seed, consume_all in ((1, True), (2, False), (3, False)):
+        rng = random.Random(seed)
+        people = _random_roster(seed, 30)
+        pool = _random_roster(seed + 100, 10)
+        session = AllocationSession(people, networks, 2025, 4, consume_all, 500.0, checkpoint_every=4)
+        rows = list(session.rows())
+        for step in range(12):
+            op = rng.choice(["add", "update", "remove"])
+            index = rng.randrange(len(people))
+            person = pool[step % len(pool)]
+            if op == "add":
+                people.insert(index, person)
+            elif op == "update":
+                people[index] = person
+            else:
+                people.pop(index)
+            delta = session.apply([(op, index, None if op == "remove" else person)])
+            for start, delete, new_rows in delta.splices:
+                rows[start : start + delete] = new_rows
+
+            expected, ledger = allocate_with_ledger(people, networks, 2025, 4, consume_all, 500.0)
+            assert rows == list(expected.rows()) == list(session.rows())
+            assert session.final.hours == ledger.hours
+            assert summary_to_dicts(session.final.summary()) == summary_to_dicts(ledger.summary())
+
+
+def test_columnar_msgpack_packs_numeric_columns_as_buffers():
+    msgpack = pytest.importorskip("msgpack")
+    table, ledger = allocate_with_ledger(_random_roster(4, 20), ["RETE1", "RETE2"], 2025, 5, True, 0.0)
+    decoded = msgpack.unpackb(encode_msgpack(columnar_result(table, ledger, binary=True)))
+    hours = array("d")
+    hours.frombytes(decoded["consuntivo"]["hours"])
+    assert hours == table.hours and decoded["consuntivo"]["length"] == len(table)
+
+
+def test_roster_csv_and_xlsx_build_the_same_people():
+    text = "Nominativo;Ore ordinarie;costo_orario;Ruoli\nMario Rossi;80,5;15;os, og\n;;;\nAnna Bianchi;40;12,25;OG\n"
+    people = read_roster(text.encode("utf-8"), "rosa.csv")
+    assert [(p.name, p.ore_ordinarie, p.costo_orario, p.roles) for p in people] == [
+        ("MARIO ROSSI", 80.5, 15.0, ["OS", "OG"]),
+        ("ANNA BIANCHI", 40.0, 12.25, ["OG"]),
+    ]
+
+    workbook = Workbook()
+    sheet = workbook.active
+    sheet.append(["nome", "ore_ordinarie", "costo_orario", "ruoli"])
+    sheet.append(["Mario Rossi", 80.5, 15, "OS OG"])
+    sheet.append(["Anna Bianchi", 40, 12.25, "OG"])
+    data = io.BytesIO()
+    workbook.save(data)
+    assert read_roster(data.getvalue(), "rosa.xlsx") == people
+
+    with pytest.raises(RosterError, match="rows 3"):
+        read_roster(b"name,ore_ordinarie\nA,1\nB,-2\n", "rosa.csv")
+    with pytest.raises(RosterError):
+        read_roster(b"name,costo_orario\nA,abc\n", "rosa.csv")
+    mixed = read_roster(b'name;ore_ordinarie\nA;1.5\nB;"2,5"\nC;1.234,5\n', "rosa.csv")
+    assert [person.ore_ordinarie for person in mixed] == [1.5, 2.5, 1234.5]
+    for value in (b"1.000", b"1,234.5"):
+        with pytest.raises(RosterError, match="Ambiguous"):
+            read_roster(b"name;ore_ordinarie\nA;" + value + b"\nB;2,5\n", "rosa.csv")
+    for value in (b"inf", b"1e400", b"nan"):
+        with pytest.raises(RosterError, match="rows 2"):
+            read_roster(b"name,ore_ordinarie\nA," + value + b"\n", "rosa.csv")
+    with pytest.raises(RosterError):
+        read_roster(b"", "rosa.pdf")
+    with pytest.raises(RosterError, match="Unknown roles FOO \\(rows 3\\)"):
+        read_roster(b"name,roles\nA,OS\nB,OG FOO\n", "rosa.csv")
+    with pytest.raises(RosterError, match="rows 5"):
+        read_roster(b"name,ore_ordinarie\nA,1\n\n,\nB,-2\n", "rosa.csv")
+    with pytest.raises(RosterError, match="Unknown roles FOO \\(rows 4\\)"):
+        read_roster(b"name,roles\n,\nA,OS\nB,OG FOO\n", "rosa.csv")
+    keywords = read_roster(b"name;ruoli\nA;Operatore sociale\nB;operatore generico, os\n", "rosa.csv")
+    assert [person.roles for person in keywords] == [["OS"], ["OG", "OS"]]
@@ -8,6 +8,7 @@ const API_BASE =
     : "";
 
 const ROLE_OPTIONS = ["DIRETTORE", "OS", "MEDIATORE", "OG"];
+const CONSUNTIVO_PREVIEW_ROWS = 200;
 
 const emptyPerson = () => ({
   id: crypto.randomUUID(),
@@ -19,12 +20,27 @@ const emptyPerson = () => ({
   roles: [],
 });
 
+const readNdjson = async (response, onFrame) => {
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = "";
+  while (true) {
+    const { done, value } = await reader.read();
+    buffer += decoder.decode(value || new Uint8Array(), { stream: !done });
+    const lines = buffer.split("\n");
+    buffer = lines.pop();
+    lines.filter((line) => line.trim()).forEach((line) => onFrame(JSON.parse(line)));
+    if (done) break;
+  }
+};
+
 const App = () => {
   const [year, setYear] = useState("");
   const [month, setMonth] = useState("");
   const [textInput, setTextInput] = useState("");
   const [people, setPeople] = useState([emptyPerson()]);
   const [templateFile, setTemplateFile] = useState(null);
+  const [rosterFile, setRosterFile] = useState(null);
   const [templateStatus, setTemplateStatus] = useState("");
   const [parseStatus, setParseStatus] = useState("");
   const [computeStatus, setComputeStatus] = useState("");
@@ -145,27 +161,72 @@ const App = () => {
     };
   };
 
+  const computeRequest = (path, headers) => {
+    if (!rosterFile) {
+      return fetch(`${API_BASE}/${path}`, {
+        method: "POST",
+        headers: { "Content-Type": "application/json", ...headers },
+        body: JSON.stringify(buildPayload()),
+      });
+    }
+    const formData = new FormData();
+    formData.append("roster", rosterFile);
+    formData.append("year", year);
+    formData.append("month", month);
+    formData.append("consume_all_hours", consumeAll);
+    formData.append("medico_total", Number(medicoTotal || 0));
+    return fetch(`${API_BASE}/${path}-upload`, { method: "POST", headers, body: formData });
+  };
+
   const handleCompute = async () => {
     setComputeStatus("");
     if (missingBasics.length) {
       setComputeStatus("Compila mese e anno.");
       return;
     }
-    const response = await fetch(`${API_BASE}/compute`, {
-      method: "POST",
-      headers: { "Content-Type": "application/json" },
-      body: JSON.stringify(buildPayload()),
-    });
+    const response = await computeRequest("compute", { Accept: "application/x-ndjson" });
     if (!response.ok) {
       const text = await response.text();
       setComputeStatus(text || "Errore calcolo");
       return;
     }
-    const data = await response.json();
-    setConsuntivo(data.consuntivo || []);
-    setPivot(data.pivot || []);
-    setCheck(data.check || []);
-    setComputeStatus("Calcolo completato.");
+    setConsuntivo([]);
+    setPivot([]);
+    setCheck([]);
+    const collected = [];
+    let progressFrame = 0;
+    let failed = "";
+    let completed = false;
+    await readNdjson(response, (frame) => {
+      if (frame.type === "rows") {
+        for (const row of frame.rows) collected.push(row);
+        if (!progressFrame) {
+          progressFrame = requestAnimationFrame(() => {
+            progressFrame = 0;
+            setComputeStatus(`Calcolo in corso: ${collected.length} righe...`);
+          });
+        }
+      } else if (frame.type === "pivot") {
+        setPivot(frame.pivot);
+      } else if (frame.type === "check") {
+        setCheck(frame.check);
+      } else if (frame.type === "done") {
+        completed = true;
+      } else if (frame.type === "error") {
+        failed = frame.detail;
+      }
+    }).catch((error) => {
+      failed = failed || error.message;
+    });
+    cancelAnimationFrame(progressFrame);
+    if (!completed) {
+      setPivot([]);
+      setCheck([]);
+      setComputeStatus(`Errore calcolo: ${failed || "risposta interrotta"}`);
+      return;
+    }
+    setConsuntivo(collected);
+    setComputeStatus(`Calcolo completato: ${collected.length} righe.`);
   };
 
   const handleExport = async () => {
@@ -174,11 +235,7 @@ const App = () => {
       setExportStatus("Carica il template Excel prima di esportare.");
       return;
     }
-    const response = await fetch(`${API_BASE}/export`, {
-      method: "POST",
-      headers: { "Content-Type": "application/json" },
-      body: JSON.stringify(buildPayload()),
-    });
+    const response = await computeRequest("export", {});
     if (!response.ok) {
       const text = await response.text();
       setExportStatus(text || "Errore export");
@@ -273,6 +330,20 @@ const App = () => {
             </button>
             {templateStatus && <p className="text-xs text-ink/60">{templateStatus}</p>}
           </div>
+          <div className="space-y-3">
+            <h3 className="font-semibold text-ink">Rosa da file (CSV/XLSX)</h3>
+            <input
+              type="file"
+              accept=".csv,.xlsx"
+              onChange={(event) => setRosterFile(event.target.files?.[0] || null)}
+              className="w-full px-4 py-3 rounded-xl border border-ink/10"
+            />
+            <p className="text-xs text-ink/60">
+              {rosterFile
+                ? `Calcolo ed export useranno ${rosterFile.name} al posto dei dati manuali.`
+                : "Colonne: name, ore_ordinarie, ore_straordinarie, ore_reperibilita, costo_orario, roles, forfait_total."}
+            </p>
+          </div>
         </div>
       </section>
 
@@ -464,6 +535,35 @@ const App = () => {
             </ul>
           </div>
         </div>
+        <div className="p-4 rounded-2xl bg-white/70">
+          <h3 className="font-semibold text-ink">Consuntivo ({consuntivo.length} righe)</h3>
+          {consuntivo.length === 0 ? (
+            <p className="mt-3 text-sm text-ink/70">Nessun dato.</p>
+          ) : (
+            <table className="mt-3 w-full text-sm text-ink/70">
+              <thead>
+                <tr className="text-left">
+                  <th>Nome</th>
+                  <th>Rete</th>
+                  <th>Ruolo</th>
+                  <th>Ore</th>
+                  <th>Importo</th>
+                </tr>
+              </thead>
+              <tbody>
+                {consuntivo.slice(0, CONSUNTIVO_PREVIEW_ROWS).map((row, idx) => (
+                  <tr key={idx}>
+                    <td>{row.name}</td>
+                    <td>{row.network}</td>
+                    <td>{row.role}</td>
+                    <td>{row.hours}</td>
+                    <td>{row.amount.toFixed(2)}</td>
+                  </tr>
+                ))}
+              </tbody>
+            </table>
+          )}
+        </div>
       </section>
 
       <section className="glass panel p-6 md:p-8 space-y-6 reveal">